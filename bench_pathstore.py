@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""
+Memory benchmark for path_store.py
+Builds the same synthetic full-archive file index (CMIP5 DRS paths
+under the badc root, a few files per variable directory) once as a
+plain list of strings and once as a PathStore, each in a fresh python
+process, and reports the peak resident memory and build time of both
+as well as the time to rebuild all the paths from the store.
+With --run it writes the same index as empty files under a directory
+and times a whole cmip5datafinder.py run over it instead (peak memory
+of the run, so the store is measured together with everything the
+run keeps per file).
+
+Example run:
+python bench_pathstore.py --files 1000000
+python bench_pathstore.py --files 50000 --run /tmp/benchtree
+"""
+# -------------------------------------------------------------------------
+#      Setup.
+# -------------------------------------------------------------------------
+
+# ---- Import standard modules to the python path.
+import sys, os, getopt, time, resource
+import subprocess
+
+__author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
+
+ROOT = '/badc/cmip5/data/cmip5/output1/'
+VARIABLES = ['tas', 'pr', 'ta', 'ua', 'va', 'hus', 'zg', 'tro3', 'clt', 'rsut',
+             'rlut', 'psl', 'huss', 'tasmax', 'tasmin', 'evspsbl']
+EXPERIMENTS = ['historical', 'rcp26', 'rcp45', 'rcp85', 'amip', 'piControl']
+
+# ---- Function usage.
+def usage():
+  msg = """\
+Memory benchmark of a PathStore against a list of path strings
+
+Usage:
+  bench_pathstore.py [options]
+  -h, --help                  Display this message and exit
+  --files <N>                 Number of file paths in the index (default 1000000)
+  --run <DIR>                 Write the index as empty files under DIR and time a full
+                              cmip5datafinder.py run over it (DIR is reused if it holds N files)
+  --finder <script>           cmip5datafinder.py to run with --run (default the one next to this
+                              file), e.g. an older copy to compare against
+"""
+  print >> sys.stderr, msg
+
+def archive_paths(nfiles, root=ROOT):
+    """
+    generator over nfiles synthetic CMIP5 paths, e.g.
+    /badc/cmip5/data/cmip5/output1/INST3/MODEL12/rcp45/mon/atmos/Amon/r2i1p1/latest/tas/tas_Amon_MODEL12_rcp45_r2i1p1_200601-201012.nc
+    """
+    n = 0
+    model = 0
+    while True:
+        inst = 'INST%i' % (model // 2)
+        mname = 'MODEL%i' % model
+        for exp in EXPERIMENTS:
+            for ens in ['r1i1p1', 'r2i1p1', 'r3i1p1']:
+                for var in VARIABLES:
+                    drs = root + '/'.join([inst, mname, exp, 'mon', 'atmos', 'Amon', ens, 'latest', var])
+                    for year in range(1850, 2010, 5):
+                        if n == nfiles:
+                            return
+                        name = '_'.join([var, 'Amon', mname, exp, ens, '%i01-%i12.nc' % (year, year + 4)])
+                        yield drs + '/' + name
+                        n += 1
+        model += 1
+
+def peak_mb():
+    # peak resident memory of this process
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def child(kind, nfiles):
+    """
+    builds the index as kind (list or store) and prints
+    peak memory (MB) before and after, and the timings
+    """
+    base = peak_mb()
+    t0 = time.time()
+    if kind == 'list':
+        index = list(archive_paths(nfiles))
+    else:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from path_store import PathStore
+        index = PathStore(archive_paths(nfiles))
+    t1 = time.time()
+    peak = peak_mb()
+    nchars = 0
+    for p in index:
+        nchars += len(p)
+    t2 = time.time()
+    print('%s %i %.1f %.1f %.2f %.2f %i' % (kind, len(index), base, peak, t1 - t0, t2 - t1, nchars))
+
+def full_run(nfiles, tree, finder):
+    """
+    writes nfiles empty files under tree/output1 and a param file
+    asking for all of them, runs finder on it in tree/work and
+    prints the wall time and peak memory of the run
+    """
+    root = os.path.join(os.path.abspath(tree), 'output1') + '/'
+    work = os.path.join(os.path.abspath(tree), 'work')
+    # the final cache is named after the param file, so it is given relative to work
+    params = os.path.join(work, 'params.txt')
+    stamp = os.path.join(os.path.abspath(tree), 'files.txt')
+    if not os.path.isfile(stamp) or open(stamp).read().strip() != str(nfiles):
+        t0 = time.time()
+        if not os.path.isdir(work):
+            os.makedirs(work)
+        descriptors = []
+        for p in archive_paths(nfiles, root):
+            d = os.path.dirname(p)
+            if not os.path.isdir(d):
+                os.makedirs(d)
+                # INST MODEL exp mon atmos Amon ens latest var
+                parts = d[len(root):].split('/')
+                descriptors.append(' '.join(['CMIP5', parts[1], 'Amon', parts[2], parts[6], '1850', '2009', parts[8]]))
+            open(p, 'w').close()
+        with open(params, 'w') as f:
+            f.write('\n'.join(descriptors) + '\n')
+        with open(stamp, 'w') as f:
+            f.write('%i\n' % nfiles)
+        print('Wrote %i files (%i filedescriptors) under %s in %.1f s' % (nfiles, len(descriptors), root, time.time() - t0))
+    t0 = time.time()
+    with open(os.path.join(work, 'stdout.txt'), 'w') as log:
+        proc = subprocess.Popen([sys.executable, finder, '-p', 'params.txt', '--datasource', 'bench=' + root],
+                                cwd=work, stdout=log, stderr=subprocess.STDOUT)
+        proc.wait()
+    wall = time.time() - t0
+    if proc.returncode != 0:
+        print >> sys.stderr, "cmip5datafinder.py run failed, exit code %i (see %s)" % (proc.returncode, log.name)
+        sys.exit(2)
+    # largest of the waited-for children: the run itself (find is far smaller)
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.
+    print('Full run of %s over %i files:' % (finder, nfiles))
+    print('   wall %.1f s   peak memory %.1f MB' % (wall, peak))
+
+# ---- parse command line
+nfiles = 1000000
+kind = None
+tree = None
+finder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cmip5datafinder.py')
+try:
+    opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "files=", "child=", "run=", "finder="])
+except getopt.GetoptError:
+    usage()
+    sys.exit(1)
+for o, a in opts:
+    if o in ("-h", "--help"):
+        usage()
+        sys.exit(0)
+    elif o == "--files":
+        nfiles = int(a)
+    elif o == "--child":
+        kind = a
+    elif o == "--run":
+        tree = a
+    elif o == "--finder":
+        finder = os.path.abspath(a)
+
+if kind is not None:
+    child(kind, nfiles)
+    sys.exit(0)
+if tree is not None:
+    full_run(nfiles, tree, finder)
+    sys.exit(0)
+
+found = {}
+for kind in ('list', 'store'):
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--files', str(nfiles), '--child', kind],
+                            stdout=subprocess.PIPE)
+    (out, err) = proc.communicate()
+    if proc.returncode != 0:
+        print >> sys.stderr, "Benchmark run failed, exit code %i" % proc.returncode
+        sys.exit(2)
+    found[kind] = out.split()
+if found['list'][6] != found['store'][6]:
+    print >> sys.stderr, "The store did not give back the same paths"
+    sys.exit(1)
+print('File index of %i paths (%.1f MB of path characters):' % (nfiles, int(found['list'][6]) / 1e6))
+for kind in ('list', 'store'):
+    k, n, base, peak, tbuild, tread, nchars = found[kind]
+    print('   %-6s %8.1f MB   build %6.2f s   all paths %6.2f s' % (kind, float(peak) - float(base), float(tbuild), float(tread)))
+print('   store / list memory: %.2f' % ((float(found['store'][3]) - float(found['store'][2])) /
+                                         max(float(found['list'][3]) - float(found['list'][2]), 1e-6)))
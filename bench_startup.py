@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Cold start benchmark for cmip5datafinder.py
+Runs a single filedescriptor --user-input query against a tiny
+throw-away datasource a number of times and checks that the median
+wall time stays under a fixed budget and that none of the heavy
+modules (numpy, matplotlib, xml parsers, yaml) got imported on the way.
+Python 2 has no -X importtime so the imported modules are read off
+sys.modules at exit instead; pass --verbose-imports for the full
+python -v import trace of one run.
+
+Example run:
+python bench_startup.py --runs 10 --budget 0.5
+"""
+# -------------------------------------------------------------------------
+#      Setup.
+# -------------------------------------------------------------------------
+
+# ---- Import standard modules to the python path.
+import sys, os, shutil, getopt, time, tempfile
+import subprocess
+
+__author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
+
+# ---- modules that must not be loaded for a single descriptor query
+HEAVY_MODULES = ['numpy', 'matplotlib', 'xml.dom.minidom',
+                 'xml.etree.cElementTree', 'xml.etree.ElementTree', 'yaml']
+
+# ---- wrapper that runs the script and reports the heavy modules at exit
+WRAPPER = """
+import sys, os, atexit
+heavy = %r
+def report():
+    loaded = [m for m in heavy if m in sys.modules]
+    sys.stderr.write('HEAVY_MODULES_LOADED ' + ','.join(loaded) + '\\n')
+atexit.register(report)
+sys.argv = %r
+# as python SCRIPT would: the script dir first on the path
+sys.path[0] = os.path.dirname(sys.argv[0])
+execfile(sys.argv[0])
+"""
+
+# ---- Function usage.
+def usage():
+  msg = """\
+Cold start benchmark for a single filedescriptor query with cmip5datafinder.py
+
+Usage:
+  bench_startup.py [options]
+  -h, --help                  Display this message and exit
+  --runs <N>                  Number of cold starts to time (default 5)
+  --budget <SEC>              Median wall time budget in seconds (default 1.0);
+                              exits with status 1 if exceeded or if a heavy module is loaded
+  --python <EXE>              Python interpreter to run the script with (default: this one)
+  --verbose-imports           Also dump the python -v import trace of one run
+"""
+  print >> sys.stderr, msg
+
+def make_datasource(workdir):
+    """
+    builds a one-file datasource under workdir and
+    returns its root
+    """
+    root = os.path.join(workdir, 'ds', 'output1') + '/'
+    ncdir = os.path.join(root, 'MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/latest/tro3')
+    os.makedirs(ncdir)
+    ncfile = os.path.join(ncdir, 'tro3_Amon_MPI-ESM-LR_historical_r1i1p1_185001-200512.nc')
+    open(ncfile, 'w').close()
+    return root
+
+def run_once(python, script, root, workdir, extra=None):
+    """
+    runs one cold start; returns wall time and
+    the heavy modules that were loaded
+    """
+    args = [script, '--user-input', '--datasource', 'bench=' + root,
+            '--fileparams', 'CMIP5', '--fileparams', 'MPI-ESM-LR',
+            '--fileparams', 'Amon', '--fileparams', 'historical',
+            '--fileparams', 'r1i1p1', '--fileparams', '1910',
+            '--fileparams', '1919', '--uservars', 'tro3']
+    cmd = [python] + (extra or []) + ['-c', WRAPPER % (HEAVY_MODULES, args)]
+    t0 = time.time()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, cwd=workdir)
+    (out, err) = proc.communicate()
+    dt = time.time() - t0
+    if proc.returncode != 0:
+        print >> sys.stderr, err
+        print >> sys.stderr, "Benchmark run failed, exit code %i" % proc.returncode
+        sys.exit(2)
+    loaded = []
+    for line in err.splitlines():
+        if line.startswith('HEAVY_MODULES_LOADED'):
+            loaded = [m for m in line[len('HEAVY_MODULES_LOADED'):].strip().split(',') if m]
+    return dt, loaded, err
+
+# ---- parse command line
+runs = 5
+budget = 1.0
+python = sys.executable
+verbose_imports = False
+try:
+    opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "runs=", "budget=", "python=", "verbose-imports"])
+except getopt.GetoptError:
+    usage()
+    sys.exit(1)
+for o, a in opts:
+    if o in ("-h", "--help"):
+        usage()
+        sys.exit(0)
+    elif o == "--runs":
+        runs = int(a)
+    elif o == "--budget":
+        budget = float(a)
+    elif o == "--python":
+        python = a
+    elif o == "--verbose-imports":
+        verbose_imports = True
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cmip5datafinder.py')
+workdir = tempfile.mkdtemp(prefix='bench_startup_')
+try:
+    root = make_datasource(workdir)
+    times = []
+    heavy = set()
+    for i in range(runs):
+        dt, loaded, err = run_once(python, script, root, workdir)
+        times.append(dt)
+        heavy.update(loaded)
+    if verbose_imports:
+        dt, loaded, err = run_once(python, script, root, workdir, extra=['-v'])
+        print('\n'.join([l for l in err.splitlines() if l.startswith('import ')]))
+finally:
+    shutil.rmtree(workdir)
+
+times.sort()
+median = times[len(times) // 2]
+print('Cold start single filedescriptor query (%i runs):' % runs)
+print('   min %.3f s   median %.3f s   max %.3f s   budget %.3f s' % (times[0], median, times[-1], budget))
+if heavy:
+    print('   heavy modules loaded: %s' % ', '.join(sorted(heavy)))
+else:
+    print('   heavy modules loaded: none')
+if median > budget or heavy:
+    print >> sys.stderr, "Startup budget exceeded"
+    sys.exit(1)
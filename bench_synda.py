@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Per-call overhead benchmark for synda_adapter.py
+Sets up a throw-away stand-in synda (synda_standin.py) with a synthetic
+index of CMIP5 files and times the same synda calls made the three
+ways cmip5datafinder.py can make them:
+  cli  one synda process per call (synda search -f ...)
+  api  synda's main() in this process (searches)
+  db   synda's SQLite database, read-only (status of one file)
+The status of a file through the command line is a search for it, as
+cmip5datafinder.py did before it read the database. --startup models
+the time a real synda takes to load its configuration on each start.
+
+Example run:
+python bench_synda.py --calls 50 --startup 0.2
+"""
+# -------------------------------------------------------------------------
+#      Setup.
+# -------------------------------------------------------------------------
+
+# ---- Import standard modules to the python path.
+import sys, os, shutil, getopt, time, tempfile
+
+__author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synda_standin import setup
+from synda_adapter import SyndaCLI, SyndaDB, load_api, SyndaAPI
+
+MODELS = ['MPI-ESM-LR', 'CanESM2', 'HadGEM2-ES', 'CESM1-BGC', 'GFDL-CM3', 'MIROC5']
+VARIABLES = ['tas', 'pr', 'ta', 'ua', 'va', 'hus', 'zg', 'tro3']
+
+# ---- Function usage.
+def usage():
+  msg = """\
+Per-call overhead of synda through its command, its python API and its database
+
+Usage:
+  bench_synda.py [options]
+  -h, --help                  Display this message and exit
+  --calls <N>                 Number of calls of each kind (default 50)
+  --startup <SEC>             Start time of the stand-in synda, per process (default 0)
+"""
+  print >> sys.stderr, msg
+
+def write_index(fname):
+    """
+    synthetic synda search -f lines, returns the file ids
+    """
+    ids = []
+    with open(fname, 'w') as file:
+        for model in MODELS:
+            for var in VARIABLES:
+                for year in range(1850, 2010, 10):
+                    fid = 'cmip5.output1.INST.%s.historical.mon.atmos.Amon.r1i1p1.v20120315.%s_Amon_%s_historical_r1i1p1_%i01-%i12.nc' \
+                          % (model, var, model, year, year + 9)
+                    file.write('new   221.2 MB  %s\n' % fid)
+                    ids.append(fid)
+    return ids
+
+def timed(calls, one):
+    # (first call, mean of the rest) in ms
+    t0 = time.time()
+    one(calls[0])
+    first = time.time() - t0
+    t0 = time.time()
+    for call in calls[1:]:
+        one(call)
+    return first * 1e3, (time.time() - t0) * 1e3 / max(len(calls) - 1, 1)
+
+# ---- parse command line
+ncalls = 50
+startup = 0.
+try:
+    opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "calls=", "startup="])
+except getopt.GetoptError:
+    usage()
+    sys.exit(1)
+for o, a in opts:
+    if o in ("-h", "--help"):
+        usage()
+        sys.exit(0)
+    elif o == "--calls":
+        ncalls = max(2, int(a))
+    elif o == "--startup":
+        startup = float(a)
+
+home = tempfile.mkdtemp(prefix='bench_synda-')
+try:
+    ids = write_index(os.path.join(home, 'index.txt'))
+    exe = setup(home, index=os.path.join(home, 'index.txt'), startup=startup)
+    searches = ['search -f CMIP5 %s Amon historical r1i1p1 %s' % (MODELS[i % len(MODELS)], VARIABLES[i % len(VARIABLES)])
+                for i in range(ncalls)]
+    statuses = [ids[(i * 7) % len(ids)] for i in range(ncalls)]
+    cli = SyndaCLI(exe)
+    t0 = time.time()
+    api = SyndaAPI(load_api(exe), exe)
+    tload = (time.time() - t0) * 1e3
+    db = SyndaDB(os.path.join(home, 'db', 'sdt.db'))
+    # same answers both ways
+    if cli.run(searches[0])[0] != api.run(searches[0])[0]:
+        print >> sys.stderr, "The command and the API did not give the same search output"
+        sys.exit(1)
+    found = {}
+    found['cli search'] = timed(searches, lambda a: cli.run(a))
+    found['api search'] = timed(searches, lambda a: api.run(a))
+    def cli_status(fid):
+        # the status column of a search for the file
+        facets = fid.split('.')
+        basename = fid.split('.', 10)[10].split('_')
+        return cli.run('search -f CMIP5 %s Amon historical r1i1p1 %s %s' % (facets[3], basename[0], basename[-1]))
+    found['cli status'] = timed(statuses, cli_status)
+    found['db status'] = timed(statuses, db.status)
+    print('Synda calls, %i of each (stand-in synda start time %.2f s, API import %.1f ms):' % (ncalls, startup, tload))
+    for kind in ('cli search', 'api search', 'cli status', 'db status'):
+        print('   %-11s first %9.2f ms   then %9.3f ms per call' % (kind, found[kind][0], found[kind][1]))
+    print('   search: api / cli per call %.4f' % (found['api search'][1] / max(found['cli search'][1], 1e-9)))
+    print('   status: db / cli per call  %.4f' % (found['db status'][1] / max(found['cli status'][1], 1e-9)))
+    api.close()
+    db.close()
+finally:
+    shutil.rmtree(home)
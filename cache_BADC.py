@@ -13,14 +13,13 @@ Can be generalized for any other archive.
 # -------------------------------------------------------------------------
 
 # ---- Import standard modules to the python path.
-import sys, os, shutil, math, copy, getopt, re, string, popen2, time, errno
-import numpy as np
-from numpy import loadtxt as lt
-from numpy import savetxt as st
-from xml.dom import minidom
+# ---- only light modules here; numpy is imported where it is used
+# ---- so that startup and synda lookups stay fast
+import sys, os, shutil, getopt, time
 import subprocess
 from datetime import datetime
-import time
+from synda_adapter import which_synda
+from synda_records import time_handling, parse_synda_search, latest_versions
 
 __author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
 
@@ -59,65 +58,6 @@ Usage:
 # ---- Operational functions here ---- #
 ########################################
 
-# ---- get the path to synda executable
-def which_synda(synda):
-    """
-
-    This function returns the path to the synda exec
-    or aborts the whole program if path is not found.
-
-    """
-    def is_exe(fpath):
-        return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
-
-    fpath, fname = os.path.split(synda)
-    if fpath:
-        if is_exe(synda):
-            #print('We are using the following executable: %s' % synda)
-            return synda
-    else:
-        for path in os.environ["PATH"].split(os.pathsep):
-            path = path.strip('"')
-            exe_file = os.path.join(path, synda)
-            if is_exe(exe_file):
-                #print('We are using the following executable: %s' % exe_file)
-                return exe_file
-
-    #print('No synda executable found on the system. Aborting program.')
-    return None
-
-# ---- handling the years for files
-def time_handling(year1, year1_model, year2, year2_model):
-    """
-
-    year1 - the start year in files
-    year1_model - the needed start year of data
-    year2 - the last year in files
-    year2_model - the needed last year of data
-    we compromise on months
-
-    """
-    # model interval < data interval / file
-    if year1 <= int(year1_model) and year2 >= int(year2_model):
-        return True
-    # model interval > data interval / file
-    elif year1 >= int(year1_model) and year2 <= int(year2_model):
-        return True
-    elif year1 <= int(year1_model) and year2 <= int(year2_model):
-        # data is entirely before model
-        if year2 <= int(year1_model):
-            return False
-        # data overlaps to the left
-        elif year2 >= int(year1_model):
-            return True
-    elif year1 >= int(year1_model) and year2 >= int(year2_model):
-        # data is entirely after model
-        if year1 >= int(year2_model):
-            return False
-        # data overlaps to the right
-        elif year1 <= int(year2_model):
-            return True
-
 # ---- synda search
 def synda_search(model_data,varname,server):
     """
@@ -133,6 +73,7 @@ def synda_search(model_data,varname,server):
 
     in a directory called allAvailableFiles_SERVER. This info may be needed for later 
     analyses or manual downloads. It is a good data tracking tool as well.
+    Returns a SyndaRecord generator that reads the synda output line by line.
 
     """
     # this is needed mostly for parallel processes that may
@@ -153,16 +94,18 @@ def synda_search(model_data,varname,server):
         cachefile = open(outfiletitle, 'w')
     synda_search = which_synda('synda') + ' search -f ' + model_data + ' ' + varname
     proc = subprocess.Popen(synda_search, stdout=subprocess.PIPE, shell=True)
-    (out, err) = proc.communicate()
-    if err is not None:
-        print >> sys.stderr, "An error has occured while searching for data:"
-        print >> sys.stderr, err
-        sys.exit(1)
-    else:
-        cachefile.write(out)
-        return out
-    cachefile.close()
-    cachefile.save()
+
+    def lines():
+        # copy the output lines to the Data_Files file as they arrive
+        try:
+            for line in iter(proc.stdout.readline, ''):
+                cachefile.write(line)
+                yield line
+        finally:
+            cachefile.close()
+            proc.stdout.close()
+            proc.wait()
+    return parse_synda_search(lines())
 
 # ---- synda download
 def write_cache(searchoutput,varname,year1_model,year2_model,header,outfile,outfile2):
@@ -170,7 +113,7 @@ def write_cache(searchoutput,varname,year1_model,year2_model,header,outfile,outf
     This function takes the standard search output from synda
     and parses it to see if/what files exist locally
 
-    The searchoutput argument is a string and is of the form e.g.
+    The searchoutput argument is a SyndaRecord iterator (parse_synda_search()) over lines of the form e.g.
 
     new   221.2 MB  cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-195912.nc
     done  132.7 MB  cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_200001-200512.nc
@@ -180,6 +123,7 @@ def write_cache(searchoutput,varname,year1_model,year2_model,header,outfile,outf
     against the required model file characterstics and files that comply and 
     exist locally are stored in a cache file for data reading. It also takes the year1_model and year2_model, for time checks.
     It also takes the variable name and the name of a cache file outfile that will be written to disk. 
+    The newest version of each file is picked from searchoutput itself, see latest_versions().
 
     """
     # this is needed mostly for parallel processes that may
@@ -191,82 +135,57 @@ def write_cache(searchoutput,varname,year1_model,year2_model,header,outfile,outf
         sys.exit(1)
     with open(outfile, 'a') as file:
         file.close()
-    entries = searchoutput.split('\n')[:-1]
-    if len(entries)>0:
-        for entry in entries:
-            file_name = entry.split()[3]
-            if header.split('_')[1] == file_name.split('.')[3]:
-                time_range = file_name.split('_')[-1].strip('.nc')
-                time1 = time_range.split('-')[0]
-                y1 = datetime.strptime(time1, '%Y%m')
-                year1 = y1.year
-                time2 = time_range.split('-')[1]
-                y2 = datetime.strptime(time2, '%Y%m')           
-                year2 = y2.year
-                if time_handling(year1, year1_model, year2, year2_model) is True:
-                    file_name_complete = ".".join(file_name.split('.')[:10]) + '.' + varname + '.' + ".".join(file_name.split('.')[10:])
-                    true_file_name = file_name_complete.split('.')[-2]+'.'+file_name_complete.split('.')[-1]
-                    print('Matching file: %s' % true_file_name)
-                    # get the most recent file from database
-                    # synda will always list the most recent database first
-                    synda_search = which_synda('synda') + ' search -f -l 1 ' + true_file_name
-                    proc = subprocess.Popen(synda_search, stdout=subprocess.PIPE, shell=True)
-                    (out, err) = proc.communicate()
-                    if len(out.split()) > 2:
-                        fc = out.split()[3]
-                        file_name_complete_final = ".".join(fc.split('.')[:10]) + '.' + varname + '.' + ".".join(fc.split('.')[10:])
-                        filepath_complete_0 = '/badc/cmip5/data/c' + file_name_complete_final.replace('.','/').strip('/nc') + '.nc'
-                        filepath_complete = "/".join(filepath_complete_0.split('/')[0:13]) + '/latest/' + "/".join(filepath_complete_0.split('/')[14:])
-                        print(filepath_complete)
-                        # ---- perform a local check file exists in /badc
-                        # ---- and write cache
-                        crf = filepath_complete.split('/')[-1]
-                        # ---- writing only files that match experiment type
-                        if header.split('_')[1] == crf.split('_')[2]:
-                            if os.path.exists(filepath_complete):
-                                with open(outfile, 'a') as file:
-                                    file.write(header + ' ' + filepath_complete + ' ' + out.split()[1] + out.split()[2] + '\n')
-                                    file.close()
-                                print('----------------------------------------------------')
-                            else:
-                                try:
-                                    s = open(filepath_complete)
-                                except IOError as ioex:
-                                    print 'err message:', os.strerror(ioex.errno)
-                                    print('Trying to look one directory up...')
-                                    probl = "/".join(filepath_complete.split('/')[0:-1])
-                                    fnd = 'find ' + probl +  ' -follow -iname "*.nc"'
-                                    proc = subprocess.Popen(fnd, stdout=subprocess.PIPE, shell=True)
-                                    (out, err) = proc.communicate()
-                                    prs = []
-                                    for s in out.split('\n')[0:-1]:
-                                        ssp = s.split('/')
-                                        av = ssp[-1]
-                                        # --- date handling
-                                        time_range = av.split('_')[-1].strip('.nc')
-                                        time1 = time_range.split('-')[0]
-                                        y1 = datetime.strptime(time1, '%Y%m')
-                                        year1 = y1.year
-                                        time2 = time_range.split('-')[1]
-                                        y2 = datetime.strptime(time2, '%Y%m')
-                                        year2 = y2.year
-                                        if time_handling(year1, yr1, year2, yr2) is True:
-                                            if os.path.exists(s):
-                                                prs.append(s)
-                                                print('Found rogue file: %s' % s)
-                                                with open(outfile, 'a') as file:
-                                                    file.write(header + ' ' + s + '\n')
-                                    if len(prs)==0:
-                                        print('No files found...')
-                                        with open(outfile2, 'a') as file:
-                                            file.write(header + ' ' + 'ERROR ' + os.strerror(ioex.errno) + ' ' + filepath_complete + '\n')
-                                            file.close()
-                    else:
-                        print('something went wrong with parsing the data entry, calling this a non-existent file')
-                        with open(outfile2, 'a') as file:
-                            file.write(header + ' ' + 'ERROR ' + file_name_complete + ' could not be found' + '\n')
+    # newest version of each file, from this one search
+    latest = latest_versions(searchoutput)
+    for fc in latest:
+        if header.split('_')[1] == fc.model and fc.year1 is not None:
+            if time_handling(fc.year1, year1_model, fc.year2, year2_model)[0] is True:
+                print('Matching file: %s' % fc.basename)
+                filepath_complete = fc.local_path('/badc/cmip5/data/').replace('/' + fc.version + '/', '/latest/')
+                print(filepath_complete)
+                # ---- perform a local check file exists in /badc
+                # ---- and write cache
+                # ---- writing only files that match experiment type
+                if header.split('_')[1] == fc.basename.split('_')[2]:
+                    if os.path.exists(filepath_complete):
+                        with open(outfile, 'a') as file:
+                            file.write(header + ' ' + filepath_complete + ' ' + '%.1fMB' % (fc.size / 1e6) + '\n')
                             file.close()
-    else:
+                        print('----------------------------------------------------')
+                    else:
+                        try:
+                            s = open(filepath_complete)
+                        except IOError as ioex:
+                            print 'err message:', os.strerror(ioex.errno)
+                            print('Trying to look one directory up...')
+                            probl = "/".join(filepath_complete.split('/')[0:-1])
+                            fnd = 'find ' + probl +  ' -follow -iname "*.nc"'
+                            proc = subprocess.Popen(fnd, stdout=subprocess.PIPE, shell=True)
+                            (out, err) = proc.communicate()
+                            prs = []
+                            for s in out.split('\n')[0:-1]:
+                                ssp = s.split('/')
+                                av = ssp[-1]
+                                # --- date handling
+                                time_range = av.split('_')[-1].strip('.nc')
+                                time1 = time_range.split('-')[0]
+                                y1 = datetime.strptime(time1, '%Y%m')
+                                year1 = y1.year
+                                time2 = time_range.split('-')[1]
+                                y2 = datetime.strptime(time2, '%Y%m')
+                                year2 = y2.year
+                                if time_handling(year1, year1_model, year2, year2_model)[0] is True:
+                                    if os.path.exists(s):
+                                        prs.append(s)
+                                        print('Found rogue file: %s' % s)
+                                        with open(outfile, 'a') as file:
+                                            file.write(header + ' ' + s + '\n')
+                            if len(prs)==0:
+                                print('No files found...')
+                                with open(outfile2, 'a') as file:
+                                    file.write(header + ' ' + 'ERROR ' + os.strerror(ioex.errno) + ' ' + filepath_complete + '\n')
+                                    file.close()
+    if len(latest) == 0:
         print >> sys.stderr, "Could not find database with the specified parameters on BADC"
         return 0
 
@@ -282,8 +201,15 @@ def write_cache_direct(params_file):
     find /badc/cmip5/data/cmip5/output1/BCC/bcc-csm1-1 -follow -type f -iname "*.nc" > all_badc_netcdf_bcc-csm1-1.txt
  
     Versioning is controlled by finding the /latest dir in the database
+    Each database file is read once, into a compact PathStore (see path_store.py),
+    and shared by all the items of its model; an item only rebuilds the
+    paths of the files named after it (PathStore.with_stem()).
 
     """ 
+    import numpy as np
+    from path_store import PathStore
+    from numpy import loadtxt as lt
+    from numpy import savetxt as st
     outfile = 'netcdf_badc_cache_direct.txt'
     car = np.genfromtxt(params_file, dtype=str, delimiter='\n')
     # ---- eliminate duplicates from input file, if any
@@ -297,13 +223,17 @@ def write_cache_direct(params_file):
         st(prfile,nar,fmt='%s')
     itemlist = lt(prfile,dtype=str)
     lenitemlist = len(itemlist)
+    databases = {}
     for item in itemlist:
         # ---- read database files
         # These files have been generated using find as:
         # find /badc/cmip5/data/cmip5/output1/BCC/bcc-csm1-1 -follow -type f -iname "*.nc" > all_badc_netcdf_bcc-csm1-1.txt
         arname = 'all_badc_netcdf_' + item[0] + '_' + item[1] + '.txt'
         if os.path.exists(arname):
-            ar = np.genfromtxt(arname, dtype=str, delimiter='\n')
+            if arname not in databases:
+                with open(arname, 'r') as file:
+                    databases[arname] = PathStore(line.strip() for line in file if line.strip())
+            ar = databases[arname]
             var = item[7]
             header = item[0] + '_'+ item[1] + '_' + item[2]\
                          + '_' + item[3] + '_' + item[4] + '_' + item[5]\
@@ -312,7 +242,8 @@ def write_cache_direct(params_file):
                          + '_' + item[3] + '_' + item[4]
             yr1 = int(item[5])
             yr2 = int(item[6])
-            for s in ar:
+            for i in ar.with_stem(filehead + '_'):
+                s = ar[i]
                 ssp = s.split('/')
                 av = ssp[-1]
                 if filehead == "_".join(av.split('_')[0:-1]):
@@ -325,7 +256,7 @@ def write_cache_direct(params_file):
                         time2 = time_range.split('-')[1]
                         y2 = datetime.strptime(time2, '%Y%m')
                         year2 = y2.year
-                        if time_handling(year1, yr1, year2, yr2) is True:
+                        if time_handling(year1, yr1, year2, yr2)[0] is True:
                             if os.path.exists(s):
                                 with open(outfile, 'a') as file:
                                     file.write(header + ' ' + s + '\n')
@@ -342,6 +273,8 @@ def fix_duplicate_entries(outfile):
     from a cache file
     """
     # ---- fixing the cache file for duplicates
+    import numpy as np
+    from numpy import savetxt as st
     ar = np.genfromtxt(outfile, dtype=str,delimiter='\n')
     nar = np.unique(ar)
     st(outfile,nar,fmt='%s')
@@ -350,6 +283,7 @@ def print_stats(outfile1,outfile2):
     """
     small function to print some stats at the end
     """
+    import numpy as np
     if os.path.exists(outfile1) and os.path.exists(outfile2):
         ar1 = np.genfromtxt(outfile1, dtype=str,delimiter='\n')
         ar2 = np.genfromtxt(outfile2, dtype=str,delimiter='\n')
@@ -574,6 +508,9 @@ if params_file:
         ###############################################################
         # ---- prepend the original params file to eliminate
         # duplicates in the lists
+        import numpy as np
+        from numpy import loadtxt as lt
+        from numpy import savetxt as st
         if direct is False:
             ar = np.genfromtxt(params_file, dtype=str, delimiter='\n')
             nar = np.unique(ar)
@@ -630,10 +567,10 @@ elif userVars:
         yr1 = fpars[5]
         yr2 = fpars[6]
         outpt = synda_search(model_data,vi,data_server)
-        s = write_cache(outpt,vi,yr1,yr2,pfile2,pfile3)
+        s = write_cache(outpt,vi,yr1,yr2,header,pfile2,pfile3)
         if s == 0:
             with open(pfile3, 'a') as file:
-                file.write(header + ' ' + 'ERROR3: ' + model_data + ' ' + str(yr1) + ' ' + str(yr2) + ' ' + v1 + ' missing database' + '\n')
+                file.write(header + ' ' + 'ERROR3: ' + model_data + ' ' + str(yr1) + ' ' + str(yr2) + ' ' + vi + ' missing database' + '\n')
                 file.close()
     # ---- clean-up
     if os.path.exists(pfile2):
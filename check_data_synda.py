@@ -10,14 +10,11 @@ Script that performs a check on the current/most recent downloads via synda
 # -------------------------------------------------------------------------
 
 # ---- Import standard modules to the python path.
-import sys, os, shutil, math, random, copy, getopt, re, string, popen2, time
-import numpy as np
-from numpy import loadtxt as lt
-from numpy import savetxt as st
-from xml.dom import minidom
+# ---- only light modules here, keeps startup fast
+import sys, os, shutil, getopt, time
 import subprocess
 from datetime import datetime
-import time
+from synda_adapter import which_synda
 
 __author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
 
@@ -39,33 +36,6 @@ Usage:
 # ---- Operational functions here ---- #
 ########################################
 
-# ---- get the path to synda executable
-def which_synda(synda):
-    """
-
-    This function returns the path to the synda exec
-    or aborts the whole program if path is not found.
-
-    """
-    def is_exe(fpath):
-        return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
-
-    fpath, fname = os.path.split(synda)
-    if fpath:
-        if is_exe(synda):
-            #print('We are using the following executable: %s' % synda)
-            return synda
-    else:
-        for path in os.environ["PATH"].split(os.pathsep):
-            path = path.strip('"')
-            exe_file = os.path.join(path, synda)
-            if is_exe(exe_file):
-                #print('We are using the following executable: %s' % exe_file)
-                return exe_file
-
-    #print('No synda executable found on the system. Aborting program.')
-    return None
-
 # ---- synda check download
 def synda_check_dll():
     print('Checking if/how your files(s) are being downloaded.')
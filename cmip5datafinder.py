@@ -13,14 +13,15 @@ cache files using the results of the search.
 # -------------------------------------------------------------------------
 
 # ---- Import standard modules to the python path.
-import sys, os, shutil, math, copy, getopt, re, string, popen2, time, errno
-import numpy as np
-from numpy import loadtxt as lt
-from numpy import savetxt as st
-from xml.dom import minidom
+# ---- only light modules here; heavy ones (numpy, matplotlib, xml, yaml)
+# ---- are imported inside the functions that need them so that a small
+# ---- --user-input lookup starts fast (see bench_startup.py)
+import sys, os, shutil, getopt, time
 import subprocess
-from datetime import datetime
-import time
+from datetime import datetime, timedelta
+import synda_adapter
+from param_files import FileDescriptor, read_params, read_namelist
+from synda_records import time_handling, date_handling, size_to_bytes, synda_record, parse_synda_search, latest_versions
 
 __author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
 
@@ -46,6 +47,13 @@ nodes via synda;
            - missing_cache_cmip5_combined_[DATASOURCE].txt missing files (synda+local)
            - missing_cache_cmip5_synda_[DATASOURCE].txt synda missing files
 4. Finally-finally it plots the overall, incomplete and missing files by model (png format).
+Each run builds its caches in its own hidden .cmip5datafinder-run-* directory and moves them
+into the current directory at the end, so several runs can share a directory; a run started
+while another one with the same command line and param file is going waits for it and reuses
+its caches instead of scanning again. Bookkeeping files left in the directory: one
+.cmip5datafinder-KEY.done per command line and param file (what its last run published),
+.cmip5datafinder.lock and a .lock next to each store (*_store.txt); all are small and can be
+deleted when no run is going. The .cmip5datafinder-KEY.inflight lock goes with its run.
 
 Example run:
 python cmip5datafinder.py -p PARAM_FILE --synda --download --dryrun --verbose --datasource badc
@@ -61,19 +69,95 @@ CMIP5_MIROC5_Amon_historical_r1i1p1_2003_2010_hus
 
 Usage:
   cmip5datafinder.py [options]
-  -p, --params-file <file>    Namelist file (xml) or text file (txt) or any other input file [REQUIRED] 
+  cmip5datafinder.py lookup CACHEFILE HEADER [HEADER ...]
+                              Print status, coverage and paths of filedescriptors in a final cache
+                              (or a --shard-by shard) in constant time, through its CACHEFILE.idx index
+                              that is written with every final cache (rebuilt here if out of date)
+  cmip5datafinder.py merge SHARDDIR [SHARDDIR ...]
+                              Combine the shard_I_of_N outputs of --shard runs into the standard cache
+                              files, final caches (in param file order) and indexes in the current directory
+  -p, --params-file <file>    Namelist file (xml), recipe (yml) or text file (txt) [REQUIRED] 
                               e.g. for xml: --params-file ESMValTool/nml/namelist_myTest.xml
                               e.g. for text: --params-file example.txt
                               e.g. for yaml: --params-file example.yml
                               This option is REQUIRED if --user-input (command line) is NOT present
+                              Text param file rows may use * and comma lists for model, experiment,
+                              ensemble and variable e.g. CMIP5 * Amon historical r1i1p1 1980 2005 tas,pr
+                              (expanded against the local datasource, see expanded_PARAM_FILE)
   -h, --help                  Display this message and exit
   --user-input                Flag for user defined CMIP file and variables parameters (to be input at command line
                               with --fileparams for each parameter)
                               This option is REQUIRED if --params-file is not present
   --datasource                Name of local data source (example: badc). Available datasources:
-                              badc [to add more here, depending where running the code][REQUIRED]
+                              badc, dkrz, sdt (local synda /sdt/data mirror) or a user root given as
+                              NAME=ROOT e.g. --datasource mine=/home/users/me/cmip5/output1/ [REQUIRED]
+                              Serial option: several datasources are scanned concurrently, each
+                              writing its own cache_files_[DATASOURCE]
+  --merge-datasources         Flag to write a best-coverage cache cache_PARAM_FILE-merged that takes
+                              each filedescriptor from the datasource that covers it best
   --synda                     Flag to call synda operations. If not passed, local datasources will be used ONLY
   --download                  Flag to allow download missing data via synda
+  --max-gb <GB>               Disk budget for --download: synda files are scheduled so that the most
+                              filedescriptors reach complete coverage first and nothing past the budget
+                              is installed; with --dryrun the download plan is printed with its totals
+  --record <DIR>              Save every synda call (command line, stdout, exit code) in DIR
+  --replay <DIR>              Answer the synda calls from a --record DIR, no synda is run (offline,
+                              deterministic runs of the synda path)
+  --replay-latency <SEC>      With --replay, wait SEC seconds per synda call to model the real index
+  --synda-api <MODULE>        Python module (name or file) whose main() is synda's command line, called in this
+                              process instead of starting synda for every search and install (default: the
+                              synda executable itself when it is a python script; the command otherwise)
+  --synda-db <FILE>           Synda's SQLite database, read-only, for the status of files (done, in transfer) and
+                              the download queue (default $ST_HOME/db/sdt.db, if there)
+  --synda-cli                 Start the synda command for every synda call and take file statuses from the
+                              search and /sdt/data only, as before (unless --synda-db is given)
+  --pipeline-queue <N>        With --synda and a --params-file, the local scan, synda search and install run as
+                              stages connected by queues of N filedescriptors (default 8): searches start as
+                              soon as the scan finds a filedescriptor missing or incomplete and installs as
+                              soon as its search is done (with --dryrun or --max-gb the plan is made at the end);
+                              each stage's items, busy and idle time and queue depth are printed at the end;
+                              0 runs the stages one after the other, as before (e.g. on a single core with a
+                              synda that is started for every call)
+  --progress <MODE>           Progress of the run while it goes: filedescriptors done/total, files found,
+                              searches in flight, MB queued for install, rates and ETA; tty rewrites one line
+                              on stderr, log prints a line every interval, off shows nothing (default auto:
+                              tty on a terminal, log otherwise); the throughput of each stage (scan, search,
+                              install) is printed at the end unless off
+  --progress-interval <SEC>   Seconds between progress updates (default 0.5 in tty mode, 10 in log mode)
+  --esgf-search <URL>         Search the ESGF search API at URL directly instead of synda search
+                              e.g. --esgf-search https://esgf-index1.ceda.ac.uk/esg-search/search
+                              (synda is then only needed to install files)
+  --esgf-workers <N>          Number of concurrent --esgf-search queries and pooled connections (default 4)
+  --http-download <ROOT>      With --esgf-search and --download, fetch the planned files over HTTP from the
+                              data nodes into their DRS path under ROOT (e.g. /sdt/data) instead of synda
+                              install; checksums are verified while streaming, interrupted files resumed
+  --http-workers <N>          Number of parallel --http-download transfers (default 4)
+  --verify                    Check the local files and the installed synda files of the run (not the
+                              --dryrun or queued ones) against the size and
+                              checksum of their ESGF search records (--esgf-search) or of synda's database
+                              (--synda); digests are kept in checksum_store.txt so unchanged files are hashed
+                              once; missing, truncated and
+                              corrupt files go to cache_files_[DATASOURCE]/corrupt_cache_cmip5_[DATASOURCE].txt
+  --verify-workers <N>        Number of --verify hashing threads (default: 16 on network filesystems, up to 4 else)
+  --introspect                Take the years covered by each cached file from its time coordinate and calendar
+                              (netCDF header only; netCDF4/HDF5 files need the netCDF4 or h5py module) instead
+                              of its file name; files are read in parallel and once only, the ranges are
+                              kept in time_store.txt
+  --coverage-matrix           Also write each final cache as a model x variable x month coverage array,
+                              cache_PARAM_FILE-[DATASOURCE].coverage.npz (numpy), to query with coverage_matrix.py
+  --shard <I/N>               Resolve only shard I of N (1 <= I <= N) of the param file filedescriptors, split
+                              by a hash of the model; outputs go to shard_I_of_N/, to be combined with
+                              the merge subcommand once all N jobs are done e.g. on one machine:
+                              for i in 1 2 3 4; do cmip5datafinder.py -p PARAM_FILE --datasource badc --shard $i/4 & done; wait
+                              cmip5datafinder.py merge shard_*_of_4
+  --shard-by <KEY>            Also write the final cache split by KEY, one or more (comma list) of project, model,
+                              table, experiment, ensemble, variable e.g. --shard-by model or --shard-by model,variable
+                              into cache_PARAM_FILE-[DATASOURCE].shards/ with a manifest.json giving each shard's
+                              filedescriptors and their byte offsets
+  --missing-ttl <DAYS>        With --synda, filedescriptors found missing both locally and on ESGF are kept in
+                              missing_store.txt and answered ERROR-MISSING without a scan or search for DAYS days
+                              (default 7), or until their local directories change; 0 turns this off
+  --recheck-missing           Look for the filedescriptors in missing_store.txt again and refresh it
   --dryrun                    Flag to pass if no download is wanted. Don't pass this if downloads are neeeded!
                               If --dryrun in arguments, all cache files will be written as normal but with
                               NOT-YET-INSTALLED flag per file
@@ -108,99 +192,140 @@ Understand the workflow:
 # ---- Operational functions here ---- #
 ########################################
 
-# ---- get the path to synda executable
+# ---- get the path to synda executable, see synda_adapter.which_synda()
 def which_synda(synda):
     """
+    path to the synda executable, None if it is not found;
+    any name will do in replay mode
+    """
+    if SYNDA_TAPE['mode'] == 'replay':
+        # answers come from the tape, no executable needed
+        return synda
+    return synda_adapter.which_synda(synda)
 
-    This function returns the path to the synda exec
-    or aborts the whole program if synda needs to be used
-    but its executable is not found.
+# ---- synda record/replay, set by --record DIR and --replay DIR
+SYNDA_TAPE = {'mode': None, 'dir': None, 'latency': 0., 'seq': 0,
+              'index': None, 'cursor': {}}
 
+def tape_key(args):
+    """
+    tape file prefix for a synda command line (without the executable)
     """
-    def is_exe(fpath):
-        return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
+    import hashlib
+    return hashlib.sha1(args).hexdigest()
 
-    fpath, fname = os.path.split(synda)
-    if fpath:
-        if is_exe(synda):
-            #print('We are using the following executable: %s' % synda)
-            return synda
-    else:
-        for path in os.environ["PATH"].split(os.pathsep):
-            path = path.strip('"')
-            exe_file = os.path.join(path, synda)
-            if is_exe(exe_file):
-                return exe_file
-    return None
+def tape_write(args,out,returncode):
+    """
+    records one synda call in the tape dir as
+    SHA1(args)-PID-SEQ.json = {args, stdout, returncode};
+    PID and SEQ keep the calls of concurrent datasources apart and in order
+    """
+    import json
+    SYNDA_TAPE['seq'] += 1
+    name = '%s-%i-%06d.json' % (tape_key(args), os.getpid(), SYNDA_TAPE['seq'])
+    tmp = os.path.join(SYNDA_TAPE['dir'], '.' + name)
+    with open(tmp, 'w') as file:
+        json.dump({'args': args, 'stdout': out, 'returncode': returncode}, file)
+    os.rename(tmp, os.path.join(SYNDA_TAPE['dir'], name))
+
+def tape_read(args):
+    """
+    returns the recorded (stdout, returncode) of a synda call;
+    repeated calls get the recorded answers in order, the last one
+    is served again once they run out
+    """
+    import json
+    if SYNDA_TAPE['index'] is None:
+        index = {}
+        for name in sorted(os.listdir(SYNDA_TAPE['dir'])):
+            if name.endswith('.json') and not name.startswith('.'):
+                index.setdefault(name.split('-')[0], []).append(name)
+        SYNDA_TAPE['index'] = index
+    key = tape_key(args)
+    names = SYNDA_TAPE['index'].get(key)
+    if not names:
+        print >> sys.stderr, "No recorded answer for: synda %s in %s. Exiting." % (args, SYNDA_TAPE['dir'])
+        sys.exit(1)
+    n = SYNDA_TAPE['cursor'].get(key, 0)
+    SYNDA_TAPE['cursor'][key] = n + 1
+    with open(os.path.join(SYNDA_TAPE['dir'], names[min(n, len(names) - 1)]), 'r') as file:
+        entry = json.load(file)
+    if SYNDA_TAPE['latency'] > 0:
+        # model the round trip to the real index
+        time.sleep(SYNDA_TAPE['latency'])
+    return entry['stdout'].encode('utf-8'), entry['returncode']
+
+# ---- how synda is called, set by --synda-api, --synda-db and --synda-cli
+SYNDA_ACCESS = {'api': None, 'db': None, 'cli': False, 'synda': None}
+
+def get_synda():
+    """
+    the synda_adapter.Synda of this run, opened on first use: synda's
+    python API in process when it can be imported, its database for
+    file statuses, the synda command otherwise
+    """
+    if SYNDA_ACCESS['synda'] is None:
+        from synda_adapter import open_synda
+        SYNDA_ACCESS['synda'] = open_synda(which_synda('synda'), api=SYNDA_ACCESS['api'],
+                                           db=SYNDA_ACCESS['db'], cli=SYNDA_ACCESS['cli'])
+    return SYNDA_ACCESS['synda']
 
-# ---- handling the years for files
-def time_handling(year1, year1_model, year2, year2_model):
-    """
-    This function is responsible for finding the correct 
-    files for the needed timespan:
-
-    year1 - the start year in files
-    year1_model - the needed start year of data
-    year2 - the last year in files
-    year2_model - the needed last year of data
-    WARNINGS:
-    we reduce our analysis only to years
-
-    """
-    # model interval < data interval / file
-    # model requirements completely within data stretch
-    if year1 <= int(year1_model) and year2 >= int(year2_model):
-        return True,True
-    # model interval > data interval / file
-    # data stretch completely within model requirements
-    elif year1 >= int(year1_model) and year2 <= int(year2_model):
-        return True,False
-    # left/right overlaps and complete misses
-    elif year1 <= int(year1_model) and year2 <= int(year2_model):
-        # data is entirely before model
-        if year2 <= int(year1_model):
-            return False,False
-        # data overlaps to the left
-        elif year2 >= int(year1_model):
-            return True,False
-    elif year1 >= int(year1_model) and year2 >= int(year2_model):
-        # data is entirely after model
-        if year1 >= int(year2_model):
-            return False,False
-        # data overlaps to the right
-        elif year1 <= int(year2_model):
-            return True,False
-
-# ---- function to handle various date formats
-def date_handling(time1,time2):
-    """
-    This function deals with different input date formats e.g.
-    time1 = 198204 or
-    time1 = 19820422 or
-    time1 = 198204220511 etc
-    More formats can be coded in at this stage.
-    Returns year 1 and year 2
-    """
-    # yyyymm
-    if len(list(time1)) == 6 and len(list(time2)) == 6:
-        y1 = datetime.strptime(time1, '%Y%m')
-        year1 = y1.year
-        y2 = datetime.strptime(time2, '%Y%m')
-        year2 = y2.year
-    else:
-        # yyyymmdd
-        if len(list(time1)) == 8 and len(list(time2)) == 8:
-            y1 = datetime.strptime(time1, '%Y%m%d')
-            year1 = y1.year
-            y2 = datetime.strptime(time2, '%Y%m%d')
-            year2 = y2.year
-        # yyyymmddHHMM
-        if len(list(time1)) == 12 and len(list(time2)) == 12:
-            y1 = datetime.strptime(time1, '%Y%m%d%H%M')
-            year1 = y1.year
-            y2 = datetime.strptime(time2, '%Y%m%d%H%M')
-            year2 = y2.year
-    return year1,year2
+def close_synda():
+    """
+    closes the synda_adapter.Synda of this run if it was opened
+    (gives sys.stdout back from the in process API)
+    """
+    if SYNDA_ACCESS['synda'] is not None:
+        SYNDA_ACCESS['synda'].close()
+        SYNDA_ACCESS['synda'] = None
+
+def synda_file_status(file_name):
+    """
+    synda database status of a synda file id e.g. done, waiting;
+    None if synda is not used, has no database or does not know the file
+    """
+    if SYNDA_TAPE['mode'] == 'replay' or which_synda('synda') is None:
+        return None
+    return get_synda().file_status(file_name)
+
+def synda_checksums(file_ids):
+    """
+    {synda file id: (size, checksum, checksum type)} from synda's database;
+    empty if synda is not used or has no database
+    """
+    if SYNDA_TAPE['mode'] == 'replay' or which_synda('synda') is None:
+        return {}
+    return get_synda().checksums(file_ids)
+
+# ---- run a synda command
+def synda_run(args,stdin_data=None):
+    """
+    Runs synda with the args string e.g. 'install FILE' and
+    returns (stdout, returncode); recorded or replayed if
+    --record/--replay are on.
+    """
+    if SYNDA_TAPE['mode'] == 'replay':
+        return tape_read(args)
+    (out, returncode) = get_synda().run(args, stdin_data)
+    if SYNDA_TAPE['mode'] == 'record':
+        tape_write(args, out, returncode)
+    return out, returncode
+
+def synda_lines(args):
+    """
+    Same as synda_run() but a generator over the stdout
+    lines, read from the pipe as they arrive
+    """
+    if SYNDA_TAPE['mode'] == 'replay':
+        out, returncode = tape_read(args)
+        for line in out.splitlines(True):
+            yield line
+        return
+    done = None
+    if SYNDA_TAPE['mode'] == 'record':
+        done = lambda out, returncode: tape_write(args, out, returncode)
+    for line in get_synda().lines(args, done):
+        yield line
 
 # ---- cleanup duplicate entries in files
 def fix_duplicate_entries(outfile):
@@ -209,9 +334,12 @@ def fix_duplicate_entries(outfile):
     from a cache file
     """
     # ---- fixing the cache file for duplicates
-    ar = np.genfromtxt(outfile, dtype=str,delimiter='\n')
-    nar = np.unique(ar)
-    st(outfile,nar,fmt='%s')
+    # (sorted, stripped, no empty lines; same as the old numpy unique)
+    with open(outfile, 'r') as file:
+        nar = sorted(set([line.strip() for line in file if line.strip()]))
+    with open(outfile, 'w') as file:
+        for line in nar:
+            file.write(line + '\n')
 
 # ---- synda search
 def synda_search(model_data,varname):
@@ -222,6 +350,8 @@ def synda_search(model_data,varname):
     - a variable name as string e.g. 'tro3'
     It performs the search for files associated with these parameters and returns ALL
     available files. (command example: synda search -f CMIP5 MPI-ESM-LR Amon amip r1i1p1 tro3)
+    The files are returned as a SyndaRecord generator that reads the synda
+    output line by line, as it arrives.
 
     """
     # this is needed mostly for parallel processes that may
@@ -231,27 +361,18 @@ def synda_search(model_data,varname):
     else:
         print >> sys.stderr, "No synda executable found in path. Exiting."
         sys.exit(1)
-    synda_search = which_synda('synda') + ' search -f ' + model_data + ' ' + varname
-    proc = subprocess.Popen(synda_search, stdout=subprocess.PIPE, shell=True)
-    (out, err) = proc.communicate()
-    if err is not None:
-        print >> sys.stderr, "An error has occured while searching for data:"
-        print >> sys.stderr, err
-        sys.exit(1)
-    else:
-        return out
+    return parse_synda_search(synda_lines('search -f ' + model_data + ' ' + varname))
 
 # ---- cache via synda
 def write_cache_via_synda(searchoutput,varname,year1_model,year2_model,header,outfile,outfile2):
     """
     ----------------------------------------------
-    WARNING1: this function is SLOW
-    WARNING2: this function is not currently used
+    WARNING: this function is not currently used
     ----------------------------------------------
     This function takes the standard search output from synda (synda_search())
     and parses it to see if/what files exist locally
 
-    The searchoutput argument is a string and is of the form e.g.
+    The searchoutput argument is a SyndaRecord iterator (parse_synda_search()) over lines of the form e.g.
 
     new   221.2 MB  cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-195912.nc
     done  132.7 MB  cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_200001-200512.nc
@@ -261,6 +382,7 @@ def write_cache_via_synda(searchoutput,varname,year1_model,year2_model,header,ou
     against the required model file characterstics and files that comply and 
     exist locally are stored in a cache file for data reading. It also takes the year1_model and year2_model, for time checks.
     It also takes the variable name and the name of a cache file outfile that will be written to disk. 
+    The newest version of each file is picked from searchoutput itself, see latest_versions().
 
     """
     # this is needed mostly for parallel processes that may
@@ -272,81 +394,135 @@ def write_cache_via_synda(searchoutput,varname,year1_model,year2_model,header,ou
         sys.exit(1)
     with open(outfile, 'a') as file:
         file.close()
-    entries = searchoutput.split('\n')[:-1]
-    if len(entries)>0:
-        for entry in entries:
-            file_name = entry.split()[3]
-            if header.split('_')[1] == file_name.split('.')[3]:
-                time_range = file_name.split('_')[-1].strip('.nc')
-                time1 = time_range.split('-')[0]
-                time2 = time_range.split('-')[1]
-                year1 = date_handling(time1,time2)[0]
-                year2 = date_handling(time1,time2)[1]
-                if time_handling(year1, year1_model, year2, year2_model)[0] is True:
-                    file_name_complete = ".".join(file_name.split('.')[:10]) + '.' + varname + '.' + ".".join(file_name.split('.')[10:])
-                    true_file_name = file_name_complete.split('.')[-2]+'.'+file_name_complete.split('.')[-1]
-                    print('Matching file: %s' % true_file_name)
-                    # get the most recent file from datasource
-                    # synda will always list the most recent filedescriptor first
-                    synda_search = which_synda('synda') + ' search -f -l 1 ' + true_file_name
-                    proc = subprocess.Popen(synda_search, stdout=subprocess.PIPE, shell=True)
-                    (out, err) = proc.communicate()
-                    if len(out.split()) > 2:
-                        fc = out.split()[3]
-                        file_name_complete_final = ".".join(fc.split('.')[:10]) + '.' + varname + '.' + ".".join(fc.split('.')[10:])
-                        filepath_complete_0 = '/badc/cmip5/data/c' + file_name_complete_final.replace('.','/').strip('/nc') + '.nc'
-                        filepath_complete = "/".join(filepath_complete_0.split('/')[0:13]) + '/latest/' + "/".join(filepath_complete_0.split('/')[14:])
-                        print(filepath_complete)
-                        # ---- perform a local check file exists in /badc
-                        # ---- and write cache
-                        crf = filepath_complete.split('/')[-1]
-                        # ---- writing only files that match experiment type
-                        if header.split('_')[1] == crf.split('_')[2]:
-                            if os.path.exists(filepath_complete):
-                                with open(outfile, 'a') as file:
-                                    file.write(header + ' ' + filepath_complete + ' ' + out.split()[1] + out.split()[2] + '\n')
-                                    file.close()
-                                print('----------------------------------------------------')
-                            else:
-                                try:
-                                    s = open(filepath_complete)
-                                except IOError as ioex:
-                                    print 'err message:', os.strerror(ioex.errno)
-                                    print('Trying to look one directory up...')
-                                    probl = "/".join(filepath_complete.split('/')[0:-1])
-                                    fnd = 'find ' + probl +  ' -follow -iname "*.nc"'
-                                    proc = subprocess.Popen(fnd, stdout=subprocess.PIPE, shell=True)
-                                    (out, err) = proc.communicate()
-                                    prs = []
-                                    for s in out.split('\n')[0:-1]:
-                                        ssp = s.split('/')
-                                        av = ssp[-1]
-                                        # --- date handling
-                                        time_range = av.split('_')[-1].strip('.nc')
-                                        time1 = time_range.split('-')[0]
-                                        time2 = time_range.split('-')[1]
-                                        year1 = date_handling(time1,time2)[0]
-                                        year2 = date_handling(time1,time2)[1]
-                                        if time_handling(year1, yr1, year2, yr2)[0] is True:
-                                            if os.path.exists(s):
-                                                prs.append(s)
-                                                print('Found rogue file: %s' % s)
-                                                with open(outfile, 'a') as file:
-                                                    file.write(header + ' ' + s + '\n')
-                                    if len(prs)==0:
-                                        print('No files found...')
-                                        with open(outfile2, 'a') as file:
-                                            file.write(header + ' ' + 'ERROR ' + os.strerror(ioex.errno) + ' ' + filepath_complete + '\n')
-                                            file.close()
-                    else:
-                        print('something went wrong with parsing the data entry, calling this a non-existent file')
-                        with open(outfile2, 'a') as file:
-                            file.write(header + ' ' + 'ERROR ' + file_name_complete + ' could not be found' + '\n')
+    # newest version of each file, from this one search
+    latest = latest_versions(searchoutput)
+    for fc in latest:
+        if header.split('_')[1] == fc.model and fc.year1 is not None:
+            if time_handling(fc.year1, year1_model, fc.year2, year2_model)[0] is True:
+                print('Matching file: %s' % fc.basename)
+                filepath_complete = fc.local_path('/badc/cmip5/data/').replace('/' + fc.version + '/', '/latest/')
+                print(filepath_complete)
+                # ---- perform a local check file exists in /badc
+                # ---- and write cache
+                # ---- writing only files that match experiment type
+                if header.split('_')[1] == fc.basename.split('_')[2]:
+                    if os.path.exists(filepath_complete):
+                        with open(outfile, 'a') as file:
+                            file.write(header + ' ' + filepath_complete + ' ' + '%.1fMB' % (fc.size / 1e6) + '\n')
                             file.close()
-    else:
+                        print('----------------------------------------------------')
+                    else:
+                        try:
+                            s = open(filepath_complete)
+                        except IOError as ioex:
+                            print 'err message:', os.strerror(ioex.errno)
+                            print('Trying to look one directory up...')
+                            probl = "/".join(filepath_complete.split('/')[0:-1])
+                            fnd = 'find ' + probl +  ' -follow -iname "*.nc"'
+                            proc = subprocess.Popen(fnd, stdout=subprocess.PIPE, shell=True)
+                            (out, err) = proc.communicate()
+                            prs = []
+                            for s in out.split('\n')[0:-1]:
+                                ssp = s.split('/')
+                                av = ssp[-1]
+                                # --- date handling
+                                time_range = av.split('_')[-1].strip('.nc')
+                                time1 = time_range.split('-')[0]
+                                time2 = time_range.split('-')[1]
+                                year1 = date_handling(time1,time2)[0]
+                                year2 = date_handling(time1,time2)[1]
+                                if time_handling(year1, year1_model, year2, year2_model)[0] is True:
+                                    if os.path.exists(s):
+                                        prs.append(s)
+                                        print('Found rogue file: %s' % s)
+                                        with open(outfile, 'a') as file:
+                                            file.write(header + ' ' + s + '\n')
+                            if len(prs)==0:
+                                print('No files found...')
+                                with open(outfile2, 'a') as file:
+                                    file.write(header + ' ' + 'ERROR ' + os.strerror(ioex.errno) + ' ' + filepath_complete + '\n')
+                                    file.close()
+    if len(latest) == 0:
         print >> sys.stderr, "Could not find filedescriptor with the specified parameters on datasource"
         return 0
 
+# ---- registry of local datasources
+# root: root directory of the output1 tree on that datasource
+# version_dir: version directory convention; either a fixed
+# directory name (badc keeps a /latest/ dir for every dataset)
+# or 'newest' for trees that keep only the vYYYYMMDD dirs and
+# where we have to pick the most recent version ourselves
+# drs: layout of the directories below root, as used by get_drs()
+DRS_CMIP5 = 'institute/model/experiment/frequency/realm/table/ensemble/version/variable'
+DATASOURCES = {
+    'badc': {'root': '/badc/cmip5/data/cmip5/output1/',
+             'version_dir': 'latest',
+             'drs': DRS_CMIP5},
+    'dkrz': {'root': '/work/kd0956/CMIP5/data/cmip5/output1/',
+             'version_dir': 'newest',
+             'drs': DRS_CMIP5},
+    'sdt': {'root': '/sdt/data/cmip5/output1/',
+            'version_dir': 'newest',
+            'drs': DRS_CMIP5}
+}
+
+# ---- look up a datasource
+def get_datasource(dsname):
+    """
+    Function that returns the registry entry of a datasource.
+    dsname: either a registered datasource name e.g. badc, dkrz, sdt
+    or a user-defined root of the form NAME=ROOT e.g.
+    mymirror=/home/users/valeriu/cmip5/output1/
+    User-defined roots are assumed to follow the standard CMIP5 DRS;
+    their version dirs are resolved as 'newest' (that is latest/ if
+    present, the most recent vYYYYMMDD dir otherwise).
+    Returns (name, entry) or (name, None) if not registered.
+    """
+    if '=' in dsname:
+        name, root = dsname.split('=', 1)
+        entry = {'root': os.path.join(root, ''),
+                 'version_dir': 'newest',
+                 'drs': DRS_CMIP5}
+        return name, entry
+    return dsname, DATASOURCES.get(dsname)
+
+# ---- version dir as used in get_drs()
+def version_glob(version_dir):
+    """
+    Returns the path bit that replaces the version dir in the DRS:
+    /latest/ for fixed version dirs (badc), /*/ for 'newest' trees;
+    the latter need a call to pick_newest_version() on the found files.
+    """
+    if version_dir == 'newest':
+        return '/*/'
+    return '/' + version_dir + '/'
+
+# ---- keep only the most recent version of each dataset
+def pick_newest_version(ids,paths):
+    """
+    Function that filters the found files (ids in the PathStore paths)
+    for datasources that keep all versions e.g.
+    .../Amon/r1i1p1/v20120315/tro3/tro3_Amon_..._185001-200512.nc
+    .../Amon/r1i1p1/v20110901/tro3/tro3_Amon_..._185001-200512.nc
+    For each dataset (path without version) only the files in the latest/
+    dir (if any) or in the most recent vYYYYMMDD dir are kept.
+    The versions are read from the directory trie, no path is rebuilt.
+    """
+    def key_version(i):
+        vardir = paths.dir_of(i)
+        verdir = paths.parent(vardir)
+        return (paths.parent(verdir), paths.component(vardir)), paths.component(verdir)
+
+    newest = {}
+    for i in ids:
+        key, ver = key_version(i)
+        if key not in newest:
+            newest[key] = ver
+        elif newest[key] != 'latest':
+            if ver == 'latest' or ver > newest[key]:
+                newest[key] = ver
+    return [i for i in ids if newest[key_version(i)[0]] == key_version(i)[1]]
+
 # ---- function that returns the DRS
 def get_drs(dir1, sdir, ic, model, latest_dir):
     """
@@ -356,7 +532,9 @@ def get_drs(dir1, sdir, ic, model, latest_dir):
     ic: experiment - MPI-ESM-LR
     model: CMIP5 MPI-ESM-LR Amon amip r1i1p1
     latest_dir: on badc is /latest/ - this is known in advance
-    and is dependant on where the code is run.
+    and is dependant on where the code is run (see DATASOURCES and
+    version_glob()).
+    The layout built here is DRS_CMIP5.
     """
     # 3h
     if model[2] == '3h':
@@ -424,7 +602,7 @@ def lsladir(dirname):
     return res
 
 # ---- local file finder
-def find_local_files(model,out1,dirname1,mfile,latest_dir):
+def find_local_files(model,out1,dirname1,mfile,latest_dir,paths):
     """
     Function that performs local search for files using `find'
     The depth is as high as possible so that find is fast.
@@ -433,6 +611,9 @@ def find_local_files(model,out1,dirname1,mfile,latest_dir):
     instances of either Permission denied or non-existent dirs;
     latest_dir: latest version directory e.g. /latest/ on badc
     (see above for details)
+    paths: the PathStore of the run; the output of find goes
+    straight into it, line by line
+    Returns the ids of the files found in paths.
     """
     flist = []
     for st in out1:
@@ -451,64 +632,455 @@ def find_local_files(model,out1,dirname1,mfile,latest_dir):
                     strfindic = 'find ' + drs\
                                  +' -follow -type f -iname "*.nc"'
                     proc = subprocess.Popen(strfindic, stdout=subprocess.PIPE, shell=True)
-                    (out, err) = proc.communicate()
-                    for t in out.split('\n')[0:-1]:
-                        flist.append(t)
+                    for t in proc.stdout:
+                        flist.append(paths.add(t.rstrip('\n')))
+                    proc.wait()
+    # version dirs globbed: keep the newest version only
+    if latest_dir == '/*/':
+        flist = pick_newest_version(flist,paths)
     return flist
     # ---- done
 
+# ---- one-pass index of the variable dirs of a datasource
+def build_dir_index(dirname1,models):
+    """
+    Function that indexes a local datasource in a single pass:
+    one find call lists the variable directories (DRS_CMIP5 depth)
+    root/institute/model/experiment/frequency/realm/table/ensemble/version/variable
+    and returns a set of (model, experiment, table, ensemble, variable) tuples.
+    dirname1: root directory e.g. /badc/cmip5/data/cmip5/output1/
+    models: model names to restrict the index to; if any of them
+    is a wildcard the whole root is indexed.
+    """
+    if [m for m in models if '*' in m or '?' in m]:
+        fnd = 'find ' + dirname1 + ' -follow -mindepth 9 -maxdepth 9 -type d'
+    else:
+        fnd = 'find ' + " ".join([dirname1 + '*/' + m for m in models])\
+              + ' -follow -mindepth 7 -maxdepth 7 -type d'
+    proc = subprocess.Popen(fnd, stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'), shell=True)
+    (out, err) = proc.communicate()
+    index = set()
+    for t in out.split('\n')[0:-1]:
+        ssp = t.rstrip('/').split('/')
+        index.add((ssp[-8], ssp[-7], ssp[-4], ssp[-3], ssp[-1]))
+    return index
+
+# ---- expand wildcards and lists in param rows
+def expand_params(descriptors,dirname1,outfile,verbose=False):
+    """
+    Function that expands filedescriptors with * (or any fnmatch pattern)
+    and comma lists in the model, experiment, ensemble and variable columns e.g.
+    CMIP5 * Amon historical r1i1p1 1980 2005 tas,pr
+    Comma lists of plain names expand to all their combinations;
+    wildcards are resolved against build_dir_index() of the datasource,
+    built once for all rows. Explicit rows are passed through untouched.
+    Returns the expanded list of FileDescriptor's; if anything got expanded
+    the list is also written to outfile for reference.
+    """
+    import fnmatch, itertools
+    def is_wild(r):
+        return [c for c in ecols if ',' in r[c] or '*' in r[c] or '?' in r[c]]
+
+    ecols = (1, 3, 4, 7)
+    wild = [r for r in descriptors if is_wild(r)]
+    if not wild:
+        return descriptors
+    index = None
+    exprows = []
+    seen = set()
+    for r in descriptors:
+        if not is_wild(r):
+            exp = [r]
+        else:
+            pats = [r[c].split(',') for c in ecols]
+            if not [p for pl in pats for p in pl if '*' in p or '?' in p]:
+                # plain lists: every combination
+                exp = [FileDescriptor(r[0], m, r[2], e, ens, r[5], r[6], v)
+                       for m, e, ens, v in itertools.product(*pats)]
+            else:
+                if index is None:
+                    index = build_dir_index(dirname1, sorted(set([p for w in wild for p in w[1].split(',')])))
+                exp = []
+                for (m, e, tb, ens, v) in sorted(index):
+                    if tb != r[2]:
+                        continue
+                    if [1 for val, pl in zip((m, e, ens, v), pats) if not [p for p in pl if fnmatch.fnmatchcase(val, p)]]:
+                        continue
+                    exp.append(FileDescriptor(r[0], m, r[2], e, ens, r[5], r[6], v))
+            if verbose is True:
+                print('Expanded: ' + r.header())
+        for fd in exp:
+            if fd not in seen:
+                seen.add(fd)
+                exprows.append(fd)
+    with open(outfile, 'w') as file:
+        for r in exprows:
+            file.write(" ".join([str(c) for c in r]) + '\n')
+    print('Expanded %i param rows with wildcards/lists into %i filedescriptors (%s)' % (len(wild), len(exprows), outfile))
+    if verbose is True:
+        for r in exprows:
+            print(r.header())
+    return exprows
+
+# ---- group overlapping filedescriptors
+def coalesce_descriptors(descriptors):
+    """
+    Function that groups filedescriptors that differ only by their years e.g.
+    CMIP5 MPI-ESM-LR Amon historical r1i1p1 1900 1982 tro3
+    CMIP5 MPI-ESM-LR Amon historical r1i1p1 1980 2015 tro3
+    by (project, model, table, experiment, ensemble, variable) so that each
+    group is scanned/searched once and the results are sliced back to each row.
+    The union FileDescriptor spans the first to the last year of its members
+    (1900-2015) so it also spans any gap between them (1900-1950 and
+    1990-2015 give 1900-2015); member_years() has the years they need.
+    Returns a list of (union FileDescriptor, [member FileDescriptor's])
+    in the order the groups first appear.
+    """
+    groups = {}
+    order = []
+    for fd in descriptors:
+        key = fd[0:5] + (fd[7],)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(fd)
+    coalesced = []
+    for key in order:
+        members = groups[key]
+        ufd = members[0]._replace(year1=min([m.year1 for m in members]),
+                                  year2=max([m.year2 for m in members]))
+        coalesced.append((ufd, members))
+    return coalesced
+
+def member_years(members):
+    """
+    the set of years needed by the members of a coalesced group
+    """
+    years = set()
+    for m in members:
+        years.update(range(m.year1, m.year2 + 1))
+    return years
+
+# ---- in-memory results of a run
+class DescriptorResult(object):
+    """
+    What the stages of a run found for one filedescriptor; created
+    and updated in place through RunResults, see below.
+    local: set of the ids of the files on the local datasource in the
+    PathStore of the run (RunResults.paths)
+    missing: files are missing on the local datasource (ERROR-MISSING)
+    incomplete: set of the names of the files on disk of an incomplete filedescriptor
+    synda: set of (path, INSTALLED or NOT-YET-INSTALLED) from synda/ESGF
+    synda_missing: nothing from synda/ESGF either (ERROR-MISSING)
+    Slots, and no lists for what was not found, keep a run
+    with many filedescriptors small.
+    """
+    __slots__ = ('local', 'missing', 'incomplete', 'synda', 'synda_missing')
+
+    def __init__(self):
+        self.local = None
+        self.missing = False
+        self.incomplete = None
+        self.synda = None
+        self.synda_missing = False
+
+class RunResults(object):
+    """
+    One model of the results of a run, {header: DescriptorResult}:
+    write_cache_direct(), synda_dll() and install_plan() add to it and
+    final_cache() reads from it, instead of each stage writing and
+    re-reading its own text file. The text files of cache_files_[SERVER]
+    are written once, at the end, by write_cache_files() with the same
+    lines (sorted and unique) as before.
+    known: headers answered as missing by the missing store, not
+    searched for, see known_missing()
+    The add_ methods take lock: the scan thread and the search threads
+    of SyndaPipeline add at the same time.
+    paths: the PathStore of all the files found on the local datasource;
+    local files are kept as ids into it, the path strings are only
+    built by local_lines()
+    """
+    __slots__ = ('byheader', 'known', 'lock', 'paths')
+
+    def __init__(self):
+        import threading
+        from path_store import PathStore
+        self.byheader = {}
+        self.known = set()
+        self.lock = threading.Lock()
+        self.paths = PathStore()
+
+    def get(self, header):
+        r = self.byheader.get(header)
+        if r is None:
+            # setdefault: the stages of SyndaPipeline add from their own threads
+            r = self.byheader.setdefault(intern(header), DescriptorResult())
+        return r
+
+    def add_local(self, header, pid):
+        # pid: id of the file in self.paths
+        with self.lock:
+            r = self.get(header)
+            if r.local is None:
+                r.local = set()
+            r.local.add(pid)
+
+    def add_missing(self, header, fname=None):
+        # fname: a file already on disk of an incomplete filedescriptor
+        with self.lock:
+            r = self.get(header)
+            if fname is None:
+                r.missing = True
+            else:
+                if r.incomplete is None:
+                    r.incomplete = set()
+                r.incomplete.add(fname)
+
+    def add_synda(self, header, path, status):
+        with self.lock:
+            r = self.get(header)
+            if r.synda is None:
+                r.synda = set()
+            r.synda.add((path, status))
+
+    def add_synda_missing(self, header):
+        with self.lock:
+            self.get(header).synda_missing = True
+
+    def add_known_missing(self, header, synda=False):
+        # missing as before, locally and, if synda is searched, on ESGF
+        self.add_missing(header)
+        if synda is True:
+            self.add_synda_missing(header)
+        with self.lock:
+            self.known.add(header)
+
+    def is_missing(self, header):
+        r = self.byheader.get(header)
+        return r is not None and (r.missing is True or r.incomplete is not None)
+
+    def missing_headers(self):
+        """
+        CMIP5 headers that synda has to look for, in the order
+        of the missing cache file
+        """
+        return sorted([h for h in self.byheader if self.needs_search(h)])
+
+    def needs_search(self, header):
+        # missing or incomplete, CMIP5, not known to be missing on ESGF
+        return self.is_missing(header) and header.split('_')[0] == 'CMIP5' and header not in self.known
+
+    def on_disk(self, header):
+        # files already on disk of a header synda looks for,
+        # missing altogether is the single 'dope' file
+        if self.byheader[header].missing is True:
+            return ['dope']
+        return sorted(self.byheader[header].incomplete)
+
+    def incomplete_files(self):
+        """
+        {header: files already on disk} of the headers that synda looks
+        for; missing altogether is the single 'dope' file
+        """
+        return dict([(h, self.on_disk(h)) for h in self.missing_headers()])
+
+    # the lines of each cache file, sorted in place
+    def local_lines(self):
+        paths = self.paths
+        # (a file found twice has two ids)
+        lines = list(set([h + ' ' + paths[i] for h, r in self.byheader.iteritems() for i in r.local or ()]))
+        lines.sort()
+        return lines
+
+    def missing_lines(self):
+        lines = []
+        for h, r in self.byheader.iteritems():
+            if r.missing is True:
+                lines.append(h + ' ERROR-MISSING')
+            for fname in r.incomplete or []:
+                lines.append(h + ' INCOMPLETE ' + fname)
+        lines.sort()
+        return lines
+
+    def synda_lines(self):
+        lines = [h + ' ' + p + ' ' + s for h, r in self.byheader.iteritems() for p, s in r.synda or []]
+        lines.sort()
+        return lines
+
+    def synda_missing_lines(self):
+        lines = [h + ' ERROR-MISSING' for h, r in self.byheader.iteritems() if r.synda_missing is True]
+        lines.sort()
+        return lines
+
+    def installed_files(self):
+        """
+        sorted (header, path) of the files that should be on disk: the
+        local ones and the synda ones installed (or done), if they are
+        there; dry run and queued installs are not, see verify_cache()
+        """
+        paths = self.paths
+        found = set()
+        for h, r in self.byheader.iteritems():
+            for i in r.local or ():
+                found.add((h, paths[i]))
+            for p, s in r.synda or ():
+                if s in ('INSTALLED', 'done') and os.path.exists(p):
+                    found.add((h, p))
+        return sorted(found)
+
+    def combined_lines(self):
+        """
+        lines of cache_cmip5_combined_[SERVER].txt: the local files and
+        the synda ones, see cache_merge(); one of them if the other is empty
+        """
+        local = self.local_lines()
+        synda = self.synda_lines()
+        if local and synda:
+            return cache_merge(local, synda)
+        return local or synda
+
+# ---- slice cache lines of a coalesced group back to its rows
+def slice_cache_lines(results,groups):
+    """
+    Function that hands the synda files found for coalesced groups
+    (union header) over to each member filedescriptor whose years
+    the file overlaps.
+    results: RunResults
+    groups: dictionary union header: [member FileDescriptor's]
+    Headers not in groups are kept as they are.
+    """
+    found = {}
+    for uheader in groups:
+        r = results.byheader.get(uheader)
+        if r is not None and r.synda:
+            found[uheader] = r.synda
+            r.synda = None
+    for uheader, files in found.items():
+        for path, status in files:
+            y = path.split('/')[-1].strip('.nc').split('_')[-1].split('-')
+            for m in groups[uheader]:
+                if len(y) == 2:
+                    year1, year2 = date_handling(y[0],y[1])
+                    if time_handling(year1, m.year1, year2, m.year2)[0] is not True:
+                        continue
+                results.add_synda(m.header(), path, status)
+
+# ---- text files of a run
+def write_cache_files(results,drb,d,syndacall=False):
+    """
+    Writes the cache files of datasource d to drb from results, once:
+    cache_cmip5_[d].txt, missing_cache_cmip5_[d].txt, the synda ones
+    and the combined ones; files with no lines are not written.
+    Returns the lines of the combined cache.
+    """
+    def write_lines(fname, lines):
+        if lines:
+            with open(os.path.join(drb, fname), 'w') as file:
+                for line in lines:
+                    file.write(line + '\n')
+
+    write_lines('cache_cmip5_' + d + '.txt', results.local_lines())
+    missing = results.missing_lines()
+    write_lines('missing_cache_cmip5_' + d + '.txt', missing)
+    if syndacall is True:
+        write_lines('cache_cmip5_synda_' + d + '.txt', results.synda_lines())
+        missing = results.synda_missing_lines()
+        write_lines('missing_cache_cmip5_synda_' + d + '.txt', missing)
+    write_lines('missing_cache_cmip5_combined_' + d + '.txt', missing)
+    del missing
+    combined = results.combined_lines()
+    write_lines('cache_cmip5_combined_' + d + '.txt', combined)
+    return combined
+
 # ---- cache local data
-def write_cache_direct(params_file,ldir,rdir,outfile,outfile2,errfile,ld,verbose=False):
+def write_cache_direct(descriptors,ldir,rdir,results,errfile,ld,verbose=False,found=None):
     """
     Function that does direct parsing of available datasource files and establishes
     the paths to the needed files; makes use of find_local_files()
+    descriptors: unique FileDescriptor's e.g. from read_params();
+    rows differing only by years are scanned once, see coalesce_descriptors()
     File versioning is controlled by finding the ld = e.g. /latest/ dir 
     in the badc datasource, this may differ on other clusters and should be correctly
     hardcoded in the code!
+    With --introspect the years of the files come from their time coordinate,
+    all files read at once after the scan, see file_time_ranges().
+    The files found and the missing ones are added to results (RunResults);
+    found, if given, is called with the (union FileDescriptor, members) of
+    each group as soon as they are, see SyndaPipeline.
 
     """
-    car = np.genfromtxt(params_file, dtype=str, delimiter='\n')
-    # ---- eliminate duplicates from input file, if any
-    nar = np.unique(car)
-    prfile = 'prepended_' + params_file
-    if len(nar) == 1:
-        with open(prfile, 'a') as file:
-            file.write(nar)
-            file.write('\n')
-            file.write(nar)
-    else:
-        st(prfile,nar,fmt='%s')
-    itemlist = lt(prfile,dtype=str)
-    lenitemlist = len(itemlist)
-    for item in itemlist:
-        arname = find_local_files(item,ldir,rdir,errfile,ld)
-        if len(arname) > 0:
+    # one scan per group, the rows only differ by their years; the paths
+    # of all groups go to the one compact store of the run, see path_store.py
+    paths = results.paths
+    scanned = []
+    for ufd, members in coalesce_descriptors(descriptors):
+        t0 = time.time()
+        ids = find_local_files(ufd,ldir,rdir,errfile,ld,paths)
+        if introspectOn is True:
+            scanned.append((ufd, members, ids, time.time() - t0))
+            continue
+        cache_direct_group(members,paths,ids,{},results,verbose)
+        PROGRESS.scanned(len(members), len(ids), time.time() - t0)
+        if found is not None:
+            found(ufd, members)
+    if introspectOn is True:
+        t0 = time.time()
+        times = file_time_ranges([paths[i] for group in scanned for i in group[2]])
+        # the time coordinates are read once for all groups
+        tread = (time.time() - t0) / max(len(scanned), 1)
+        for ufd, members, ids, dt in scanned:
+            t0 = time.time()
+            cache_direct_group(members,paths,ids,times,results,verbose)
+            PROGRESS.scanned(len(members), len(ids), dt + tread + time.time() - t0)
+            if found is not None:
+                found(ufd, members)
+    if not [r for r in results.byheader.values() if r.local]:
+        print >> sys.stderr, "WARNING: could not cache any data from local datasource"
+    if not [h for h in results.byheader if results.is_missing(h)]:
+        print >> sys.stderr, "Cached all needed data from local datasource. Looks like there are no missing files, huzzah!"
+
+def cache_direct_group(members,paths,ids,times,results,verbose=False):
+    """
+    Adds the files found for a group of filedescriptors (ids in the
+    PathStore paths) to the results of each member, complete or
+    incomplete, or the members as missing;
+    times: {path: (first, last yyyymm, ...)} from --introspect
+    """
+    # years of each file, once for all the members
+    files = []
+    for i in ids:
+        s = paths[i]
+        av = paths.name(i)
+        time_range = av.split('_')[-1].strip('.nc')
+        if times.get(s) is not None:
+            year1 = times[s][0] // 100
+            year2 = times[s][1] // 100
+        elif len(time_range.split('-')) == 2:
+            time1 = time_range.split('-')[0]
+            time2 = time_range.split('-')[1]
+            year1 = date_handling(time1,time2)[0]
+            year2 = date_handling(time1,time2)[1]
+        else:
+            print('File: _date1-date2.nc not properly formatted...skipping it')
+            continue
+        files.append((i, s, year1, year2, os.path.exists(s)))
+    for item in members:
+        if ids:
             var = item[7]
-            header = item[0] + '_'+ item[1] + '_' + item[2]\
-                         + '_' + item[3] + '_' + item[4] + '_' + item[5]\
-                         + '_' + item[6] + '_' + item[7]
-            yr1 = int(item[5])
-            yr2 = int(item[6])
-            for s in arname:
-                ssp = s.split('/')
-                av = ssp[-1]
-                time_range = av.split('_')[-1].strip('.nc')
-                time1 = time_range.split('-')[0]
-                time2 = time_range.split('-')[1]
-                year1 = date_handling(time1,time2)[0]
-                year2 = date_handling(time1,time2)[1]
+            header = item.header()
+            yr1 = item[5]
+            yr2 = item[6]
+            for i, s, year1, year2, exists in files:
                 # case where the required data completely overlaps
                 # available data
                 # this case stops the code to make a call to synda for this filedescriptor
                 if time_handling(year1, yr1, year2, yr2)[0] is True and time_handling(year1, yr1, year2, yr2)[1] is True:
-                    if os.path.exists(s):
-                        with open(outfile, 'a') as file:
-                            file.write(header + ' ' + s + '\n')
+                    if exists:
+                        results.add_local(header, i)
                         if verbose is True:
                             print('Cached file from local datasource: ' + s)
                     else:
-                        with open(outfile2, 'a') as file:
-                            file.write(header + ' ERROR-MISSING' + '\n')
+                        results.add_missing(header)
                         if verbose is True:
                             print('WARNING: missing from local datasource: ' +  header)
                 # case where the required data is not fully found
@@ -518,77 +1090,53 @@ def write_cache_direct(params_file,ldir,rdir,outfile,outfile2,errfile,ld,verbose
                 # she can find it...just maybe
                 # also we must make sure she doesnt download what we already have
                 if time_handling(year1, yr1, year2, yr2)[0] is True and time_handling(year1, yr1, year2, yr2)[1] is False:
-                    if os.path.exists(s):
-                        with open(outfile, 'a') as file:
-                            file.write(header + ' ' + s + '\n')
+                    if exists:
+                        results.add_local(header, i)
                         if verbose is True:
                             print('Cached file from local datasource: ' + s)
-                        sfn = s.split('/')[-1]
-                        with open(outfile2, 'a') as file:
-                            # the INCOMPLETE indicator will be used
-                            # to label partially complete filedescriptors so synda can
-                            # look for the missing bits and hopefully complete it
-                            file.write(header + ' INCOMPLETE ' + sfn + '\n')
+                        sfn = paths.name(i)
+                        # the INCOMPLETE indicator will be used
+                        # to label partially complete filedescriptors so synda can
+                        # look for the missing bits and hopefully complete it
+                        results.add_missing(header, sfn)
                     else:
-                        with open(outfile2, 'a') as file:
-                            file.write(header + ' ERROR-MISSING' + '\n')
+                        results.add_missing(header)
                         if verbose is True:
                             print('WARNING: missing from local datasource: ' +  header)
         else:
-            with open(outfile2, 'a') as file:
-                # missing entirely
-                file.write("_".join(item) + ' ERROR-MISSING' + '\n')
+            # missing entirely
+            results.add_missing(item.header())
             if verbose is True:
-                print('WARNING: missing from local datasource: ' + "_".join(item))
-    if os.path.exists(outfile):
-        fix_duplicate_entries(outfile)
-    else:
-        print >> sys.stderr, "WARNING: could not cache any data from local datasource"
-    if os.path.exists(outfile2):
-        fix_duplicate_entries(outfile2)
-    else:
-        print >> sys.stderr, "Cached all needed data from local datasource. Looks like there are no missing files, huzzah!"
+                print('WARNING: missing from local datasource: ' + item.header())
 
 # ---- print some stats
-def print_stats(outfile1,outfile2):
+def print_stats(lines1,lines2):
     """
     small function to print some stats at the end
+    lines1, lines2: cache and missing cache lines, see RunResults
     """
-    if os.path.exists(outfile1) and os.path.exists(outfile2):
-        ar1 = np.genfromtxt(outfile1, dtype=str,delimiter='\n')
-        ar2 = np.genfromtxt(outfile2, dtype=str,delimiter='\n')
-        # force to a 1-liner
-        if ar1.ndim == 0:
-            f = 1
-        else:
-            f = len(ar1)
-        if ar2.ndim == 0:
-            m = 1
-        else:
-            m = len(ar2)
+    if lines1 and lines2:
+        f = len(lines1)
+        m = len(lines2)
         print('\n###############################################################')
         print('  Found and cached: %i individual .nc files cached' % f)
         print('Missing/incomplete: %i individual datasets NOT cached/incomplete' % m)
         print('#################################################################\n')
-    elif os.path.exists(outfile1) and os.path.exists(outfile2) is False:
-        ar1 = np.genfromtxt(outfile1, dtype=str,delimiter='\n')
-        if ar1.ndim == 0:
-            f = 1
-        else:
-            f = len(ar1)
+    elif lines1:
+        f = len(lines1)
         print('\n########################################################')
         print('Found and cached: %i individual .nc files cached' % f)
         print('########################################################\n')
-    elif os.path.exists(outfile1) is False:
+    else:
         print('Shoot! No cache written this time around...') 
 
 # ---- synda download
-def synda_dll(searchoutput,varname,year1_model,year2_model,header,D,outfile,outfile2,download=False,dryrunOn=False,verbose=False):
+def synda_dll(searchoutput,varname,year1_model,year2_model,header,D,results,download=False,dryrunOn=False,verbose=False,plan=None,years=None):
     """
     This function takes the standard search output from synda
     and parses it to see if/what files need to be downloaded
 
-    The searchoutput argument is a string and is of the form e.g.
+    The searchoutput argument is a SyndaRecord iterator (parse_synda_search()) over lines of the form e.g.
 
     new   221.2 MB  cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-195912.nc
     done  132.7 MB  cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_200001-200512.nc
@@ -597,124 +1145,1231 @@ def synda_dll(searchoutput,varname,year1_model,year2_model,header,D,outfile,outf
     ie typical synda file search output. This gets parsed in and analyzed
     against the required model file characterstics and files that comply can
     be downloaded via synda install. It also takes the year1_model and year2_model, for time checks.
-    It also takes the variable name and the name of a cache file outfile that will be written to disk. 
+    It also takes the variable name and the RunResults the files found are added to.
     dryrunOn is the switch from a physical download to just polling the esgf node without any download.
 
     varname: variable
     D: incomplete filedescriptors: the dictionary that contains the files that are already available locally
     year1_model, year2_model: needed filedescriptor year1 and 2
     header: unique filedescriptor indicator e.g. CMIP5_CNRM-CM5_Amon_historical_r1i1p1_2003_2010_hus
-    outfile: cache file
-    outfile2: missing cache file
+    results: RunResults
     download: download (either dryrun or for reals) flag 
+    plan: if a dict (see plan_downloads()) the new files are not installed here
+    but collected in plan, together with the years already on disk
+    years: for a coalesced group, the years its members need (member_years());
+    files that only cover a gap between the members are skipped
+    Only the newest version of each file is looked at, see latest_versions().
     
     """
     # this is needed mostly for parallel processes that may
     # go tits-up from time to time due to random path mixes
-    if which_synda('synda') is not None:
+    # (synda is only needed here to install, see --esgf-search)
+    if which_synda('synda') is not None or ESGF is not None and (download is False or dryrunOn is True or DOWNLOADER is not None):
         pass
     else:
         print >> sys.stderr, "No synda executable found in path. Exiting."
         sys.exit(1)
-    entries = searchoutput.split('\n')[:-1]
-    if len(entries) > 0:
-        for entry in entries:
-            label=str(entry.split()[0])
-            file_name = entry.split()[3]
-            if header.split('_')[1] == file_name.split('.')[3]:
-                time_range = file_name.split('_')[-1].strip('.nc')
-                time1 = time_range.split('-')[0]
-                time2 = time_range.split('-')[1]
-                year1 = date_handling(time1,time2)[0]
-                year2 = date_handling(time1,time2)[1]
-                if time_handling(year1, year1_model, year2, year2_model)[0] is True:
-                    if label=='done':
-                        file_name_complete = ".".join(file_name.split('.')[:10]) + '.' + varname + '.' + ".".join(file_name.split('.')[10:])
-                        filepath_complete = '/sdt/data/c' + file_name_complete.replace('.','/').strip('/nc') + '.nc'
-                        fn = filepath_complete.split('/')[-1]
-                        # synda should not cache files in dictionary D
-                        # these belong to incomplete filedescriptors but are already on disk
-                        if fn not in D[header]:
-                            with open(outfile, 'a') as file:
-                                file.write(header + ' ' + filepath_complete + ' ' + 'INSTALLED' + '\n')
-                            if verbose is True:
-                                print('File exists in local /sdt/data, path: ' + filepath_complete)
-                                # no download #
-                    elif label=='new':
-                        if download is True:
-                            file_name_new = ".".join(file_name.split('.')[:10]) + '.' + varname + '.' + ".".join(file_name.split('.')[10:])
-                            filepath_new = '/sdt/data/c' + file_name_new.replace('.','/').strip('/nc') + '.nc'
-                            fn = filepath_new.split('/')[-1]
-                            # synda should not download files in dictionary D
-                            # these belong to incomplete filedescriptors but are already on disk
-                            if fn not in D[header]:
-                                if dryrunOn is True:
-                                    if verbose is True:
-                                        print('Needed file %s doesnt exist in local /sdt/data but is on ESGF nodes, enable download to get it' % file_name)
-                                        print('Download enabled in dryrun mode...')
-                                        print('Synda found file: ' + file_name)
-                                        print('If installed, full path would be: ' + filepath_new)
-                                    with open(outfile, 'a') as file:
-                                        file.write(header + ' ' + filepath_new + ' ' + 'NOT-YET-INSTALLED' + '\n')
-                                        # no download, dryrun only #
-                                else:
-                                    synda_install = which_synda('synda') +  ' install ' + file_name
-                                    proc = subprocess.Popen(synda_install, stdout=subprocess.PIPE, stdin=subprocess.PIPE, shell=True)
-                                    dll ='\n'
-                                    (out, err) = proc.communicate(input=dll)
-                                    if err is not None:
-                                        print >> sys.stderr, "An error has occured while starting the download:"
-                                        print >> sys.stderr, err
-                                        sys.exit(1)
-                                    else:
-                                        with open(outfile, 'a') as file:
-                                            file.write(header + ' ' + filepath_new + ' ' + 'INSTALLED' + '\n')
-                                    if verbose is True:
-                                        print('Needed file %s doesnt exist in local /sdt/data but is on ESGF nodes' % file_name)
-                                        print('Download enabled in full install mode...')
-                                        print('Downloading file: ' + file_name)
-                                        print('Full path: ' + filepath_new)
-                                        # yes download #
+    if plan is not None:
+        # years the filedescriptor already has on disk
+        have = plan['have'].setdefault(header, set())
+        for fn in D.get(header, []):
+            have.update(file_years(fn))
+    nrec = 0
+    for rec in latest_versions(searchoutput):
+        nrec += 1
+        if header.split('_')[1] == rec.model:
+            if rec.year1 is not None and time_handling(rec.year1, year1_model, rec.year2, year2_model)[0] is True:
+                # synda should not cache or download files in dictionary D
+                # these belong to incomplete filedescriptors but are already on disk
+                if rec.basename in D[header]:
+                    continue
+                if years is not None and years.isdisjoint(xrange(rec.year1, rec.year2 + 1)):
+                    continue
+                if DOWNLOADER is not None and rec.url:
+                    filepath = rec.local_path(DOWNLOADER.root)
                 else:
+                    filepath = rec.local_path()
+                if rec.status == 'done':
+                    if plan is not None:
+                        plan['have'][header].update(range(rec.year1, rec.year2 + 1))
+                    results.add_synda(header, filepath, 'INSTALLED')
                     if verbose is True:
-                        print('WARNING: synda - not cached due to requested period mismatch: ' + header + ' ' + file_name)
-                    return 0
+                        print('File exists in local /sdt/data, path: ' + filepath)
+                        # no download #
+                elif rec.status == 'new' and download is True:
+                    if plan is not None:
+                        # keep only the newest version of each file, the
+                        # scheduler decides what gets installed and when
+                        if rec.basename not in plan['files'] or plan['files'][rec.basename][0] < rec.version:
+                            plan['files'][rec.basename] = (rec.version, rec.file_name, filepath, rec.size,
+                                                           set(range(rec.year1, rec.year2 + 1)), header, rec)
+                    elif dryrunOn is True:
+                        if verbose is True:
+                            print('Needed file %s doesnt exist in local /sdt/data but is on ESGF nodes, enable download to get it' % rec.file_name)
+                            print('Download enabled in dryrun mode...')
+                            print('Synda found file: ' + rec.file_name)
+                            print('If installed, full path would be: ' + filepath)
+                        results.add_synda(header, filepath, 'NOT-YET-INSTALLED')
+                        # no download, dryrun only #
+                    else:
+                        (out, returncode) = synda_run('install ' + rec.file_name, stdin_data='\n')
+                        if returncode != 0:
+                            print >> sys.stderr, "An error has occured while starting the download:"
+                            print >> sys.stderr, out
+                        else:
+                            results.add_synda(header, filepath, 'INSTALLED')
+                        if verbose is True:
+                            print('Needed file %s doesnt exist in local /sdt/data but is on ESGF nodes' % rec.file_name)
+                            print('Download enabled in full install mode...')
+                            print('Downloading file: ' + rec.file_name)
+                            print('Full path: ' + filepath)
+                            # yes download #
             else:
                 if verbose is True:
-                    print('WARNING: synda - not cached due to model mismatch: ' + header + ' ' + file_name)
+                    print('WARNING: synda - not cached due to requested period mismatch: ' + header + ' ' + rec.file_name)
                 return 0
-    else:
+        else:
+            if verbose is True:
+                print('WARNING: synda - not cached due to model mismatch: ' + header + ' ' + rec.file_name)
+            return 0
+    if nrec == 0:
         if verbose is True:
             print('WARNING: synda - missing data altogether: ' + header)
         return 0
-    if os.path.exists(outfile):
-        fix_duplicate_entries(outfile)
 
-def cache_merge(file1,file2,finalFile):
+# ---- years covered by a data file
+def file_years(fname):
     """
-    Function that takes two cache files and merges them
-    into a single one. Caution -- note the order:
-    file1 = local datasource cache
-    file2 = local synda cache
-    """
-    f1 = open(file1, 'r')
-    f2 = open(file2, 'r')
-    ff = open(finalFile, 'w')
-    r1 = f1.readlines()
-    r2 = f2.readlines()
-    for b in r2:
-        for a in r1:
-            if a.split()[1].split('/')[-1] == b.split()[1].split('/')[-1]:
-                ff.write(a.split()[0] + ' ' + a.split()[1] + '\n')
+    returns the set of years covered by a data file
+    e.g. tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-199912.nc
+    """
+    time_range = fname.split('/')[-1].split('_')[-1].strip('.nc')
+    if len(time_range.split('-')) != 2:
+        return set()
+    year1, year2 = date_handling(time_range.split('-')[0],time_range.split('-')[1])
+    return set(range(year1, year2 + 1))
+
+# ---- download scheduler
+def plan_downloads(plan,groups,max_bytes=None):
+    """
+    Orders the new files collected by synda_dll(..., plan=plan) so that
+    the most filedescriptors reach complete coverage first, within a
+    disk budget of max_bytes (None means no budget). Coverage is counted
+    in years, against the years each filedescriptor already has on disk.
+    First pass: repeatedly pick the filedescriptor that is cheapest to
+    complete (files already picked cost nothing) and fits the budget;
+    second pass: fill what is left of the budget with the files that add
+    the most coverage per byte to filedescriptors that can not be completed.
+
+    plan: {'files': {file: (version, synda file name, /sdt path, bytes, years, header, SyndaRecord)},
+           'have': {header: years on disk}}
+    groups: header -> member FileDescriptor's (see coalesce_descriptors())
+    Returns (steps, skipped); steps is the ordered list of
+    (synda file name, /sdt path, bytes, header, completed member headers, SyndaRecord)
+    and skipped the useful files left out by the budget.
+    """
+    # years still needed by each member filedescriptor
+    need = {}
+    for header, members in groups.items():
+        have = plan['have'].get(header, set())
+        for m in members:
+            need[m.header()] = (header, set(range(m.year1, m.year2 + 1)),
+                                set(range(m.year1, m.year2 + 1)) - have)
+    by_header = {}
+    for fbase in sorted(plan['files']):
+        by_header.setdefault(plan['files'][fbase][5], []).append(fbase)
+    got = {}
+    chosen = []
+    spent = [0]
+    done = set([mh for mh in need if not need[mh][2]])
+
+    def still_missing(mh):
+        return need[mh][2] - got.get(need[mh][0], set())
+
+    def take(fbase):
+        version, file_name, filepath, size, years, header, rec = plan['files'][fbase]
+        got.setdefault(header, set()).update(years)
+        spent[0] += size
+        completed = []
+        for mh in sorted(need):
+            if need[mh][0] == header and mh not in done and not still_missing(mh):
+                done.add(mh)
+                completed.append(mh)
+        chosen.append((file_name, filepath, size, header, completed, rec))
+
+    def fits(cost):
+        return max_bytes is None or spent[0] + cost <= max_bytes
+
+    taken = set()
+    # ---- first pass: complete as many filedescriptors as possible
+    while True:
+        best = None
+        for mh in sorted(need):
+            if mh in done:
+                continue
+            miss = still_missing(mh)
+            fl = [f for f in by_header.get(need[mh][0], [])
+                  if f not in taken and plan['files'][f][4] & miss]
+            cover = set()
+            for f in fl:
+                cover.update(plan['files'][f][4])
+            if not miss <= cover:
+                # ESGF does not have the years either
+                continue
+            cost = sum([plan['files'][f][3] for f in fl])
+            if fits(cost) and (best is None or cost < best[0]):
+                best = (cost, fl)
+        if best is None:
+            break
+        for f in sorted(best[1], key=lambda f: min(plan['files'][f][4] or [0])):
+            taken.add(f)
+            take(f)
+    # ---- second pass: best coverage gain per byte for the rest
+    while True:
+        best = None
+        for f in sorted(plan['files']):
+            if f in taken or not fits(plan['files'][f][3]):
+                continue
+            gain = 0.
+            for mh in need:
+                if need[mh][0] == plan['files'][f][5] and mh not in done:
+                    gain += len(plan['files'][f][4] & still_missing(mh)) / float(len(need[mh][1]))
+            if gain > 0:
+                score = gain / max(plan['files'][f][3], 1)
+                if best is None or score > best[0]:
+                    best = (score, f)
+        if best is None:
+            break
+        taken.add(best[1])
+        take(best[1])
+    # ---- what the budget left out, only files that would have helped
+    skipped = []
+    for f in sorted(plan['files']):
+        if f not in taken:
+            version, file_name, filepath, size, years, header, rec = plan['files'][f]
+            if [mh for mh in need if need[mh][0] == header and years & still_missing(mh)]:
+                skipped.append((file_name, filepath, size, header))
+    return chosen, skipped
+
+# ---- install (or dry run) a download plan
+def install_plan(steps,skipped,results,max_bytes=None,dryrunOn=False,verbose=False,installed=False):
+    """
+    Installs the files of a plan_downloads() plan in order and adds
+    them to the synda files of results (NOT-YET-INSTALLED in dryrun mode);
+    in dryrun mode the whole plan is printed with its totals.
+    installed: the steps were installed already (see SyndaPipeline),
+    only print the plan.
+    With --http-download the files that have an HTTP url are fetched
+    by DOWNLOADER, all at once, and only the rest go to synda install.
+    """
+    tot = sum([st[2] for st in steps])
+    ncomp = sum([len(st[4]) for st in steps])
+    if max_bytes is None:
+        budget = 'no budget'
+    else:
+        budget = 'budget %.2f GB' % (max_bytes / 1e9)
+    if dryrunOn is True or verbose is True:
+        print('\n-----------------------------------------------------------------------')
+        print('Download plan (%s):' % budget)
+        print('-----------------------------------------------------------------------')
+        for i, st in enumerate(steps):
+            print('%4i %10.1f MB  %s' % (i + 1, st[2] / 1e6, st[0]))
+            for mh in st[4]:
+                print('                     completes %s' % mh)
+    if installed is not True:
+        install_steps(steps,results,dryrunOn,verbose)
+    print('Planned downloads: %i files, %.2f GB (%s); filedescriptors completed: %i' % (len(steps), tot / 1e9, budget, ncomp))
+    if len(skipped) > 0:
+        print('Left out by the budget: %i files, %.2f GB' % (len(skipped), sum([sk[2] for sk in skipped]) / 1e9))
+        if verbose is True:
+            for sk in skipped:
+                print('   not planned: ' + sk[0])
+
+def install_steps(steps,results,dryrunOn=False,verbose=False):
+    """
+    Installs the steps of a plan_downloads() plan, see install_plan()
+    """
+    t0 = time.time()
+    jobs = []
+    for st in steps:
+        if dryrunOn is True:
+            results.add_synda(st[3], st[1], 'NOT-YET-INSTALLED')
+        elif DOWNLOADER is not None and st[5].url:
+            jobs.append((st[5].url, st[1], st[2], st[5].checksum, st[5].checksum_type))
+        elif which_synda('synda') is None:
+            print >> sys.stderr, "No HTTP url for %s and no synda to install it" % st[0]
+        else:
+            (out, returncode) = synda_run('install ' + st[0], stdin_data='\n')
+            if returncode != 0:
+                print >> sys.stderr, "An error has occured while starting the download:"
+                print >> sys.stderr, out
             else:
-                ff.write(a.split()[0] + ' ' + a.split()[1] + '\n')
-                ff.write(b.split()[0] + ' ' + b.split()[1] + '\n')
-    ff.close()
-    if os.path.exists(finalFile):
-        fix_duplicate_entries(finalFile)                
+                results.add_synda(st[3], st[1], 'INSTALLED')
+            if verbose is True:
+                print('Downloading file: ' + st[0])
+    if jobs:
+        errors = DOWNLOADER.fetch_many(jobs)
+        for st in steps:
+            if st[1] in errors and errors[st[1]] is None:
+                results.add_synda(st[3], st[1], 'INSTALLED')
+    if dryrunOn is not True and steps:
+        PROGRESS.installed(len(steps), sum([st[2] for st in steps]), time.time() - t0)
+
+# ---- pipelined local scan -> synda search -> install (--synda runs)
+# size of the queues between the stages, set by --pipeline-queue
+PIPELINE_QUEUE = 8
+
+class PipelineStage(object):
+    """
+    One stage of SyndaPipeline: its bounded input queue and worker
+    threads, and what it did: items, busy time, idle time (waiting for
+    input), time blocked on a full output queue and the depth of its
+    input queue at each get (max and mean). Times are summed over the
+    threads of the stage.
+    """
+    def __init__(self, name, maxsize, nthreads=1):
+        import Queue, threading
+        self.name = name
+        self.queue = Queue.Queue(maxsize)
+        self.nthreads = nthreads
+        self.lock = threading.Lock()
+        self.items = 0
+        self.busy = 0.
+        self.idle = 0.
+        self.blocked = 0.
+        self.gets = 0
+        self.depth_max = 0
+        self.depth_sum = 0
+        self.threads = []
+        self.error = None
+
+    def start(self, work, out=None):
+        """
+        starts the threads: each item of the input queue goes to
+        work(item), which returns the items for the out stage;
+        None in the queue stops a thread
+        """
+        import threading
+        for i in range(self.nthreads):
+            thread = threading.Thread(target=self.run, args=(work, out))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self, work, out):
+        while True:
+            t0 = time.time()
+            depth = self.queue.qsize()
+            item = self.queue.get()
+            t1 = time.time()
+            with self.lock:
+                self.idle += t1 - t0
+                self.gets += 1
+                self.depth_sum += depth
+                self.depth_max = max(self.depth_max, depth)
+            if item is None:
+                return
+            if self.error is not None:
+                # keep draining after a failure so nobody blocks on us
+                continue
+            try:
+                found = work(item)
+            except BaseException:
+                self.error = sys.exc_info()
+                continue
+            t2 = time.time()
+            with self.lock:
+                self.items += 1
+                self.busy += t2 - t1
+            for made in found or []:
+                self.put(out, made)
+
+    def take_more(self):
+        """
+        the items waiting in the input queue, without blocking,
+        for a stage that does them in one batch
+        """
+        import Queue
+        more = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is None:
+                # the stop is for run(), nothing comes after it
+                self.queue.put(None)
+                break
+            more.append(item)
+        with self.lock:
+            self.items += len(more)
+        return more
+
+    def put(self, out, item):
+        # blocks while the queue of out is full
+        t0 = time.time()
+        out.queue.put(item)
+        with self.lock:
+            self.blocked += time.time() - t0
+
+    def stop(self):
+        """
+        lets the threads finish the queue, waits for them and
+        raises what failed in them
+        """
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+class SyndaPipeline(object):
+    """
+    Local scan, synda (or --esgf-search) search and install as stages
+    connected by bounded queues: write_cache_direct() hands each scanned
+    group to feed(), its missing and incomplete members go to the search
+    stage right away and the files they need to the install stage while
+    the scan goes on; the groups that queue up while a batch is installed
+    make the next batch. A full queue holds back the stage before it.
+    Installs start per group when nothing limits them; with --dryrun or a
+    --max-gb budget the install stage collects the files and the download
+    plan is made once, at the end, for all of them (see plan_downloads()).
+    """
+    def __init__(self, results, download=False, dryrunOn=False, max_bytes=None,
+                 verbose=False, maxsize=PIPELINE_QUEUE, workers=1):
+        self.results = results
+        self.download = download
+        self.dryrunOn = dryrunOn
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        # union header -> member FileDescriptor's of the searched groups
+        self.groups = {}
+        # new files of all the groups, planned at the end
+        self.plan = {'files': {}, 'have': {}}
+        self.steps = []
+        self.skipped = []
+        # maxsize 0: unbounded queues, the stages run one after the other
+        self.serial = maxsize == 0
+        self.scan = PipelineStage('scan', 0)
+        self.search = PipelineStage('search', maxsize, workers)
+        self.install = PipelineStage('install', maxsize)
+        self.tstart = None
+
+    def start(self):
+        self.tstart = time.time()
+        if self.serial is not True:
+            self.start_stages()
+
+    def start_stages(self):
+        self.search.start(self.search_one, self.install)
+        if self.download is True:
+            self.install.start(self.install_one)
+
+    def feed(self, ufd, members):
+        """
+        the members of a scanned group that synda has to look for,
+        as one search; called by write_cache_direct()
+        """
+        t0 = time.time()
+        results = self.results
+        missing = []
+        for m in sorted(set(members), key=lambda m: m.header()):
+            if results.needs_search(m.header()):
+                missing.append(m)
+        if missing:
+            for sfd, smembers in coalesce_descriptors(missing):
+                header = sfd.header()
+                self.groups[header] = smembers
+                # the files of the members already on disk are not downloaded again
+                Z = {header: [f for m in smembers for f in results.on_disk(m.header())]}
+                PROGRESS.wait(len(smembers))
+                self.scan.put(self.search, (sfd, smembers, Z))
+        with self.scan.lock:
+            self.scan.items += 1
+
+    def search_one(self, item):
+        ufd, members, Z = item
+        header = ufd.header()
+        t0 = time.time()
+        PROGRESS.search_begin()
+        nfound = 0
+        try:
+            if ESGF is not None:
+                outpt = ESGF.search(ufd.model_data(), ufd.variable)
+            else:
+                outpt = synda_search(ufd.model_data(), ufd.variable)
+            plan = None
+            if self.download is True:
+                plan = {'files': {}, 'have': {}}
+            s = synda_dll(outpt,ufd.variable,ufd.year1,ufd.year2,header,Z,self.results,
+                          download=self.download,dryrunOn=self.dryrunOn,verbose=self.verbose,plan=plan,
+                          years=member_years(members))
+            if s == 0:
+                for m in members:
+                    self.results.add_synda_missing(m.header())
+            nfound = len(self.results.get(header).synda or ())
+        finally:
+            PROGRESS.search_end(len(members), nfound, time.time() - t0)
+        if plan is not None:
+            PROGRESS.queue_bytes(sum([f[3] for f in plan['files'].values()]))
+            return [(header, members, plan)]
+        return []
+
+    def install_one(self, item):
+        # the groups that queued up while the last batch was installed go together
+        steps = []
+        taken = 0
+        for header, members, plan in [item] + self.install.take_more():
+            if self.dryrunOn is True or self.max_bytes is not None:
+                # the budget and the printed plan need all the files
+                self.plan['files'].update(plan['files'])
+                self.plan['have'].update(plan['have'])
+                continue
+            taken += sum([f[3] for f in plan['files'].values()])
+            gsteps, skipped = plan_downloads(plan, {header: members})
+            steps.extend(gsteps)
+            self.skipped.extend(skipped)
+        if steps:
+            install_steps(steps,self.results,False,self.verbose)
+            self.steps.extend(steps)
+        PROGRESS.queue_bytes(-taken)
+
+    def close(self):
+        """
+        waits for the searches and installs to finish, then
+        installs (or prints) the plan collected for the end
+        """
+        self.scan.busy = time.time() - self.tstart - self.scan.blocked
+        if self.serial is True:
+            self.start_stages()
+        try:
+            self.search.stop()
+        finally:
+            self.install.stop()
+        if self.download is True:
+            if self.dryrunOn is True or self.max_bytes is not None:
+                steps, skipped = plan_downloads(self.plan,self.groups,self.max_bytes)
+                install_plan(steps,skipped,self.results,self.max_bytes,self.dryrunOn,self.verbose)
+                PROGRESS.queue_bytes(-sum([f[3] for f in self.plan['files'].values()]))
+            else:
+                install_plan(self.steps,self.skipped,self.results,None,False,self.verbose,installed=True)
+        slice_cache_lines(self.results,self.groups)
+
+    def report(self):
+        """
+        prints what each stage did: a stage that is mostly idle waits for
+        the one before it, a stage that is often blocked (and whose next
+        queue is full) waits for the one after it
+        """
+        print('Pipeline stages (%s, %.2f s; times summed over threads):'
+              % ('one after the other' if self.serial else 'queues of %i' % self.search.queue.maxsize,
+                 time.time() - self.tstart))
+        print('   %-8s %7s %7s %9s %9s %9s %11s %6s' % ('stage', 'threads', 'items', 'busy s', 'idle s',
+                                                      'blocked s', 'queue max', 'mean'))
+        for st in (self.scan, self.search, self.install):
+            if st is self.install and not st.threads:
+                continue
+            if st is self.scan:
+                depth = ('-', '-')
+            else:
+                depth = ('%i' % st.depth_max, '%.1f' % (st.depth_sum / float(max(st.gets, 1))))
+            print('   %-8s %7i %7i %9.2f %9.2f %9.2f %11s %6s' % (st.name, max(st.nthreads, 1), st.items, st.busy,
+                                                                  st.idle, st.blocked, depth[0], depth[1]))
+
+# ---- live progress and stage throughput (--progress)
+class ProgressOutput(object):
+    """
+    sys.stdout and sys.stderr while the progress line is on the
+    terminal: the line is cleared before anything else is printed and
+    drawn again by the next update
+    """
+    def __init__(self, stream, progress):
+        self.stream = stream
+        self.progress = progress
+
+    def write(self, text):
+        with self.progress.lock:
+            self.progress.clear_line()
+            self.stream.write(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.stream.flush()
+
+    # print keeps its state in the file it prints to
+    def _get_softspace(self):
+        return getattr(self.stream, 'softspace', 0)
+
+    def _set_softspace(self, value):
+        self.stream.softspace = value
+
+    softspace = property(_get_softspace, _set_softspace)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class ProgressReporter(object):
+    """
+    Progress of a datasource run: the stages count what they did, once
+    per group, search or install batch (scanned(), search_begin() and
+    search_end(), queue_bytes(), installed()), and the first count made
+    interval seconds after the last update shows filedescriptors
+    done/total, files found, searches in flight, MB queued for install,
+    rates and an ETA: in tty mode as one line on stderr rewritten in
+    place, in log mode as a line per interval for log files and batch
+    jobs; there is no thread of its own, the counting threads draw the
+    updates. stop() prints the throughput of each stage. A
+    filedescriptor is done when it is scanned and, if synda looks for
+    it, searched.
+    """
+    # seconds of recent progress the rates and the ETA are taken over
+    WINDOW = 30.
+
+    def __init__(self):
+        import threading
+        self.lock = threading.Lock()
+        self.mode = 'off'
+        self.interval = 10.
+        self.name = ''
+        self.total = 0
+        self.scanned_fds = 0
+        self.skipped = 0
+        self.waiting = 0
+        self.files = 0
+        self.searching = 0
+        self.bytes_queued = 0
+        # stage: [items, files, bytes, busy seconds]
+        self.stages = {}
+        self.t0 = time.time()
+        self.samples = []
+        self.shown = False
+        self.next_show = None
+        # the real streams while ours are in place, see ProgressOutput
+        self.streams = None
+        self.err = sys.stderr
+        self.columns = 80
+
+    def start(self, name, total, mode='auto', interval=None):
+        """
+        starts showing the progress of total filedescriptors; mode
+        auto is tty on a terminal (stderr) and log otherwise
+        """
+        self.name = name
+        self.total = total
+        self.t0 = time.time()
+        if mode == 'auto':
+            mode = 'tty' if sys.stderr.isatty() else 'log'
+        self.mode = mode
+        if interval is None:
+            interval = 0.5 if mode == 'tty' else 10.
+        self.interval = interval
+        if mode == 'off':
+            return
+        self.err = sys.stderr
+        if mode == 'tty':
+            self.columns = self.terminal_width()
+            self.streams = (sys.stdout, sys.stderr)
+            sys.stderr = ProgressOutput(sys.stderr, self)
+            if sys.stdout.isatty():
+                sys.stdout = ProgressOutput(sys.stdout, self)
+        self.next_show = self.t0 + interval
+
+    def stage(self, name, items, files=0, nbytes=0, dt=0.):
+        st = self.stages.setdefault(name, [0, 0, 0, 0.])
+        st[0] += items
+        st[1] += files
+        st[2] += nbytes
+        st[3] += dt
+
+    def skip(self, n):
+        # filedescriptors answered without a scan or search
+        with self.lock:
+            self.skipped += n
+        self.tick()
+
+    def scanned(self, n, nfiles, dt):
+        with self.lock:
+            self.scanned_fds += n
+            self.files += nfiles
+            self.stage('scan', n, nfiles, 0, dt)
+        self.tick()
+
+    def wait(self, n):
+        # n scanned filedescriptors go to synda
+        with self.lock:
+            self.waiting += n
+        self.tick()
+
+    def search_begin(self):
+        with self.lock:
+            self.searching += 1
+        self.tick()
+
+    def search_end(self, n, nfiles, dt):
+        # one search for n filedescriptors found nfiles
+        with self.lock:
+            self.searching -= 1
+            self.waiting -= n
+            self.files += nfiles
+            self.stage('search', 1, nfiles, 0, dt)
+        self.tick()
+
+    def queue_bytes(self, nbytes):
+        with self.lock:
+            self.bytes_queued += nbytes
+        self.tick()
+
+    def installed(self, nfiles, nbytes, dt):
+        with self.lock:
+            self.stage('install', nfiles, nfiles, nbytes, dt)
+        self.tick()
+
+    def tick(self):
+        # one clock read per count until an update is due
+        if self.next_show is not None and time.time() >= self.next_show:
+            self.next_show = time.time() + self.interval
+            self.show()
+
+    def done(self):
+        return self.scanned_fds + self.skipped - self.waiting
+
+    def line(self):
+        """
+        the progress as one line of text
+        """
+        now = time.time()
+        done = self.done()
+        self.samples.append((now, done, self.files))
+        while len(self.samples) > 2 and now - self.samples[1][0] > self.WINDOW:
+            self.samples.pop(0)
+        t, done0, files0 = self.samples[0]
+        if now - t < 1e-3:
+            t, done0, files0 = self.t0, 0, 0
+        rate = (done - done0) / max(now - t, 1e-3)
+        frate = (self.files - files0) / max(now - t, 1e-3)
+        if done >= self.total:
+            eta = '0:00:00'
+        elif rate > 0:
+            eta = str(timedelta(seconds=int((self.total - done) / rate)))
+        else:
+            eta = '--'
+        text = '%i/%i filedescriptors (%i%%) | %i files | %i searches in flight | %.1f MB queued | %.1f fd/s %.1f files/s | ETA %s' \
+               % (done, self.total, 100 * done // max(self.total, 1), self.files, self.searching,
+                  self.bytes_queued / 1e6, rate, frate, eta)
+        if self.name:
+            text = '[%s] ' % self.name + text
+        return text
+
+    def clear_line(self):
+        # called under self.lock
+        if self.shown:
+            self.err.write('\x1b[K')
+            self.shown = False
+
+    def show(self):
+        with self.lock:
+            text = self.line()
+            if self.mode == 'tty':
+                # the cursor stays at the start of the line: what other
+                # processes (find, synda) print writes over it
+                self.err.write('\r' + text[:self.columns - 1] + '\x1b[K\r')
+                self.shown = True
+            else:
+                self.err.write('Progress ' + time.strftime('%H:%M:%S') + ' ' + text + '\n')
+            self.err.flush()
+
+    def terminal_width(self):
+        # a line longer than the terminal would wrap and not be rewritten
+        import fcntl, termios, struct
+        try:
+            return struct.unpack('hh', fcntl.ioctl(self.err.fileno(), termios.TIOCGWINSZ, '1234'))[1] or 80
+        except Exception:
+            return 80
+
+    def stop(self):
+        """
+        stops the updates and prints the throughput of each stage
+        """
+        self.next_show = None
+        with self.lock:
+            self.clear_line()
+        if self.streams is not None:
+            sys.stdout, sys.stderr = self.streams
+            self.streams = None
+        if self.mode == 'off':
+            return
+        print('Throughput (%s%i filedescriptors done in %.1f s; items: filedescriptors scanned, searches, files installed):'
+              % (self.name + ', ' if self.name else '', self.done(), time.time() - self.t0))
+        print('   stage       items     files        GB    busy s   items/s   files/s      MB/s')
+        for name in ('scan', 'search', 'install'):
+            if name not in self.stages or self.stages[name][0] == 0:
+                continue
+            items, nfiles, nbytes, busy = self.stages[name]
+            busy1 = max(busy, 1e-6)
+            if name == 'install':
+                amount = '%9.2f' % (nbytes / 1e9)
+                speed = '%9.1f' % (nbytes / 1e6 / busy1)
+            else:
+                amount = speed = '%9s' % '-'
+            print('   %-8s %8i %9i %s %9.2f %9.1f %9.1f %s' % (name, items, nfiles, amount, busy,
+                                                            items / busy1, nfiles / busy1, speed))
+
+PROGRESS = ProgressReporter()
+
+# ---- cache verification (--verify)
+# hashes already checked, keyed by (path, size, mtime, checksum type)
+CHECKSUM_STORE = 'checksum_store.txt'
+# read size for hashing, a multiple of any fs block size
+VERIFY_BUFSIZE = 1 << 22
+# latency bound filesystems that want many reads in flight
+NETWORK_FS = ('nfs', 'nfs4', 'lustre', 'gpfs', 'panfs', 'cifs', 'smb2',
+              'beegfs', 'ceph', 'fuse.sshfs')
+
+def fs_type(path):
+    """
+    filesystem type of the mount path lives on, from /proc/mounts
+    (None if not known e.g. not on linux)
+    """
+    path = os.path.realpath(path)
+    best = ('', None)
+    try:
+        with open('/proc/mounts', 'r') as file:
+            for line in file:
+                cols = line.split()
+                if len(cols) < 3:
+                    continue
+                mnt = cols[1].replace('\\040', ' ')
+                if (path == mnt or path.startswith(mnt.rstrip('/') + '/')) and len(mnt) > len(best[0]):
+                    best = (mnt, cols[2])
+    except IOError:
+        pass
+    return best[1]
+
+def verify_workers(path):
+    """
+    number of hashing threads for files under path: network and parallel
+    filesystems are latency bound and take many reads in flight,
+    local disks do best with a few streams
+    """
+    import multiprocessing
+    if fs_type(path) in NETWORK_FS:
+        return 16
+    return max(1, min(4, multiprocessing.cpu_count()))
+
+def file_digest(path, checksum_type='sha256'):
+    """
+    hex digest of a file, read unbuffered in VERIFY_BUFSIZE chunks
+    into one preallocated buffer (hashlib drops the GIL while hashing)
+    """
+    # no mmap: it saves no copy over readinto, faults one page at a time
+    # on network filesystems and a file truncated under it kills the run
+    # with SIGBUS; sequential VERIFY_BUFSIZE reads are block aligned already
+    import hashlib, io
+    digest = hashlib.new(checksum_type.lower())
+    buf = bytearray(VERIFY_BUFSIZE)
+    view = memoryview(buf)
+    with io.open(path, 'rb', buffering=0) as file:
+        while True:
+            n = file.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+def read_checksum_store(fname):
+    """
+    {(path, size, mtime, checksum type): checksum} from a checksum store
+    file with lines: path size mtime checksum_type checksum
+    """
+    store = {}
+    if os.path.exists(fname):
+        with open(fname, 'r') as file:
+            for line in file:
+                cols = line.split()
+                if len(cols) == 5:
+                    store[(cols[0], int(cols[1]), cols[2], cols[3].lower())] = cols[4]
+    return store
+
+def write_checksum_store(fname, store):
+    """
+    merges store into the checksum store file, under its lock so
+    concurrent runs do not drop each other's digests; written to a
+    temp file first so readers never see a half written store
+    """
+    lf = run_lock(fname + '.lock')
+    try:
+        merged = read_checksum_store(fname)
+        merged.update(store)
+        tmp = '%s.%i.tmp' % (fname, os.getpid())
+        with open(tmp, 'w') as file:
+            for key in sorted(merged):
+                file.write('%s %i %s %s %s\n' % (key[0], key[1], key[2], key[3], merged[key]))
+        os.rename(tmp, fname)
+    finally:
+        lf.close()
+
+def file_metadata(path, records):
+    """
+    picks the search record that describes the local file path out of the
+    records with its basename: the one of the version in the (resolved)
+    path, or any if all versions agree on the checksum; None if unsure
+    """
+    import re
+    if not records:
+        return None
+    versions = [c for c in os.path.realpath(path).split('/') if re.match(r'^v\d+$', c)]
+    if versions:
+        found = [r for r in records if r.version == versions[-1]]
+        return found[0] if found else None
+    if len(set([(r.checksum, r.size) for r in records])) == 1:
+        return records[0]
+    return None
+
+def drs_file_id(path):
+    """
+    synda file id of a file in a CMIP5 DRS tree (version dir resolved) e.g.
+    .../cmip5/output1/MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/latest/tas/tas_Amon_..._185001-200512.nc
+    -> cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315.tas_Amon_..._185001-200512.nc
+    None if path is not in a DRS tree
+    """
+    import re
+    parts = path.split('/')
+    if len(parts) < 12:
+        return None
+    version = os.path.basename(os.path.realpath('/'.join(parts[:-2])))
+    if not re.match(r'^v\d+$', version):
+        return None
+    return '.'.join(parts[-12:-3] + [version, parts[-1]])
+
+def verify_cache(entries,corruptfile,workers=None,verbose=False):
+    """
+    Checks the files of a run, (header, path) from RunResults.installed_files(),
+    against the size and checksum of the ESGF search records (ESGF.seen; the
+    datasets not searched in this run are searched here) or, for the files
+    not found there, the checksums in synda's database. Files are hashed in
+    parallel, workers threads (default: tuned to the filesystem, see
+    verify_workers()); digests go to CHECKSUM_STORE so an unchanged file
+    (same path, size and mtime) is never hashed again. Missing, truncated and
+    corrupt files are written to corruptfile as
+    header path synda_file_id reason
+    ready to be fed back to synda install or --download.
+    Returns (number ok, number corrupt, number without checksum).
+    """
+    from multiprocessing.dummy import Pool
+    if ESGF is not None:
+        queries = set()
+        for header, path in entries:
+            if path.split('/')[-1] not in ESGF.seen:
+                hp = header.split('_')
+                queries.add((' '.join(hp[:5]), hp[-1]))
+        if queries:
+            ESGF.search_many(sorted(queries), ESGF.pool_size)
+        seen = dict(ESGF.seen)
+    else:
+        seen = {}
+    ids = set()
+    for header, path in entries:
+        if path.split('/')[-1] not in seen:
+            fid = drs_file_id(path)
+            if fid is not None:
+                ids.add(fid)
+    for fid, (size, checksum, checksum_type) in synda_checksums(ids).items():
+        rec = synda_record('done', size, fid)
+        if rec is not None:
+            rec.checksum, rec.checksum_type = checksum, checksum_type
+            seen.setdefault(rec.basename, []).append(rec)
+    store = read_checksum_store(CHECKSUM_STORE)
+    new_store = {}
+    if workers is None:
+        workers = verify_workers(entries[0][1] if entries else '.')
+
+    def check(path):
+        # (path, record, reason or None, hashed bytes, checksum)
+        rec = file_metadata(path, seen.get(path.split('/')[-1]))
+        if not os.path.exists(path):
+            return path, rec, 'missing file', 0, None
+        if rec is None or not rec.checksum:
+            return path, rec, None, 0, None
+        st = os.stat(path)
+        if rec.size and st.st_size != rec.size:
+            return path, rec, 'size %i, expected %i' % (st.st_size, rec.size), 0, None
+        key = (path, st.st_size, '%.6f' % st.st_mtime, (rec.checksum_type or 'sha256').lower())
+        hashed = 0
+        if key in store:
+            got = store[key]
+        else:
+            try:
+                got = file_digest(path, key[3])
+            except (IOError, OSError, ValueError) as err:
+                return path, rec, str(err).replace('\n', ' '), 0, None
+            hashed = st.st_size
+            new_store[key] = got
+        if got != rec.checksum.lower():
+            return path, rec, '%s checksum mismatch' % key[3], hashed, got
+        return path, rec, None, hashed, got
+
+    nok = ncorrupt = nunknown = nbytes = 0
+    t0 = time.time()
+    # a file may serve several filedescriptors, check it once
+    paths = sorted(set([path for header, path in entries]))
+    pool = Pool(max(1, min(workers, len(paths) or 1)))
+    try:
+        results = dict([(res[0], res) for res in pool.imap_unordered(check, paths)])
+    finally:
+        pool.close()
+        pool.join()
+    for res in results.values():
+        nbytes += res[3]
+    with open(corruptfile, 'w') as file:
+        for header, path in entries:
+            path, rec, reason, hashed, got = results[path]
+            if reason is not None:
+                ncorrupt += 1
+                fid = rec.file_name if rec is not None else '-'
+                file.write('%s %s %s %s\n' % (header, path, fid, reason))
+                if verbose is True:
+                    print('Corrupt file: %s (%s)' % (path, reason))
+            elif rec is None or not rec.checksum:
+                nunknown += 1
+            else:
+                nok += 1
+    if new_store:
+        write_checksum_store(CHECKSUM_STORE, new_store)
+    dt = time.time() - t0
+    print('Verified %i files: %i ok, %i corrupt, %i without checksum; hashed %.1f MB in %.1f s (%.1f MB/s) with %i workers'
+          % (len(entries), nok, ncorrupt, nunknown, nbytes / 1e6, dt, nbytes / 1e6 / max(dt, 1e-6), workers))
+    if ncorrupt > 0:
+        print('Corrupt files listed in %s' % '/'.join(corruptfile.split('/')[-2:]))
+    return nok, ncorrupt, nunknown
+
+def cache_merge(lines1,lines2):
+    """
+    Function that takes the lines of two caches and merges them
+    into a single one. Caution -- note the order:
+    lines1 = local datasource cache
+    lines2 = local synda cache
+    A synda file is kept unless it is the only file of the local
+    cache (same file name); returns sorted unique header path lines.
+    """
+    merged = set([a.split()[0] + ' ' + a.split()[1] for a in lines1])
+    names = set([a.split()[1].split('/')[-1] for a in lines1])
+    for b in lines2:
+        if names and names != set([b.split()[1].split('/')[-1]]):
+            merged.add(b.split()[0] + ' ' + b.split()[1])
+    return sorted(merged)
     
+# ---- netCDF time coverage (--introspect), read by netcdf_time.py
+# time ranges already read, keyed by (path, size, mtime)
+TIME_STORE = 'time_store.txt'
+
+def read_time_store(fname):
+    """
+    {(path, size, mtime): (first yyyymm, last yyyymm, calendar) or None}
+    from a time store file with lines: path size mtime first last calendar
+    (- for files that have no readable time)
+    """
+    store = {}
+    if os.path.exists(fname):
+        with open(fname, 'r') as file:
+            for line in file:
+                cols = line.split()
+                if len(cols) == 6:
+                    if cols[3] == '-':
+                        store[(cols[0], int(cols[1]), cols[2])] = None
+                    else:
+                        store[(cols[0], int(cols[1]), cols[2])] = (int(cols[3]), int(cols[4]), cols[5])
+    return store
+
+def write_time_store(fname, store):
+    """
+    merges store into the time store file, under its lock
+    """
+    lf = run_lock(fname + '.lock')
+    try:
+        merged = read_time_store(fname)
+        merged.update(store)
+        tmp = '%s.%i.tmp' % (fname, os.getpid())
+        with open(tmp, 'w') as file:
+            for key in sorted(merged):
+                rng = merged[key] or ('-', '-', '-')
+                file.write('%s %i %s %s %s %s\n' % (key[0], key[1], key[2], rng[0], rng[1], rng[2]))
+        os.rename(tmp, fname)
+    finally:
+        lf.close()
+
+def file_time_ranges(paths,workers=None):
+    """
+    Time coverage of data files from their time coordinate, in parallel
+    (workers threads, default tuned to the filesystem as for --verify);
+    every file is opened once across runs, the ranges are kept in
+    TIME_STORE keyed by (path, size, mtime).
+    Returns {path: (first yyyymm, last yyyymm, calendar) or None}
+    """
+    import struct
+    from multiprocessing.dummy import Pool
+    from netcdf_time import nc_time, time_to_yyyymm
+    store = read_time_store(TIME_STORE)
+    new_store = {}
+    keys = {}
+    todo = []
+    for path in sorted(set(paths)):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        keys[path] = (path, st.st_size, '%.6f' % st.st_mtime)
+        if keys[path] not in store:
+            todo.append(path)
+
+    def read_one(path):
+        try:
+            found = nc_time(path)
+            if found is None:
+                return path, None
+            return path, (time_to_yyyymm(found[0], found[2], found[3]),
+                          time_to_yyyymm(found[1], found[2], found[3]), found[3])
+        except (IOError, ValueError, KeyError, IndexError, struct.error) as err:
+            print >> sys.stderr, "WARNING: no time coordinate read from %s: %s" % (path, err)
+            return path, None
+
+    if todo:
+        if workers is None:
+            workers = verify_workers(todo[0])
+        pool = Pool(max(1, min(workers, len(todo))))
+        try:
+            for path, rng in pool.imap_unordered(read_one, todo):
+                new_store[keys[path]] = rng
+        finally:
+            pool.close()
+            pool.join()
+        write_time_store(TIME_STORE, new_store)
+    store.update(new_store)
+    print('Time coordinates: %i files, %i read now, %i from %s' % (len(keys), len(todo), len(keys) - len(todo), TIME_STORE))
+    return dict([(path, store[key]) for path, key in keys.items()])
+
+# ---- negative cache of missing filedescriptors (--missing-ttl, --recheck-missing)
+# filedescriptors found missing both locally and on ESGF, by (datasource root, header)
+MISSING_STORE = 'missing_store.txt'
+# days an entry is trusted for
+MISSING_TTL = 7.
+
+def local_fingerprint(fd,ls_host_root,host_root,latest_dir):
+    """
+    Fingerprint of the local directories the files of fd would be in:
+    the mtimes of the deepest existing directories of its DRS path
+    (see get_drs()) under each institute that has the model, or of
+    the root and institute directories if none has; adding a file,
+    version or dataset dir for fd changes at least one of them.
+    """
+    import glob, hashlib
+    insts = [st.split()[-1] for st in ls_host_root]
+    dirs = []
+    for inst in insts:
+        mdir = host_root + inst + '/' + fd.model
+        if not os.path.isdir(mdir):
+            continue
+        found = [mdir]
+        for comp in get_drs(host_root,inst,fd.model,fd,latest_dir)[len(mdir) + 1:].strip('/').split('/'):
+            deeper = [m for f in found for m in glob.glob(f + '/' + comp) if os.path.isdir(m)]
+            if not deeper:
+                break
+            found = deeper
+        dirs.extend(found)
+    if not dirs:
+        dirs = [host_root] + [host_root + inst for inst in insts]
+    stamp = hashlib.sha1()
+    for dname in sorted(set(dirs)):
+        try:
+            stamp.update('%s %.6f\n' % (dname, os.stat(dname).st_mtime))
+        except OSError:
+            pass
+    return stamp.hexdigest()[:16]
+
+def read_missing_store(fname):
+    """
+    {(root, header): (time recorded, local fingerprint)} from a
+    missing store file with lines: root header time fingerprint
+    """
+    store = {}
+    if os.path.exists(fname):
+        with open(fname, 'r') as file:
+            for line in file:
+                cols = line.split()
+                if len(cols) == 4:
+                    store[(cols[0], cols[1])] = (float(cols[2]), cols[3])
+    return store
+
+def write_missing_store(fname, store, drop=()):
+    """
+    merges store into the missing store file and removes
+    the keys in drop, under its lock
+    """
+    lf = run_lock(fname + '.lock')
+    try:
+        merged = read_missing_store(fname)
+        merged.update(store)
+        for key in drop:
+            merged.pop(key, None)
+        tmp = '%s.%i.tmp' % (fname, os.getpid())
+        with open(tmp, 'w') as file:
+            for key in sorted(merged):
+                file.write('%s %s %.0f %s\n' % (key[0], key[1], merged[key][0], merged[key][1]))
+        os.rename(tmp, fname)
+    finally:
+        lf.close()
+
+def known_missing(descriptors,host_root,ls_host_root,latest_dir):
+    """
+    headers of the descriptors that the missing store has as missing
+    on host_root and on ESGF, recorded less than missing_ttl days ago
+    and with their local directories unchanged since; these are
+    answered ERROR-MISSING without a scan or a search
+    """
+    if missing_ttl <= 0 or recheckMissing is True:
+        return set()
+    store = read_missing_store(MISSING_STORE)
+    if not store:
+        return set()
+    now = time.time()
+    known = set()
+    for fd in descriptors:
+        entry = store.get((host_root, fd.header()))
+        if entry is not None and now - entry[0] < missing_ttl * 86400. \
+                and entry[1] == local_fingerprint(fd,ls_host_root,host_root,latest_dir):
+            known.add(fd.header())
+    return known
+
+def record_missing(descriptors,results,host_root,ls_host_root,latest_dir):
+    """
+    puts the descriptors this run found missing locally and on ESGF
+    (nothing on disk, nothing from synda) in the missing store and
+    drops those it found data for
+    """
+    if missing_ttl <= 0:
+        return
+    store = read_missing_store(MISSING_STORE)
+    now = time.time()
+    new = {}
+    drop = []
+    for fd in descriptors:
+        header = fd.header()
+        r = results.byheader.get(header)
+        if header in results.known:
+            continue
+        elif r is not None and r.missing is True and not r.local and r.incomplete is None \
+                and not r.synda and r.synda_missing is True:
+            new[(host_root, header)] = (now, local_fingerprint(fd,ls_host_root,host_root,latest_dir))
+        elif (host_root, header) in store:
+            drop.append((host_root, header))
+    if new or drop:
+        write_missing_store(MISSING_STORE, new, drop)
+
 # ---- final user-friendly cache generator
-def final_cache(parfile,ofile1,finalfile):
+def final_cache(descriptors,lines,finalfile):
     """
     Function that generates the final user-friendly
     single cache file; this can easily be used
@@ -722,54 +2377,333 @@ def final_cache(parfile,ofile1,finalfile):
     Database | data_status | Percent complete | available_data
     ---------------------------------------------
     CMIP5_MIROC5_Amon_historical_r1i1p1_2003_2010_hus (complete,incomplete or missing) [file_list, if available]
+    descriptors: the FileDescriptor's that were searched for
+    lines: header path lines of the combined cache (RunResults.combined_lines())
+    With --introspect the years of each file come from its time
+    coordinate (see file_time_ranges()), the file name is only
+    used for files whose time can not be read.
     """
-    pparfile = 'prepended_' + parfile
-    car = open(pparfile, 'r')
-    lis = car.readlines()
     ff = open(finalfile, 'w')
-    if os.path.exists(ofile1):
-        of1 = open(ofile1, 'r')
-        ofl1 = of1.readlines()
-        o1 = [(a.split()[0],a.split()[1]) for a in ofl1]
-        for b in lis:
-            tt = []
-            hh = []
-            header = b.split()[0] + '_'+ b.split()[1] + '_' + b.split()[2]\
-                     + '_' + b.split()[3] + '_' + b.split()[4] + '_' + b.split()[5]\
-                     + '_' + b.split()[6] + '_' + b.split()[7]
-
-            for h in o1:
-                if header == h[0]:
-                    y = h[1].split('/')[-1].strip('.nc').split('_')[-1].split('-')
-                    # y could be some dodgy stuff if file not proper formatted
-                    if len(y) == 2: 
-                        yr1 = date_handling(y[0],y[1])[0]
-                        yr2 = date_handling(y[0],y[1])[1]
-                        tt.append(yr1)
-                        tt.append(yr2)
-                        hh.append(h[1])
-                    else:
-                        print('File: _date1-date2.nc not properly formatted...skipping it')
-            y1 = int(b.split()[5])
-            y2 = int(b.split()[6])
-            # let's see how we do with time
-            if len(tt) > 0:
-                if get_overlap(tt,y1,y2)[1] == 1:
-                    # we have contiguous time
-                    if get_overlap(tt,y1,y2)[0] == 1:
-                        ff.write(header + ' complete 1.0 ' + str(hh) + '\n')
-                    else:
-                        fdt = get_overlap(tt,y1,y2)[0]
-                        ff.write(header + ' incomplete ' + '%.2f' % fdt + ' ' + str(hh) + '\n')
-                else:
-                    # we have gaps
-                    if get_overlap(tt,y1,y2)[0] == 1:
-                        ff.write(header + ' complete(DATAGAPS) 1.0 ' + str(hh) + '\n')
-                    else:
-                        fdt = get_overlap(tt,y1,y2)[0]
-                        ff.write(header + ' incomplete(DATAGAPS) ' + '%.2f' % fdt + ' ' + str(hh) + '\n')
+    # index the cache lines by header, once
+    o1 = {}
+    for a in lines:
+        o1.setdefault(a.split()[0], []).append((a.split()[0],a.split()[1]))
+    times = {}
+    if introspectOn is True:
+        times = file_time_ranges([h[1] for hs in o1.values() for h in hs])
+    if lines or nshards:
+        # (a shard with no file found still lists its filedescriptors)
+        for b in descriptors:
+            header = b.header()
+            ff.write(final_cache_line(header,[h[1] for h in o1.get(header, [])],b.year1,b.year2,times))
+    ff.close()
+    index_final_cache(finalfile)
+
+def final_cache_line(header,paths,y1,y2,times=None):
+    """
+    the final cache line of filedescriptor header with files paths
+    and years y1 to y2; the years of a file come from times (see
+    file_time_ranges()) if it is there, from its name otherwise
+    """
+    tt = []
+    hh = []
+    for path in paths:
+        y = path.split('/')[-1].strip('.nc').split('_')[-1].split('-')
+        # y could be some dodgy stuff if file not proper formatted
+        if times and times.get(path) is not None:
+            # years of the time coordinate itself
+            tt.append(times[path][0] // 100)
+            tt.append(times[path][1] // 100)
+            hh.append(path)
+        elif len(y) == 2: 
+            yr1 = date_handling(y[0],y[1])[0]
+            yr2 = date_handling(y[0],y[1])[1]
+            tt.append(yr1)
+            tt.append(yr2)
+            hh.append(path)
+        else:
+            print('File: _date1-date2.nc not properly formatted...skipping it')
+    # let's see how we do with time
+    if len(tt) > 0:
+        if get_overlap(tt,y1,y2)[1] == 1:
+            # we have contiguous time
+            if get_overlap(tt,y1,y2)[0] == 1:
+                return header + ' complete 1.0 ' + str(hh) + '\n'
+            else:
+                fdt = get_overlap(tt,y1,y2)[0]
+                return header + ' incomplete ' + '%.2f' % fdt + ' ' + str(hh) + '\n'
+        else:
+            # we have gaps
+            if get_overlap(tt,y1,y2)[0] == 1:
+                return header + ' complete(DATAGAPS) 1.0 ' + str(hh) + '\n'
             else:
-                ff.write(header + ' missing' + '\n')
+                fdt = get_overlap(tt,y1,y2)[0]
+                return header + ' incomplete(DATAGAPS) ' + '%.2f' % fdt + ' ' + str(hh) + '\n'
+    return header + ' missing' + '\n'
+
+# ---- coverage array of a final cache (--coverage-matrix)
+def write_coverage_matrix(finalfile,introspect=False):
+    """
+    writes finalfile.coverage.npz, see coverage_matrix.py; with
+    introspect (--introspect) the months come from the files' time
+    coordinates
+    """
+    import coverage_matrix
+    if introspect is True:
+        cov = coverage_matrix.build_coverage(finalfile, time_ranges=file_time_ranges)
+    else:
+        cov = coverage_matrix.build_coverage(finalfile)
+    print('Coverage matrix: %i models x %i variables x %i months in %s'
+          % (len(cov['models']), len(cov['variables']), len(cov['months']),
+             os.path.basename(finalfile) + '.coverage.npz'))
+
+# ---- sharded final cache (--shard-by)
+# FileDescriptor fields a final cache can be sharded by
+SHARD_KEYS = ('project', 'model', 'table', 'experiment', 'ensemble', 'variable')
+
+def shard_final_cache(finalfile,key,sharddir=None):
+    """
+    Splits a final cache into one file per value of key, a list of
+    FileDescriptor fields e.g. ['model'] or ['model', 'variable'], in
+    sharddir (default finalfile + '.shards') so that parallel consumers
+    read only their part; lines keep the final cache format and order,
+    shards are named after the value e.g. MPI-ESM-LR.txt, MPI-ESM-LR_tro3.txt
+    Also writes sharddir/manifest.json:
+    {"source": finalfile, "key": key,
+     "shards": {value: {"file": shard file name, "bytes": shard size,
+                        "descriptors": {header: [byte offset, length]}}}}
+    The new sharddir replaces the old one in one rename.
+    Returns the manifest.
+    """
+    import json
+    if sharddir is None:
+        sharddir = finalfile + '.shards'
+    shards = {}
+    order = []
+    with open(finalfile, 'r') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            fd = dict(zip(FileDescriptor._fields, line.split()[0].split('_')))
+            value = '_'.join([fd.get(k, 'unknown') for k in key])
+            if value not in shards:
+                shards[value] = []
+                order.append(value)
+            shards[value].append(line)
+    tmpdir = '%s.%i.tmp' % (sharddir.rstrip('/'), os.getpid())
+    if os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    manifest = {'source': os.path.basename(finalfile), 'key': key, 'shards': {}}
+    for value in order:
+        offset = 0
+        descs = {}
+        with open(os.path.join(tmpdir, value + '.txt'), 'w') as file:
+            for line in shards[value]:
+                file.write(line)
+                descs[line.split()[0]] = [offset, len(line)]
+                offset += len(line)
+        manifest['shards'][value] = {'file': value + '.txt', 'bytes': offset,
+                                     'descriptors': descs}
+    with open(os.path.join(tmpdir, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    if os.path.isdir(sharddir):
+        shutil.rmtree(sharddir)
+    os.rename(tmpdir, sharddir)
+    print('Final cache %s sharded by %s: %i shards in %s' % (os.path.basename(finalfile), ','.join(key), len(order), os.path.basename(sharddir)))
+    return manifest
+
+# ---- merge final caches from several datasources
+def merge_final_caches(cachefiles,mergedfile):
+    """
+    Function that merges the final user-friendly caches of several
+    datasources into a single best-coverage cache: the files of each
+    filedescriptor are pooled across datasources and its coverage is
+    worked out again from the pooled files, so that datasources holding
+    different years of a filedescriptor add up. A file name found on
+    several datasources is taken from the one passed first, a file whose
+    years the pool already covers is left out.
+    cachefiles: list of (datasource, final cache file) tuples
+    mergedfile: the merged cache file, same format as the final cache
+    Returns a dictionary datasource: number of filedescriptors it gave files to.
+    """
+    import ast
+    files = {}
+    order = []
+    for ds, cf in cachefiles:
+        if not os.path.exists(cf):
+            continue
+        with open(cf, 'r') as file:
+            for line in file:
+                sl = line.split(None, 3)
+                if len(sl) < 2:
+                    continue
+                header = sl[0]
+                if header not in files:
+                    order.append(header)
+                    files[header] = ([], set())
+                if sl[1] == 'missing' or len(sl) < 4:
+                    continue
+                pool, names = files[header]
+                for path in ast.literal_eval(sl[3].strip()):
+                    if path.split('/')[-1] not in names:
+                        names.add(path.split('/')[-1])
+                        pool.append((path, ds))
+    times = {}
+    if introspectOn is True:
+        times = file_time_ranges([path for pool, names in files.values() for path, ds in pool])
+
+    def span(path):
+        # (first year, last year) of a file, None if unknown
+        if times.get(path) is not None:
+            return times[path][0] // 100, times[path][1] // 100
+        years = file_years(path)
+        return (min(years), max(years)) if years else None
+
+    taken = {}
+    with open(mergedfile, 'w') as file:
+        for header in order:
+            spans = [(span(path), path, ds) for path, ds in files[header][0]]
+            # earliest first, the longer of two files starting together first
+            spans.sort(key=lambda x: (x[0][0], -x[0][1]) if x[0] else (0, 0))
+            paths = []
+            dss = set()
+            end = None
+            for sp, path, ds in spans:
+                if sp is not None and end is not None and sp[1] <= end:
+                    continue
+                if sp is not None:
+                    end = sp[1]
+                paths.append(path)
+                dss.add(ds)
+            for ds in dss:
+                taken[ds] = taken.get(ds, 0) + 1
+            hp = header.split('_')
+            file.write(final_cache_line(header,paths,int(hp[-3]),int(hp[-2]),times))
+    index_final_cache(mergedfile)
+    return taken
+
+# ---- constant time header lookup in a final cache
+# index file: a first line with the cache size, mtime and sha1 and the
+# number of slots, then an open addressing hash table of fixed width slot lines
+# hash(16 hex) offset length, blank if empty; see index_final_cache()
+INDEX_MAGIC = 'CMIP5DATAFINDER-INDEX'
+INDEX_SLOT = '%016x %012i %08i\n'
+INDEX_WIDTH = len(INDEX_SLOT % (0, 0, 0))
+
+def header_hash(header):
+    import hashlib
+    return int(hashlib.sha1(header).hexdigest()[:16], 16)
+
+def index_final_cache(finalfile,indexfile=None):
+    """
+    Writes the lookup index of a final cache (default finalfile + '.idx'):
+    a hash table from filedescriptor header to the byte offset and length
+    of its line, twice as many slots as headers, so that lookup_header()
+    finds a header in one or two reads whatever the size of the cache.
+    """
+    import hashlib
+    if indexfile is None:
+        indexfile = finalfile + '.idx'
+    entries = []
+    offset = 0
+    digest = hashlib.sha1()
+    with open(finalfile, 'r') as file:
+        mtime = os.fstat(file.fileno()).st_mtime
+        for line in file:
+            digest.update(line)
+            if line.strip():
+                entries.append((header_hash(line.split()[0]), offset, len(line)))
+            offset += len(line)
+    nslots = max(2 * len(entries), 1)
+    slots = [None] * nslots
+    for entry in entries:
+        i = entry[0] % nslots
+        while slots[i] is not None:
+            i = (i + 1) % nslots
+        slots[i] = entry
+    empty = ' ' * (INDEX_WIDTH - 1) + '\n'
+    tmp = '%s.%i.tmp' % (indexfile, os.getpid())
+    with open(tmp, 'w') as file:
+        file.write('%s %i %.6f %s %i\n' % (INDEX_MAGIC, offset, mtime, digest.hexdigest(), nslots))
+        for slot in slots:
+            file.write(INDEX_SLOT % slot if slot is not None else empty)
+    os.rename(tmp, indexfile)
+
+def index_is_current(finalfile,indexfile):
+    """
+    True if indexfile was built from finalfile as it is now: same size
+    and mtime, or, if only the mtime moved (a copy, a touch), the same
+    sha1 of the content; the index then takes the new mtime
+    """
+    import hashlib
+    if not os.path.exists(indexfile):
+        return False
+    with open(indexfile, 'r') as idx:
+        first = idx.readline().split()
+    if len(first) != 5 or first[0] != INDEX_MAGIC:
+        return False
+    st = os.stat(finalfile)
+    if int(first[1]) != st.st_size:
+        return False
+    if first[2] == '%.6f' % st.st_mtime:
+        return True
+    digest = hashlib.sha1()
+    with open(finalfile, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), ''):
+            digest.update(chunk)
+    if digest.hexdigest() != first[3]:
+        return False
+    line = '%s %s %.6f %s %s\n' % (INDEX_MAGIC, first[1], st.st_mtime, first[3], first[4])
+    with open(indexfile, 'r+') as idx:
+        if len(idx.readline()) == len(line):
+            idx.seek(0)
+            idx.write(line)
+    return True
+
+def lookup_header(finalfile,header,indexfile=None):
+    """
+    Looks up one filedescriptor header e.g.
+    CMIP5_MIROC5_Amon_historical_r1i1p1_2003_2010_hus in a final cache
+    through its index (rebuilt first if missing or out of date, see
+    index_is_current()) and returns (status, coverage fraction, [paths])
+    or None if not there
+    """
+    import ast
+    if indexfile is None:
+        indexfile = finalfile + '.idx'
+    if not index_is_current(finalfile, indexfile):
+        index_final_cache(finalfile, indexfile)
+    hh = header_hash(header)
+    for attempt in (1, 2):
+        misses = 0
+        with open(indexfile, 'r') as idx:
+            first = idx.readline()
+            nslots = int(first.split()[4])
+            start = len(first)
+            i = hh % nslots
+            with open(finalfile, 'r') as cache:
+                for probe in xrange(nslots):
+                    idx.seek(start + i * INDEX_WIDTH)
+                    slot = idx.read(INDEX_WIDTH).split()
+                    if not slot:
+                        break
+                    if int(slot[0], 16) == hh:
+                        cache.seek(int(slot[1]))
+                        line = cache.read(int(slot[2]))
+                        sl = line.split(None, 3)
+                        if sl and sl[0] == header:
+                            if sl[1] == 'missing':
+                                return ('missing', 0.0, [])
+                            return (sl[1], float(sl[2]), ast.literal_eval(sl[3].strip()))
+                        misses += 1
+                    i = (i + 1) % nslots
+        if misses == 0:
+            return None
+        # the slot points at another line: the cache changed under an
+        # index with the same size and mtime, rebuild it and look again
+        index_final_cache(finalfile, indexfile)
+    return None
 
 #---- function that returns the amount of overlap
 # between needed data and available data
@@ -854,7 +2788,10 @@ def print_final_stats(sfile):
     print('          Missing filedescriptors: %i' % len(mi))
     print('           Complete dbs with gaps: %i' % len(gc))
     print('         Incomplete dbs with gaps: %i' % len(gic))
-    print('      Avg coverage for incomplete: %.2f' % np.mean(prcc))
+    if len(prcc) > 0:
+        print('      Avg coverage for incomplete: %.2f' % (sum(prcc) / len(prcc)))
+    else:
+        print('      Avg coverage for incomplete: nan')
     print('---------------------------')
 
 # ---- plotting the filedescriptors in pie charts
@@ -911,6 +2848,204 @@ def plotter(cachefile,saveDir):
     saveLoc = saveDir + '/incomplete.png'
     plt.savefig(saveLoc)
 
+# ---- runs sharing a working directory
+def run_lock(lockfile,blocking=True):
+    """
+    Takes an exclusive advisory (POSIX) lock on lockfile, created if
+    needed; returns the open lock file, the lock goes when it is closed
+    (or the process exits), see run_unlock(). Not blocking: None if
+    someone else has it.
+    """
+    import fcntl
+    while True:
+        lf = open(lockfile, 'a+')
+        try:
+            if blocking:
+                fcntl.lockf(lf, fcntl.LOCK_EX)
+            else:
+                fcntl.lockf(lf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            lf.close()
+            return None
+        # the holder may have removed the file while we waited on it
+        try:
+            if os.stat(lockfile).st_ino == os.fstat(lf.fileno()).st_ino:
+                return lf
+        except OSError:
+            pass
+        lf.close()
+
+def run_unlock(lf,remove=False):
+    """
+    Releases a lock taken with run_lock(); remove deletes the lock file
+    first (waiters on it notice and lock the next one)
+    """
+    if remove:
+        try:
+            os.remove(lf.name)
+        except OSError:
+            pass
+    lf.close()
+
+def run_key(command_string,params_file):
+    """
+    sha1 of what a run depends on: the command line and the
+    param file contents; equal keys give equal caches
+    """
+    import hashlib
+    key = hashlib.sha1(command_string)
+    if params_file and os.path.exists(params_file):
+        with open(params_file, 'rb') as file:
+            key.update(file.read())
+    return key.hexdigest()
+
+def publish_run(workdir,shared='.'):
+    """
+    Moves the outputs of a run from its private workdir into the shared
+    directory, holding the shared .cmip5datafinder.lock: files go with
+    one atomic rename each, directories (cache_files_[DATASOURCE], shards)
+    are swapped with two, so other runs never see half written caches.
+    Returns the published names.
+    """
+    lf = run_lock(os.path.join(shared, '.cmip5datafinder.lock'))
+    try:
+        names = sorted(os.listdir(workdir))
+        for name in names:
+            src = os.path.join(workdir, name)
+            dst = os.path.join(shared, name)
+            if os.path.isdir(src):
+                old = None
+                if os.path.isdir(dst):
+                    old = os.path.join(workdir, '.old-' + name)
+                    os.rename(dst, old)
+                os.rename(src, dst)
+                if old is not None:
+                    shutil.rmtree(old)
+            else:
+                os.rename(src, dst)
+    finally:
+        lf.close()
+    shutil.rmtree(workdir)
+    return names
+
+# ---- multi-node runs: --shard i/N and the merge subcommand
+def shard_of(model,nshards):
+    """
+    1-based shard of a model out of nshards; a hash of the
+    model name so every job splits the same way
+    """
+    import hashlib
+    return int(hashlib.sha1(model).hexdigest(), 16) % nshards + 1
+
+def shard_descriptors(descriptors,ishard,nshards):
+    """
+    the FileDescriptor's of shard ishard of nshards; all the
+    filedescriptors of a model go to the same shard
+    """
+    return [fd for fd in descriptors if shard_of(fd.model, nshards) == ishard]
+
+def cache_dir_text_file(fname,d):
+    """
+    True if fname is one of the line files a run writes to
+    cache_files_[d] (see write_cache_files(), expand_params() and
+    verify_cache()); not the plots
+    """
+    if fname in ('cache_cmip5_' + d + '.txt', 'cache_cmip5_combined_' + d + '.txt',
+                 'cache_cmip5_synda_' + d + '.txt', 'missing_cache_cmip5_' + d + '.txt',
+                 'missing_cache_cmip5_combined_' + d + '.txt', 'missing_cache_cmip5_synda_' + d + '.txt',
+                 'corrupt_cache_cmip5_' + d + '.txt', 'cache_err.out'):
+        return True
+    return fname.startswith('expanded_')
+
+def merge_shards(sharddirs,outdir='.'):
+    """
+    Combines the outputs of --shard i/N runs (their shard_i_of_N dirs)
+    into the standard outputs in outdir: the line files of cache_files_*
+    (caches, missing caches, errors, expanded param files) are joined and
+    deduplicated, final caches (the cache_* files with an index) are
+    joined and put back in the order of the filedescriptors in the params
+    file (descriptor_order.txt-* of the shards) and indexed again, .shards
+    dirs are rebuilt with the key of their manifest; coverage matrices and
+    plots the shards had are made again from the merged final caches.
+    Built aside and published like a normal run, see publish_run().
+    Returns the names of the final caches.
+    """
+    import json, tempfile
+    workdir = tempfile.mkdtemp(prefix='.cmip5datafinder-run-', dir=outdir)
+    finals = []
+    shardkeys = {}
+    params = []
+    seen = set()
+    position = {}
+    coverage = set()
+    plots = set()
+    for sd in sharddirs:
+        for name in sorted(os.listdir(sd)):
+            src = os.path.join(sd, name)
+            dst = os.path.join(workdir, name)
+            if name.startswith('.') or name.endswith('.idx'):
+                continue
+            elif name.endswith('.coverage.npz'):
+                coverage.add(name[:-len('.coverage.npz')])
+            elif name.startswith('cache_files_') and os.path.isdir(src):
+                d = name[len('cache_files_'):]
+                if not os.path.isdir(dst):
+                    os.makedirs(dst)
+                for fname in os.listdir(src):
+                    if fname.endswith('.png'):
+                        plots.add(d)
+                    elif cache_dir_text_file(fname, d):
+                        with open(os.path.join(dst, fname), 'a') as out:
+                            with open(os.path.join(src, fname), 'r') as file:
+                                shutil.copyfileobj(file, out)
+            elif name.endswith('.shards') and os.path.isdir(src):
+                with open(os.path.join(src, 'manifest.json'), 'r') as file:
+                    shardkeys[name[:-len('.shards')]] = json.load(file)['key']
+            elif name == 'cmip5datafinder.param':
+                with open(src, 'r') as file:
+                    for line in file:
+                        if line not in seen:
+                            seen.add(line)
+                            params.append(line)
+            elif name.startswith('descriptor_order.txt-'):
+                with open(src, 'r') as file:
+                    for line in file:
+                        position.setdefault(line.strip(), len(position))
+            elif name.startswith('cache_') and os.path.isfile(src) and os.path.isfile(src + '.idx'):
+                if name not in finals:
+                    finals.append(name)
+                with open(dst, 'a') as out:
+                    with open(src, 'r') as file:
+                        shutil.copyfileobj(file, out)
+    for name in os.listdir(workdir):
+        if name.startswith('cache_files_'):
+            for fname in os.listdir(os.path.join(workdir, name)):
+                fix_duplicate_entries(os.path.join(workdir, name, fname))
+    # the shards ran with --introspect: their file times are in the time store
+    introspect = len([p for p in params if '--introspect' in p.split()]) > 0
+    for name in finals:
+        finalfile = os.path.join(workdir, name)
+        if position:
+            with open(finalfile, 'r') as file:
+                lines = [line for line in file if line.strip()]
+            # sort is stable: lines of unknown headers keep shard order, last
+            lines.sort(key=lambda line: position.get(line.split()[0], len(position)))
+            with open(finalfile, 'w') as file:
+                file.writelines(lines)
+        index_final_cache(finalfile)
+        if name in shardkeys:
+            shard_final_cache(finalfile, [str(k) for k in shardkeys[name]])
+        if name in coverage:
+            write_coverage_matrix(finalfile, introspect)
+        d = name.rsplit('-', 1)[-1]
+        if d in plots and os.path.getsize(finalfile) > 0:
+            plotter(finalfile, os.path.join(workdir, 'cache_files_' + d))
+    if params:
+        with open(os.path.join(workdir, 'cmip5datafinder.param'), 'w') as file:
+            file.writelines(params)
+    publish_run(workdir, outdir)
+    return finals
+
 # ---- synda check download
 def synda_check_dll():
     """
@@ -918,24 +3053,57 @@ def synda_check_dll():
     """
     print('Your files(s) are being downloaded.')
     print('You can check the download progress with synda queue, see output below')
-    synda_queue = 'synda queue'
-    proc = subprocess.Popen(synda_queue, stdout=subprocess.PIPE, shell=True)
-    (out, err) = proc.communicate()
+    if SYNDA_TAPE['mode'] is None:
+        # answered from the synda database when there is one
+        (out, returncode) = get_synda().queue()
+    else:
+        (out, returncode) = synda_run('queue')
     print(out)
     statusreport = out.split('\n')
     for entry in statusreport:
         if len(entry)>0:
             if entry.split()[0] == 'waiting':
                 print('%i files are waiting, totalling %.2f MB disk' % (int(entry.split()[1]),float(entry.split()[2])))
-    synda_watch = 'synda watch'
-    proc = subprocess.Popen(synda_watch, stdout=subprocess.PIPE, shell=True)
-    (out, err) = proc.communicate()
+    (out, returncode) = synda_run('watch')
     print(out)
 
 # -------------------------------------------------------------------------
 #      Parse the command line options.
 # -------------------------------------------------------------------------
 
+# ---- subcommands, handled before the caching options
+# lookup CACHEFILE HEADER [HEADER ...]: status, coverage and paths of
+# filedescriptors in a final cache, through its index
+if len(sys.argv) > 1 and sys.argv[1] == 'lookup':
+    if len(sys.argv) < 4:
+        print >> sys.stderr, "Usage: cmip5datafinder.py lookup CACHEFILE HEADER [HEADER ...]"
+        sys.exit(1)
+    notfound = 0
+    for header in sys.argv[3:]:
+        found = lookup_header(sys.argv[2], header)
+        if found is None:
+            print >> sys.stderr, "%s not in %s" % (header, sys.argv[2])
+            notfound += 1
+        else:
+            print('%s %s %.2f' % (header, found[0], found[1]))
+            for path in found[2]:
+                print('   ' + path)
+    sys.exit(1 if notfound else 0)
+# merge SHARDDIR [SHARDDIR ...]: combine the outputs of --shard i/N runs
+if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+    if len(sys.argv) < 3:
+        print >> sys.stderr, "Usage: cmip5datafinder.py merge SHARDDIR [SHARDDIR ...]"
+        sys.exit(1)
+    for sd in sys.argv[2:]:
+        if not os.path.isdir(sd):
+            print >> sys.stderr, "Shard directory %s not found. Exiting." % sd
+            sys.exit(1)
+    for name in merge_shards(sys.argv[2:]):
+        print('Merged %i shards into %s' % (len(sys.argv) - 2, name))
+        if os.path.getsize(name) > 0:
+            print_final_stats(name)
+    sys.exit(0)
+
 # ---- Initialise command line argument variables.
 params_file       = None
 userVars          = False
@@ -946,6 +3114,32 @@ dryrunOn          = False
 fpars             = []
 vpars             = []
 verbose           = False
+mergeOn           = False
+max_bytes         = None
+record_dir        = None
+replay_dir        = None
+replay_latency    = 0.
+esgf_url          = None
+esgf_workers      = 4
+ESGF              = None
+http_root         = None
+http_workers      = 4
+DOWNLOADER        = None
+verifyOn          = False
+verify_nworkers   = None
+shard_key         = None
+ishard            = None
+introspectOn      = False
+coverageOn        = False
+nshards           = None
+missing_ttl       = MISSING_TTL
+recheckMissing    = False
+synda_api         = None
+pipeline_queue    = PIPELINE_QUEUE
+progress_mode     = 'auto'
+progress_interval = None
+synda_db          = None
+syndaCLI          = False
 
 # ---- Syntax of options, as required by getopt command.
 # ---- Short form.
@@ -961,7 +3155,30 @@ longop = [
    "dryrun",
    "fileparams=",
    "uservars=",
-   "verbose"
+   "verbose",
+   "merge-datasources",
+   "max-gb=",
+   "record=",
+   "replay=",
+   "replay-latency=",
+   "esgf-search=",
+   "esgf-workers=",
+   "http-download=",
+   "http-workers=",
+   "verify",
+   "verify-workers=",
+   "shard-by=",
+   "shard=",
+   "introspect",
+   "coverage-matrix",
+   "missing-ttl=",
+   "recheck-missing",
+   "synda-api=",
+   "synda-db=",
+   "synda-cli",
+   "pipeline-queue=",
+   "progress=",
+   "progress-interval="
 ]
 
 # ---- Get command-line arguments.
@@ -1008,6 +3225,84 @@ for o, a in opts:
     elif o in ("--verbose"):
       verbose = True
       command_string = command_string + ' --verbose '
+    elif o in ("--merge-datasources"):
+      mergeOn = True
+      command_string = command_string + ' --merge-datasources '
+    elif o in ("--max-gb"):
+        max_bytes = int(float(a) * 1e9)
+        command_string = command_string + ' --max-gb ' + a
+    elif o in ("--record"):
+        record_dir = a
+        command_string = command_string + ' --record ' + a
+    elif o in ("--replay"):
+        replay_dir = a
+        command_string = command_string + ' --replay ' + a
+    elif o in ("--replay-latency"):
+        replay_latency = float(a)
+        command_string = command_string + ' --replay-latency ' + a
+    elif o in ("--esgf-search"):
+        esgf_url = a
+        command_string = command_string + ' --esgf-search ' + a
+    elif o in ("--esgf-workers"):
+        esgf_workers = int(a)
+        command_string = command_string + ' --esgf-workers ' + a
+    elif o in ("--http-download"):
+        http_root = a
+        command_string = command_string + ' --http-download ' + a
+    elif o in ("--http-workers"):
+        http_workers = int(a)
+        command_string = command_string + ' --http-workers ' + a
+    elif o == "--verify":
+        verifyOn = True
+        command_string = command_string + ' --verify '
+    elif o in ("--verify-workers"):
+        verify_nworkers = int(a)
+        command_string = command_string + ' --verify-workers ' + a
+    elif o == "--coverage-matrix":
+        coverageOn = True
+        command_string = command_string + ' --coverage-matrix '
+    elif o == "--introspect":
+        introspectOn = True
+        command_string = command_string + ' --introspect '
+    elif o == "--shard":
+        try:
+            ishard, nshards = [int(x) for x in a.split('/')]
+        except ValueError:
+            ishard = nshards = 0
+        if nshards < 1 or ishard < 1 or ishard > nshards:
+            print >> sys.stderr, "--shard needs I/N with 1 <= I <= N e.g. --shard 2/8. Exiting."
+            sys.exit(1)
+        command_string = command_string + ' --shard ' + a
+    elif o in ("--shard-by"):
+        shard_key = a.split(',')
+        command_string = command_string + ' --shard-by ' + a
+    elif o == "--missing-ttl":
+        missing_ttl = float(a)
+        command_string = command_string + ' --missing-ttl ' + a
+    elif o == "--recheck-missing":
+        recheckMissing = True
+        command_string = command_string + ' --recheck-missing '
+    elif o == "--synda-api":
+        synda_api = a
+        command_string = command_string + ' --synda-api ' + a
+    elif o == "--synda-db":
+        synda_db = a
+        command_string = command_string + ' --synda-db ' + a
+    elif o == "--synda-cli":
+        syndaCLI = True
+        command_string = command_string + ' --synda-cli '
+    elif o == "--pipeline-queue":
+        pipeline_queue = max(0, int(a))
+        command_string = command_string + ' --pipeline-queue ' + a
+    elif o == "--progress":
+        if a not in ('auto', 'tty', 'log', 'off'):
+            print >> sys.stderr, "--progress must be one of auto, tty, log, off"
+            sys.exit(1)
+        progress_mode = a
+        command_string = command_string + ' --progress ' + a
+    elif o == "--progress-interval":
+        progress_interval = max(0.05, float(a))
+        command_string = command_string + ' --progress-interval ' + a
     else:
         print >> sys.stderr, "Unknown option:", o
         usage()
@@ -1038,6 +3333,61 @@ if not db:
     print >> sys.stderr, "No local datasource to search specified"
     print >> sys.stderr, "Use --datasource to specify a valid datasource e.g. badc or dkrz. Exiting..."
     sys.exit(1)
+if record_dir and replay_dir:
+    print >> sys.stderr, "Use --record OR --replay, not both. Exiting."
+    sys.exit(1)
+if record_dir:
+    if not os.path.isdir(record_dir):
+        os.makedirs(record_dir)
+    SYNDA_TAPE['mode'] = 'record'
+    SYNDA_TAPE['dir'] = record_dir
+if replay_dir:
+    if not os.path.isdir(replay_dir):
+        print >> sys.stderr, "Replay directory %s not found. Exiting." % replay_dir
+        sys.exit(1)
+    SYNDA_TAPE['mode'] = 'replay'
+    SYNDA_TAPE['dir'] = replay_dir
+    SYNDA_TAPE['latency'] = replay_latency
+SYNDA_ACCESS['api'] = synda_api
+SYNDA_ACCESS['db'] = synda_db
+SYNDA_ACCESS['cli'] = syndaCLI
+if synda_api and syndaCLI:
+    print >> sys.stderr, "Use --synda-api OR --synda-cli, not both. Exiting."
+    sys.exit(1)
+if http_root:
+    if not esgf_url:
+        print >> sys.stderr, "--http-download needs the file urls of --esgf-search. Exiting."
+        sys.exit(1)
+    from esgf_client import HTTPDownloader
+    DOWNLOADER = HTTPDownloader(http_root, workers=http_workers, verbose=verbose)
+if esgf_url:
+    from esgf_client import ESGFSearch
+    # files synda or the downloader already have are done
+    roots = ['/sdt/data/']
+    if DOWNLOADER is not None:
+        roots.append(DOWNLOADER.root)
+    ESGF = ESGFSearch(esgf_url, pool_size=esgf_workers, status=synda_file_status, roots=roots)
+if nshards and not params_file:
+    print >> sys.stderr, "--shard splits the filedescriptors of a --params-file. Exiting."
+    sys.exit(1)
+if shard_key and [k for k in shard_key if k not in SHARD_KEYS]:
+    print >> sys.stderr, "Can not shard by %s; use one or more of %s. Exiting." % (','.join(shard_key), ','.join(SHARD_KEYS))
+    sys.exit(1)
+if verifyOn and not esgf_url and not syndacall:
+    print >> sys.stderr, "WARNING: --verify takes the checksums from --esgf-search or synda's database; without them only missing files are found"
+# ---- resolve the datasources against the registry
+dsnames = []
+dsentries = {}
+for dsarg in db:
+    dsname, dsentry = get_datasource(dsarg)
+    if dsentry is None:
+        print >> sys.stderr, "Unknown datasource %s; available: %s" % (dsname, ", ".join(sorted(DATASOURCES)))
+        print >> sys.stderr, "Use --datasource NAME=ROOT for a local root not in the list. Exiting..."
+        sys.exit(1)
+    if dsname not in dsnames:
+        dsnames.append(dsname)
+        dsentries[dsname] = dsentry
+db = dsnames
 
 # -------------------------------------------------------------------------
 #      Status message.  Report all supplied arguments.
@@ -1104,11 +3454,20 @@ if syndacall is True:
     if which_synda('synda') is not None:
         print >> sys.stdout, "Synda found...OK" 
         print >> sys.stdout, which_synda('synda')
+        if SYNDA_TAPE['mode'] != 'replay' and len(db) == 1:
+            # opened once here, before any search threads; with several
+            # datasources each process opens its own, see run_datasource()
+            found = get_synda()
+            if verbose is True:
+                print('Calling %s' % found.describe())
+    elif ESGF is not None and (download is False or dryrunOn is True or DOWNLOADER is not None):
+        # searches go to the ESGF API, nothing to install or files fetched over HTTP
+        print >> sys.stdout, "No synda executable, searching %s directly" % esgf_url
     else:
         print >> sys.stderr, "No synda executable found in path. Exiting."
         sys.exit(1)
 
-    if verbose is True:
+    if verbose is True and which_synda('synda') is not None:
         # ---- Have us some information from the synda configuration file
         # ---- one can add more info if needed, currently just data server
         print('\n---------------------------------------------')
@@ -1116,14 +3475,42 @@ if syndacall is True:
         print('---------------------------------------------')
         synda_conf_file = which_synda('synda').rsplit('/',2)[0] + '/conf/sdt.conf'
         print ('Synda conf file %s' % synda_conf_file)
-        with open(synda_conf_file, 'r') as file:
-            for line in file:
-                if line.split('=')[0]=='indexes':
-                    data_server = line.split('=')[1]
-                    print('ESGF data node: %s' % data_server.split()[0])
+        if SYNDA_TAPE['mode'] == 'replay':
+            print('Replaying synda answers from %s' % SYNDA_TAPE['dir'])
+        else:
+            with open(synda_conf_file, 'r') as file:
+                for line in file:
+                    if line.split('=')[0]=='indexes':
+                        data_server = line.split('=')[1]
+                        print('ESGF data node: %s' % data_server.split()[0])
+
+# ---- single-flight: one run per parameter set at a time in this directory;
+# ---- a second run with the same key waits for the first and reuses its caches
+run_id = run_key(command_string, params_file)
+donefile = '.cmip5datafinder-' + run_id + '.done'
+# a .done written after this is the one of the run we would wait for
+done_before = os.path.getmtime(donefile) if os.path.exists(donefile) else None
+inflight = run_lock('.cmip5datafinder-' + run_id + '.inflight', blocking=False)
+if inflight is None:
+    print('A run with the same parameters is in progress here, waiting for its results...')
+    inflight = run_lock('.cmip5datafinder-' + run_id + '.inflight')
+    if os.path.exists(donefile) and os.path.getmtime(donefile) != done_before:
+        with open(donefile, 'r') as file:
+            print('Reusing the caches of the concurrent run: %s' % ' '.join(file.read().split()))
+        sys.exit(0)
+    print('The concurrent run did not finish, running now')
+
+# ---- each run writes into its own working directory, published at the end
+import tempfile, atexit
+WORKDIR = tempfile.mkdtemp(prefix='.cmip5datafinder-run-', dir='.')
+def remove_workdir():
+    # only left if the run failed
+    if os.path.isdir(WORKDIR):
+        shutil.rmtree(WORKDIR)
+atexit.register(remove_workdir)
 
 # ---- Write ASCII file holding cache_BADC.py command.
-pfile = open('cmip5datafinder.param','w')
+pfile = open(os.path.join(WORKDIR, 'cmip5datafinder.param'),'w')
 pfile.write(command_string + "\n")
 pfile.close()
 
@@ -1131,45 +3518,51 @@ pfile.close()
 # ---- hardcoded names so we standardize analyses
 # ---- start overall timing
 t10 = time.time()
+# ---- progress of the run on datasource d, see ProgressReporter
+def start_progress(d, total):
+    # datasources running side by side print log lines with their
+    # name, their tty lines would overwrite each other
+    if len(db) == 1:
+        PROGRESS.start('', total, progress_mode, progress_interval)
+    elif progress_mode == 'auto':
+        PROGRESS.start(d, total, 'log', progress_interval)
+    else:
+        PROGRESS.start(d, total, progress_mode, progress_interval)
+
 # ---- db is a list and we run on each called datasource
-for d in db:
-    # we need to firstly remove any pre existent cache dirs
-    drb = 'cache_files_' + d
-    print('Removing all pre-existent cache directories...')
-    if os.path.isdir(drb):
-        rrc = 'rm -r ' + drb
-        proc = subprocess.Popen(rrc, stdout=subprocess.PIPE, shell=True)
-        (out, err) = proc.communicate()
+def run_datasource(d):
+    """
+    Runs the whole caching chain for datasource d and writes
+    cache_files_[d] and the final cache file; when more than one
+    datasource is passed each runs in its own process, see below.
+    """
+    # cache dirs are built in the run's own WORKDIR and replace
+    # the ones in the current directory only at the end, see publish_run()
+    drb = os.path.join(WORKDIR, 'cache_files_' + d)
     print('Polling %s datasource...' % d)
-    # ...then create new one, standard name cache_files_[SERVER] eg cache_files_badc
-    print('We will be writing all needed cache files to %s directory...' % drb)
-    mkc = 'mkdir -p ' + drb
-    proc = subprocess.Popen(mkc, stdout=subprocess.PIPE, shell=True)
-    (out, err) = proc.communicate()
-    # place the cache files
-    pfile2 = drb + '/cache_cmip5_' + d + '.txt'
-    pfile3 = drb + '/missing_cache_cmip5_' + d + '.txt'
-    if syndacall is True:
-        pfile4 = drb + '/cache_cmip5_synda_' + d + '.txt'
-        pfile5 = drb + '/missing_cache_cmip5_synda_' + d + '.txt'
+    if syndacall is True and SYNDA_TAPE['mode'] != 'replay' and which_synda('synda') is not None:
+        # synda (its database connection, the sys.stdout of its API) is
+        # opened after the fork, before the search threads
+        get_synda()
+    # standard name cache_files_[SERVER] eg cache_files_badc
+    print('We will be writing all needed cache files to %s directory...' % ('cache_files_' + d))
+    os.makedirs(drb)
+    # all the stages add to one in-memory model, the cache
+    # files are written from it at the end, see write_cache_files()
+    results = RunResults()
     errorfile = drb + '/cache_err.out'
     if params_file:
-        nm = 'cache_' + params_file + '-' + d
-        if os.path.exists(nm):
-            os.remove(nm)
+        nm = os.path.join(WORKDIR, 'cache_' + params_file + '-' + d)
     else:
-        nm = 'cache_user.txt-' + d
-        if os.path.exists(nm):
-            os.remove(nm)
+        nm = os.path.join(WORKDIR, 'cache_user.txt-' + d)
 
     # ---- get root directory
     if verbose is True:
         print('Using %s as local searchable datasource' % d)
-    if d == 'badc':
-        host_root = '/badc/cmip5/data/cmip5/output1/'
-        ls_host_root = lsladir(host_root)
-        # this is a standard for badc
-        latestDir = '/latest/'
+    host_root = dsentries[d]['root']
+    ls_host_root = lsladir(host_root)
+    # latest/ on badc, newest vYYYYMMDD dir elsewhere
+    latestDir = version_glob(dsentries[d]['version_dir'])
 
     # ---- start timer
     t1 = time.time()
@@ -1178,8 +3571,8 @@ for d in db:
     if params_file:
         paramfile, paramfile_extension = os.path.splitext(params_file)
 
-        # ---- txt
-        if paramfile_extension=='.txt':
+        # ---- txt, xml namelists and yml recipes
+        if paramfile_extension in ('.txt', '.xml', '.yml', '.yaml'):
             # ---- Parse a generic text parameters file ---- #
             # ---- with the specified variable(s) ---- #
             ##############################################################
@@ -1192,117 +3585,55 @@ for d in db:
             CMIP5 MPI-ESM-LR Amon historical r1i1p1  1900  1982   tro3 
     
             IT IS IMPORTANT TO KEEP THIS ORDER OTHERWISE THINGS CAN GET VERY MESSY !!!
+            Model, experiment, ensemble and variable may be * or comma lists, see expand_params()
             """
+            if paramfile_extension=='.txt':
+                descriptors = list(read_params(params_file))
+            else:
+                # unique filedescriptors across all diagnostics
+                descriptors = list(read_namelist(params_file))
+                print('Parsed %s: %i unique filedescriptors across all diagnostics' % (params_file, len(descriptors)))
+            descriptors = expand_params(descriptors,host_root,drb + '/expanded_' + os.path.basename(params_file),verbose)
+            if nshards:
+                # the order of all the filedescriptors, for merge_shards()
+                with open(os.path.join(WORKDIR, 'descriptor_order.txt-' + d), 'w') as file:
+                    for fd in descriptors:
+                        file.write(fd.header() + '\n')
+                descriptors = shard_descriptors(descriptors,ishard,nshards)
+                print('Shard %i of %i: %i filedescriptors' % (ishard, nshards, len(descriptors)))
+            # filedescriptors known to be missing are not looked for again
+            known = known_missing(descriptors,host_root,ls_host_root,latestDir)
+            if known:
+                print('%i filedescriptors missing locally and on ESGF as of %s, not searched again (see --recheck-missing)' % (len(known), MISSING_STORE))
+                for header in sorted(known):
+                    results.add_known_missing(header, syndacall)
+            scan = [fd for fd in descriptors if fd.header() not in known]
+            start_progress(d, len(descriptors))
+            PROGRESS.skip(len(descriptors) - len(scan))
             if syndacall is True:
-                # first poll the local server
-                if verbose is True:
-                    write_cache_direct(params_file,ls_host_root,host_root,pfile2,pfile3,errorfile,latestDir,verbose)
+                # poll the local server; what it is missing goes to synda
+                # search and install while the scan goes on, see SyndaPipeline
+                if ESGF is not None:
+                    nsearch = esgf_workers
                 else:
-                    write_cache_direct(params_file,ls_host_root,host_root,pfile2,pfile3,errorfile,latestDir,verbose=False)
-                print_stats(pfile2,pfile3)
-                # check for incomplete/missing filedescriptors
-                if os.path.exists(pfile3):
-                    ar = open(pfile3, 'r')
-                    lls = [line for line in ar if line.split()[0].split('_')[0] == 'CMIP5']
-                    lenitemlist = len(lls)
-                    cat11 = [(p.split()[0],'dope') for p in lls if p.split()[1] == 'ERROR-MISSING']
-                    cat21 = [(p.split()[0],p.split()[2]) for p in lls if p.split()[1] == 'INCOMPLETE']
-                    # construct two dictionaries:
-                    # A: contains all missing filedescriptors
-                    # B: contains the incomplete filedescriptors
-                    A = {}
-                    B = {}
-                    for item in cat21:
-                        A.setdefault(item[0],[]).append(item[1])
-                    for item in cat11:
-                        B.setdefault(item[0],[]).append(item[1])
-                    # convolve A and B so synda will download only the A's 'dope' (missing)
-                    # and the bits from B that are not already on disk
-                    Z = dict(A, **B)
+                    nsearch = 1
+                pipe = SyndaPipeline(results,download,dryrunOn,max_bytes,verbose,pipeline_queue,nsearch)
+                pipe.start()
+                write_cache_direct(scan,ls_host_root,host_root,results,errorfile,latestDir,verbose,found=pipe.feed)
+                print_stats(results.local_lines(),results.missing_lines())
+                if pipe.groups:
                     if verbose is True:
                         print('\n-----------------------------------------------------------------------------------------------------')
-                        print('We parsed a missing LOCAL data param file. We have missing/incomplete files for %i filedescriptors: ' % lenitemlist)
+                        print('We parsed a missing LOCAL data param file. We have missing/incomplete files for %i filedescriptors: ' % len(results.missing_headers()))
                         print('Calling SYNDA to look for data in /sdt/data or download what is not found...')
                         print('-------------------------------------------------------------------------------------------------------')
-                    for it in lls:
-                        ite = it.split()[0].split('_')
-                        v1 = ite[7]
-                        header = it.split()[0]
-                        model_data = ite[0] + ' '+ ite[1] + ' ' + ite[2]\
-                                     + ' ' + ite[3] + ' ' + ite[4]
-                        yr1 = int(ite[5])
-                        yr2 = int(ite[6])
-                        # call synda search
-                        outpt = synda_search(model_data,v1)
-                        if download is True:
-                            if verbose is True:
-                                if dryrunOn:
-                                    s = synda_dll(outpt,v1,yr1,yr2,header,Z,pfile4,pfile5,download=True,dryrunOn=True,verbose=True)
-                                else:
-                                    s = synda_dll(outpt,v1,yr1,yr2,header,Z,pfile4,pfile5,download=True,dryrunOn=False,verbose=True)
-                            else:
-                                if dryrunOn:
-                                    s = synda_dll(outpt,v1,yr1,yr2,header,Z,pfile4,pfile5,download=True,dryrunOn=True,verbose=False)
-                                else:
-                                    s = synda_dll(outpt,v1,yr1,yr2,header,Z,pfile4,pfile5,download=True,dryrunOn=False,verbose=False)
-                        else:
-                            if verbose is True:
-                                s = synda_dll(outpt,v1,yr1,yr2,header,Z,pfile4,pfile5,download=False,dryrunOn=False,verbose=True)
-                            else:
-                                s = synda_dll(outpt,v1,yr1,yr2,header,Z,pfile4,pfile5,download=False,dryrunOn=False,verbose=False)
-                        if s == 0:
-                            with open(pfile5, 'a') as file:
-                                file.write(header + ' ' + 'ERROR-MISSING' + '\n')
-                                file.close()
-                    if os.path.exists(pfile4):
-                        fix_duplicate_entries(pfile4)
-                    if os.path.exists(errorfile):
-                        fix_duplicate_entries(errorfile)
-                    print_stats(pfile4,pfile5)
-
-                    # final cache merging and cleanup
-                    if os.path.exists(pfile2) and os.path.exists(pfile4):
-                        # create a composite file using caches from sever and synda
-                        compf = drb + '/cache_cmip5_combined_' + d + '.txt'
-                        cache_merge(pfile2,pfile4,compf)
-                        final_cache(params_file,compf,nm)
-                        print_final_stats(nm)
-                        plotter(nm,drb)
-                    else:
-                        # looks like synda didnt find anything extra
-                        if os.path.exists(pfile2):
-                            cpc = 'cp ' + pfile2 + ' ' + drb + '/cache_cmip5_combined_' + d + '.txt'
-                            proc = subprocess.Popen(cpc, stdout=subprocess.PIPE, shell=True)
-                            (out, err) = proc.communicate()
-                            final_cache(params_file,pfile2,nm)
-                            print_final_stats(nm)
-                            plotter(nm,drb)
-                        else:
-                            # looks like there is nothing in local but synda found extra
-                            if os.path.exists(pfile4):
-                                cpc = 'cp ' + pfile4 + ' ' + drb + '/cache_cmip5_combined_' + d + '.txt'
-                                proc = subprocess.Popen(cpc, stdout=subprocess.PIPE, shell=True)
-                                (out, err) = proc.communicate()
-                                final_cache(params_file,pfile4,nm)
-                                print_final_stats(nm)
-                                plotter(nm,drb)
-                    # in case synda missed some filedescriptors
-                    if os.path.exists(pfile5):
-                        fix_duplicate_entries(pfile5)
-                        cpc = 'cp ' + pfile5 + ' ' + drb + '/missing_cache_cmip5_combined_' + d + '.txt'
-                        proc = subprocess.Popen(cpc, stdout=subprocess.PIPE, shell=True)
-                        (out, err) = proc.communicate()
-                else:
+                pipe.close()
+                if pipe.groups:
+                    print_stats(results.synda_lines(),results.synda_missing_lines())
+                    pipe.report()
+                elif not known:
                     # no need to call synda if we found all needed filedescriptors on server
                     print('Cached all needed data from local datasource %s' % d)
-                    if os.path.exists(pfile2):
-                        cpc = 'cp ' + pfile2 + ' ' + drb + '/cache_cmip5_combined_' + d + '.txt'
-                        proc = subprocess.Popen(cpc, stdout=subprocess.PIPE, shell=True)
-                        (out, err) = proc.communicate()
-                        final_cache(params_file,pfile2,nm)
-                        print_final_stats(nm)
-                        plotter(nm,drb)
-                    #sys.exit(0)
             else:
                 # not calling synda at all
                 if verbose is True:
@@ -1310,156 +3641,123 @@ for d in db:
                     print('We have looked at existing files LOCALLY only: ')
                     print('Here is what we found:')
                     print('---------------------------------------------------------------------------------------')
-                    write_cache_direct(params_file,ls_host_root,host_root,pfile2,pfile3,errorfile,latestDir,verbose)
+                    write_cache_direct(scan,ls_host_root,host_root,results,errorfile,latestDir,verbose)
                 else:
-                    write_cache_direct(params_file,ls_host_root,host_root,pfile2,pfile3,errorfile,latestDir,verbose=False)
-                if os.path.exists(errorfile):
-                    fix_duplicate_entries(errorfile)
-                print_stats(pfile2,pfile3)
-                if os.path.exists(pfile2):
-                    cpc = 'cp ' + pfile2 + ' ' + drb + '/cache_cmip5_combined_' + d + '.txt'
-                    proc = subprocess.Popen(cpc, stdout=subprocess.PIPE, shell=True)
-                    (out, err) = proc.communicate()
-                    final_cache(params_file,pfile2,nm)
-                    print_final_stats(nm)
-                    plotter(nm,drb)
-                if os.path.exists(pfile3):
-                    cpc = 'cp ' + pfile3 + ' ' + drb + '/missing_cache_cmip5_combined_' + d + '.txt'
-                    proc = subprocess.Popen(cpc, stdout=subprocess.PIPE, shell=True)
-                    (out, err) = proc.communicate()
+                    write_cache_direct(scan,ls_host_root,host_root,results,errorfile,latestDir,verbose=False)
+                print_stats(results.local_lines(),results.missing_lines())
 
 
     elif userVars:
     
         # ---- user command line arguments parsed here
+        descriptors = []
+        budget_left = max_bytes
+        known = known_missing([FileDescriptor(fpars[0], fpars[1], fpars[2], fpars[3], fpars[4],
+                                              int(fpars[5]), int(fpars[6]), vi) for vi in vpars],
+                              host_root,ls_host_root,latestDir)
+        start_progress(d, len(set(vpars)))
         for vi in vpars:
-            if os.path.exists('prepended_temp.txt'):
-                os.remove('prepended_temp.txt')
-            #if os.path.exists('temp.txt'):
-            #    os.remove('temp.txt')
-            header = fpars[0] + '_'+ fpars[1] + '_' + fpars[2]\
-                     + '_' + fpars[3] + '_' + fpars[4] + '_' + str(fpars[5])+ '_' + str(fpars[6])\
-                     + '_' + vi
-            model_data = fpars[0] + ' '+ fpars[1] + ' ' + fpars[2]\
-                     + ' ' + fpars[3] + ' ' + fpars[4]
+            fd = FileDescriptor(fpars[0], fpars[1], fpars[2], fpars[3], fpars[4],
+                                int(fpars[5]), int(fpars[6]), vi)
+            if fd in descriptors:
+                continue
+            descriptors.append(fd)
+            header = fd.header()
+            if header in known:
+                print('Missing locally and on ESGF as of %s, not searched again (see --recheck-missing): %s' % (MISSING_STORE, header))
+                results.add_known_missing(header, syndacall)
+                PROGRESS.skip(1)
+                continue
+            model_data = fd.model_data()
             if verbose is True:
                 print('Looking at variable %s' % vi)
                 print('Model data for: ', model_data + '\n')
-            yr1 = fpars[5]
-            yr2 = fpars[6]
-            tempfile = open('temp.txt', 'a')
-            templine = model_data + ' ' + str(yr1) + ' ' + str(yr2) + ' ' + vi + '\n'
-            tempfile.write(templine)
-            tempfile.close()
+            yr1 = fd.year1
+            yr2 = fd.year2
             if verbose is True:
-                write_cache_direct('temp.txt',ls_host_root,host_root,pfile2,pfile3,errorfile,latestDir,verbose)
+                write_cache_direct([fd],ls_host_root,host_root,results,errorfile,latestDir,verbose)
             else:
-                write_cache_direct('temp.txt',ls_host_root,host_root,pfile2,pfile3,errorfile,latestDir,verbose=False)
-            print_stats(pfile2,pfile3)
+                write_cache_direct([fd],ls_host_root,host_root,results,errorfile,latestDir,verbose=False)
+            print_stats(results.local_lines(),results.missing_lines())
             if syndacall is True:
-                if os.path.exists(pfile3):
+                if results.is_missing(header):
                     if verbose is True:
                         print('\n-------------------------------------------------------------------------------------')
                         print('We are missing files for our needed filedescriptor: %s' % model_data + ' ' + str(yr1) + ' ' + str(yr2) + ' ' + vi)
                         print('Calling SYNDA to look for data in /sdt/data or download what is not found...')
                         print('---------------------------------------------------------------------------------------')
-                    ar = open(pfile3, 'r')
-                    lls = [line for line in ar if line.split()[0].split('_')[0] == 'CMIP5']
-                    lenitemlist = len(lls)
-                    cat11 = [(p.split()[0],'dope') for p in lls if p.split()[1] == 'ERROR-MISSING']
-                    cat21 = [(p.split()[0],p.split()[2]) for p in lls if p.split()[1] == 'INCOMPLETE']
-                    A = {}
-                    B = {}
-                    for item in cat21:
-                        A.setdefault(item[0],[]).append(item[1])
-                    for item in cat11:
-                        B.setdefault(item[0],[]).append(item[1])
-                    Z = dict(A, **B)
-                    outpt = synda_search(model_data,vi)
+                    Z = results.incomplete_files()
+                    tsearch = time.time()
+                    PROGRESS.wait(1)
+                    PROGRESS.search_begin()
+                    if ESGF is not None:
+                        outpt = ESGF.search(model_data,vi)
+                    else:
+                        outpt = synda_search(model_data,vi)
                     if download is True:
+                        plan = {'files': {}, 'have': {}}
                         if verbose is True:
                             if dryrunOn:
-                                s = synda_dll(outpt,vi,yr1,yr2,header,Z,pfile4,pfile5,download=True,dryrunOn=True,verbose=True)
+                                s = synda_dll(outpt,vi,yr1,yr2,header,Z,results,download=True,dryrunOn=True,verbose=True,plan=plan)
                             else:
-                                s = synda_dll(outpt,vi,yr1,yr2,header,Z,pfile4,pfile5,download=True,dryrunOn=False,verbose=True)
+                                s = synda_dll(outpt,vi,yr1,yr2,header,Z,results,download=True,dryrunOn=False,verbose=True,plan=plan)
                         else:
                             if dryrunOn:
-                                s = synda_dll(outpt,vi,yr1,yr2,header,Z,pfile4,pfile5,download=True,dryrunOn=True,verbose=False)
+                                s = synda_dll(outpt,vi,yr1,yr2,header,Z,results,download=True,dryrunOn=True,verbose=False,plan=plan)
                             else:
-                                s = synda_dll(outpt,vi,yr1,yr2,header,Z,pfile4,pfile5,download=True,dryrunOn=False,verbose=False)
+                                s = synda_dll(outpt,vi,yr1,yr2,header,Z,results,download=True,dryrunOn=False,verbose=False,plan=plan)
                     else:
                         if verbose is True:
-                            s = synda_dll(outpt,vi,yr1,yr2,header,Z,pfile4,pfile5,download=False,dryrunOn=False,verbose=True)
+                            s = synda_dll(outpt,vi,yr1,yr2,header,Z,results,download=False,dryrunOn=False,verbose=True)
                         else:
-                            s = synda_dll(outpt,vi,yr1,yr2,header,Z,pfile4,pfile5,download=False,dryrunOn=False,verbose=False)
+                            s = synda_dll(outpt,vi,yr1,yr2,header,Z,results,download=False,dryrunOn=False,verbose=False)
+                    PROGRESS.search_end(1, len(results.get(header).synda or ()), time.time() - tsearch)
+                    if download is True:
+                        # the budget is shared by all the variables
+                        steps, skipped = plan_downloads(plan,{header: [fd]},budget_left)
+                        install_plan(steps,skipped,results,budget_left,dryrunOn,verbose)
+                        if budget_left is not None:
+                            budget_left -= sum([st[2] for st in steps])
                     if s == 0:
-                        with open(pfile5, 'a') as file:
-                            file.write(header + ' ' + 'ERROR-MISSING' + '\n')
-                            file.close()
-                    if os.path.exists(pfile4):
-                        fix_duplicate_entries(pfile4)
-                    if os.path.exists(errorfile):
-                        fix_duplicate_entries(errorfile)
-                    print_stats(pfile4,pfile5)
-                    # final cache merging and cleanup
-                    if os.path.exists(pfile2) and os.path.exists(pfile4):
-                        # create a composite file using caches from sever and synda
-                        compf = drb + '/cache_cmip5_combined_' + d + '.txt'
-                        cache_merge(pfile2,pfile4,compf)
-                        final_cache('temp.txt',compf,nm)
-                        print_final_stats(nm)
-                    else:
-                        # looks like synda didnt find anything extra
-                        if os.path.exists(pfile2):
-                            cpc = 'cp ' + pfile2 + ' ' + drb + '/cache_cmip5_combined_' + d + '.txt'
-                            proc = subprocess.Popen(cpc, stdout=subprocess.PIPE, shell=True)
-                            (out, err) = proc.communicate()
-                            final_cache('temp.txt',pfile2,nm)
-                            print_final_stats(nm)
-                        else:
-                            # looks like there is nothing in local but synda found extra
-                            if os.path.exists(pfile4):
-                                cpc = 'cp ' + pfile4 + ' ' + drb + '/cache_cmip5_combined_' + d + '.txt'
-                                proc = subprocess.Popen(cpc, stdout=subprocess.PIPE, shell=True)
-                                (out, err) = proc.communicate()
-                                final_cache('temp.txt',pfile4,nm)
-                                print_final_stats(nm)
-                    # in case synda missed some filedescriptors
-                    if os.path.exists(pfile5):
-                        fix_duplicate_entries(pfile5)
-                        cpc = 'cp ' + pfile5 + ' ' + drb + '/missing_cache_cmip5_combined_' + d + '.txt'
-                        proc = subprocess.Popen(cpc, stdout=subprocess.PIPE, shell=True)
-                        (out, err) = proc.communicate()
+                        results.add_synda_missing(header)
+                    print_stats(results.synda_lines(),results.synda_missing_lines())
                 else:
                     # no need to call synda if we found all needed filedescriptors on server
                     print('Cached all data from local datasource %s' % d)
-                    if os.path.exists(pfile2):
-                        cpc = 'cp ' + pfile2 + ' ' + drb + '/cache_cmip5_combined_' + d + '.txt'
-                        proc = subprocess.Popen(cpc, stdout=subprocess.PIPE, shell=True)
-                        (out, err) = proc.communicate()
-                        final_cache('temp.txt',pfile2,nm)
-                        print_final_stats(nm)
-            # not calling synda at all
-            if verbose is True:
-                print('\n-------------------------------------------------------------------------------------')
-                print('We have looked at existing files LOCALLY only: ')
-                print('Here is what we found:')
-                print('---------------------------------------------------------------------------------------')
-            if os.path.exists(errorfile):
-                fix_duplicate_entries(errorfile)
-                print_stats(pfile2,pfile3)
-            if os.path.exists(pfile2):
-                cpc = 'cp ' + pfile2 + ' ' + drb + '/cache_cmip5_combined_' + d + '.txt'
-                proc = subprocess.Popen(cpc, stdout=subprocess.PIPE, shell=True)
-                (out, err) = proc.communicate()
-                final_cache('temp.txt',pfile2,nm)
-                print_final_stats(nm)
-            if os.path.exists(pfile3):
-                cpc = 'cp ' + pfile3 + ' ' + drb + '/missing_cache_cmip5_combined_' + d + '.txt'
-                proc = subprocess.Popen(cpc, stdout=subprocess.PIPE, shell=True)
-                (out, err) = proc.communicate()
-            #os.remove('temp.txt')
-            os.remove('prepended_temp.txt')
+
+    PROGRESS.stop()
+
+    # ---- remember what is missing both locally and on ESGF
+    if syndacall is True:
+        record_missing(descriptors,results,host_root,ls_host_root,latestDir)
+
+    # ---- cache files, written once from the results of all the stages
+    if os.path.exists(errorfile):
+        fix_duplicate_entries(errorfile)
+    combined = write_cache_files(results,drb,d,syndacall)
+    installed = results.installed_files() if verifyOn is True else []
+    del results
+    if combined:
+        final_cache(descriptors,combined,nm)
+        print_final_stats(nm)
+        if params_file:
+            plotter(nm,drb)
+    elif nshards:
+        # a shard reports its filedescriptors even if it found nothing
+        final_cache(descriptors,combined,nm)
+
+    # ---- coverage array for portfolio wide queries
+    if coverageOn is True and os.path.exists(nm):
+        write_coverage_matrix(nm, introspectOn)
+
+    # ---- one final cache file per model, variable etc
+    if shard_key and os.path.exists(nm):
+        shard_final_cache(nm, shard_key)
+
+    # ---- check the cached files are intact
+    if verifyOn is True and installed:
+        verify_cache(installed, drb + '/corrupt_cache_cmip5_' + d + '.txt', verify_nworkers, verbose)
+    close_synda()
 
     # ---- timing and exit
     t2 = time.time()
@@ -1471,12 +3769,54 @@ for d in db:
         print('=================================')
     print('Time elapsed: %.1f s' % dt)
 
+# ---- one datasource runs here, several run concurrently
+# ---- in separate processes, each in its own cache_files_[SERVER]
+if len(db) == 1:
+    run_datasource(db[0])
+else:
+    import multiprocessing
+    procs = []
+    for d in db:
+        dsproc = multiprocessing.Process(target=run_datasource, args=(d,))
+        dsproc.start()
+        procs.append((d, dsproc))
+    for d, dsproc in procs:
+        dsproc.join()
+        if dsproc.exitcode != 0:
+            print >> sys.stderr, "WARNING: run on datasource %s exited with code %i" % (d, dsproc.exitcode)
+
+# ---- best-coverage cache across datasources
+if mergeOn is True:
+    if params_file:
+        mnm = os.path.join(WORKDIR, 'cache_' + params_file + '-merged')
+        fcs = [(d, os.path.join(WORKDIR, 'cache_' + params_file + '-' + d)) for d in db]
+    else:
+        mnm = os.path.join(WORKDIR, 'cache_user.txt-merged')
+        fcs = [(d, os.path.join(WORKDIR, 'cache_user.txt-' + d)) for d in db]
+    taken = merge_final_caches(fcs,mnm)
+    print('Merged best-coverage cache: %s' % os.path.basename(mnm))
+    for d in db:
+        print('  %i filedescriptors with files from %s' % (taken.get(d, 0), d))
+    if os.path.exists(mnm) and os.path.getsize(mnm) > 0:
+        print_final_stats(mnm)
+    if coverageOn is True and os.path.exists(mnm):
+        write_coverage_matrix(mnm, introspectOn)
+    if shard_key and os.path.exists(mnm):
+        shard_final_cache(mnm, shard_key)
+
+# ---- publish the caches and let waiting runs of the same parameters have them
+if nshards:
+    outdir = 'shard_%i_of_%i' % (ishard, nshards)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    published = publish_run(WORKDIR, outdir)
+else:
+    published = publish_run(WORKDIR)
+with open(donefile, 'w') as file:
+    file.write('\n'.join(published) + '\n')
+run_unlock(inflight, remove=True)
+
 # ---- finish, cleanup and exit
-if params_file:
-    prp = 'prepended_' + params_file
-    os.remove(prp)
-if userVars:
-    os.remove('temp.txt')
 t20 = time.time()
 dt0 = t20 - t10
 if verbose is True:
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""
+Model x variable x month coverage matrix of a final cache
+(cache_PARAM_FILE-DATASOURCE) as a numpy array, so that questions like
+"which models have complete tas and pr for 1980-2005" are array
+reductions instead of new scripts rescanning the text caches.
+cmip5datafinder.py --coverage-matrix writes it next to each final cache
+as cache_PARAM_FILE-DATASOURCE.coverage.npz with the arrays:
+  coverage   bool [model, variable, month], any run (experiment_ensemble)
+  by_run     bool [model, run, variable, month]
+  models, runs, variables  label axes (strings)
+  months     label axis, yyyymm integers
+The functions below work on the loaded dict (load_coverage()); this
+module is imported by cmip5datafinder.py and is a small command line
+tool as well.
+
+Example run:
+python coverage_matrix.py --matrix cache_example.txt-badc.coverage.npz --complete tas,pr --years 1980-2005
+python coverage_matrix.py --matrix cache_example.txt-badc.coverage.npz --heatmap coverage.png
+"""
+# -------------------------------------------------------------------------
+#      Setup.
+# -------------------------------------------------------------------------
+
+# ---- Import standard modules to the python path.
+import sys, os, getopt
+import numpy as np
+
+__author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
+
+# ---- Function usage.
+def usage():
+  msg = """\
+Queries on a model x variable x month coverage matrix written by
+cmip5datafinder.py --coverage-matrix
+
+Usage:
+  coverage_matrix.py [options]
+  -h, --help                  Display this message and exit
+  --matrix <FILE>             The .coverage.npz file [REQUIRED]
+  --years <Y1-Y2>             Period of the queries (default: the whole matrix)
+  --complete <VARS>           Models with complete coverage of all VARS (comma list) in one run
+  --best-run <MODEL>          Run of MODEL covering --vars best
+  --vars <VARS>               Variables for --best-run (default: all)
+  --gaps                      Gap summary per model and variable
+  --heatmap <PNG>             Plot the model x variable coverage fraction
+"""
+  print >> sys.stderr, msg
+
+def file_months(path, times=None):
+    """
+    (first, last) yyyymm of a data file, from times (path: (first, last, ...)
+    e.g. from the netCDF time coordinate) or its _YYYYMM-YYYYMM name suffix;
+    None if not known
+    """
+    if times and times.get(path) is not None:
+        return times[path][0], times[path][1]
+    rng = path.split('/')[-1].split('_')[-1].replace('.nc', '').split('-')
+    if len(rng) != 2 or len(rng[0]) < 6 or len(rng[1]) < 6:
+        return None
+    try:
+        return int(rng[0][:6]), int(rng[1][:6])
+    except ValueError:
+        return None
+
+def month_index(yyyymm, month0):
+    # index of yyyymm in a months axis starting at month0
+    return (yyyymm // 100 - month0 // 100) * 12 + yyyymm % 100 - month0 % 100
+
+def build_coverage(finalfile, outfile=None, time_ranges=None):
+    """
+    Builds the coverage matrix of a final cache and saves it to outfile
+    (default finalfile + '.coverage.npz'); the months axis spans the
+    years of the filedescriptors in the cache. time_ranges, if given, is
+    called once with all the file paths and returns their
+    {path: (first, last yyyymm, ...)} e.g. from the netCDF time
+    coordinates; file names are used otherwise.
+    Returns the arrays as a dict.
+    """
+    import ast
+    if outfile is None:
+        outfile = finalfile + '.coverage.npz'
+    entries = []
+    years = []
+    models, runs, variables = set(), set(), set()
+    with open(finalfile, 'r') as file:
+        for line in file:
+            sl = line.split(None, 3)
+            if len(sl) < 2:
+                continue
+            hp = sl[0].split('_')
+            if len(hp) != 8:
+                continue
+            models.add(hp[1])
+            runs.add(hp[3] + '_' + hp[4])
+            variables.add(hp[7])
+            years.extend([int(hp[5]), int(hp[6])])
+            paths = ast.literal_eval(sl[3].strip()) if len(sl) == 4 else []
+            entries.append((hp[1], hp[3] + '_' + hp[4], hp[7], paths))
+    models, runs, variables = sorted(models), sorted(runs), sorted(variables)
+    times = None
+    if time_ranges is not None:
+        times = time_ranges([path for e in entries for path in e[3]])
+    if years:
+        months = np.array([y * 100 + m for y in range(min(years), max(years) + 1)
+                           for m in range(1, 13)], dtype=np.int32)
+    else:
+        months = np.zeros(0, dtype=np.int32)
+    by_run = np.zeros((len(models), len(runs), len(variables), len(months)), dtype=bool)
+    mi = dict([(m, i) for i, m in enumerate(models)])
+    ri = dict([(r, i) for i, r in enumerate(runs)])
+    vi = dict([(v, i) for i, v in enumerate(variables)])
+    for model, run, var, paths in entries:
+        for path in paths:
+            rng = file_months(path, times)
+            if rng is None:
+                continue
+            i0 = max(month_index(rng[0], months[0]), 0)
+            i1 = min(month_index(rng[1], months[0]), len(months) - 1)
+            if i1 >= i0:
+                by_run[mi[model], ri[run], vi[var], i0:i1 + 1] = True
+    cov = {'coverage': by_run.any(axis=1), 'by_run': by_run,
+           'models': np.array(models), 'runs': np.array(runs),
+           'variables': np.array(variables), 'months': months}
+    np.savez_compressed(outfile, **cov)
+    return cov
+
+def load_coverage(fname):
+    """
+    the arrays of a .coverage.npz file as a dict
+    """
+    with np.load(fname) as npz:
+        return dict([(k, npz[k]) for k in npz.files])
+
+def month_slice(cov, y1=None, y2=None):
+    # months axis slice of the years y1..y2
+    months = cov['months']
+    if y1 is None:
+        y1 = months[0] // 100 if len(months) else 0
+    if y2 is None:
+        y2 = months[-1] // 100 if len(months) else 0
+    return slice(np.searchsorted(months, y1 * 100 + 1), np.searchsorted(months, y2 * 100 + 12, side='right'))
+
+def var_index(cov, variables=None):
+    # variable axis indices, all variables if None; unknown variables give None
+    if variables is None:
+        return np.arange(len(cov['variables']))
+    found = [np.where(cov['variables'] == v)[0] for v in variables]
+    if [f for f in found if len(f) == 0]:
+        return None
+    return np.array([f[0] for f in found])
+
+def complete_for_range(cov, variables, y1=None, y2=None):
+    """
+    models that have every month of y1..y2 of all variables in one run
+    """
+    vidx = var_index(cov, variables)
+    if vidx is None:
+        return []
+    sub = cov['by_run'][:, :, vidx, month_slice(cov, y1, y2)]
+    ok = sub.reshape(sub.shape[0], sub.shape[1], -1).all(axis=2).any(axis=1)
+    return list(cov['models'][ok])
+
+def best_run(cov, model, variables=None, y1=None, y2=None):
+    """
+    (run, covered fraction) of the run (experiment_ensemble) of model
+    that covers the most months of variables in y1..y2
+    """
+    mi = np.where(cov['models'] == model)[0]
+    vidx = var_index(cov, variables)
+    if len(mi) == 0 or vidx is None:
+        return None, 0.
+    sub = cov['by_run'][mi[0]][:, vidx, month_slice(cov, y1, y2)]
+    frac = sub.reshape(sub.shape[0], -1).mean(axis=1)
+    best = int(np.argmax(frac))
+    return str(cov['runs'][best]), float(frac[best])
+
+def gap_summary(cov, y1=None, y2=None):
+    """
+    [(model, variable, covered fraction, number of gaps)] for every
+    model and variable with some data in y1..y2; a gap is a stretch of
+    missing months between covered ones
+    """
+    sub = cov['coverage'][:, :, month_slice(cov, y1, y2)].astype(np.int8)
+    frac = sub.mean(axis=2) if sub.shape[2] else np.zeros(sub.shape[:2])
+    # a gap starts where a covered month is followed by a missing one
+    # and some covered month comes later
+    later = np.flip(np.maximum.accumulate(np.flip(sub, axis=2), axis=2), axis=2)
+    starts = (sub[:, :, :-1] == 1) & (sub[:, :, 1:] == 0) & (later[:, :, 1:] == 1)
+    ngaps = starts.sum(axis=2)
+    found = []
+    for i, j in zip(*np.nonzero(frac > 0)):
+        found.append((str(cov['models'][i]), str(cov['variables'][j]), float(frac[i, j]), int(ngaps[i, j])))
+    return found
+
+def coverage_heatmap(cov, pngfile, y1=None, y2=None):
+    """
+    plots the covered fraction of y1..y2 per model and variable
+    """
+    import matplotlib as mpl
+    mpl.use('Agg')
+    import matplotlib.pyplot as plt
+    sub = cov['coverage'][:, :, month_slice(cov, y1, y2)]
+    frac = sub.mean(axis=2) if sub.shape[2] else np.zeros(sub.shape[:2])
+    fig, ax = plt.subplots(figsize=(max(4, 0.5 * len(cov['variables']) + 3),
+                                    max(3, 0.3 * len(cov['models']) + 2)))
+    im = ax.imshow(frac, vmin=0, vmax=1, cmap='viridis', aspect='auto')
+    ax.set_xticks(range(len(cov['variables'])))
+    ax.set_xticklabels(cov['variables'], rotation=90)
+    ax.set_yticks(range(len(cov['models'])))
+    ax.set_yticklabels(cov['models'])
+    fig.colorbar(im, ax=ax, label='covered fraction')
+    plt.title('Data coverage by model and variable')
+    plt.tight_layout()
+    plt.savefig(pngfile)
+
+if __name__ == '__main__':
+    # ---- parse command line
+    matrix = None
+    y1 = y2 = None
+    complete = None
+    bestrun = None
+    qvars = None
+    gaps = False
+    heatmap = None
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "matrix=", "years=", "complete=",
+                                                      "best-run=", "vars=", "gaps", "heatmap="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(1)
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit(0)
+        elif o == "--matrix":
+            matrix = a
+        elif o == "--years":
+            y1, y2 = [int(y) for y in a.split('-')]
+        elif o == "--complete":
+            complete = a.split(',')
+        elif o == "--best-run":
+            bestrun = a
+        elif o == "--vars":
+            qvars = a.split(',')
+        elif o == "--gaps":
+            gaps = True
+        elif o == "--heatmap":
+            heatmap = a
+    if not matrix or not os.path.exists(matrix):
+        print >> sys.stderr, "No --matrix file found. Exiting."
+        usage()
+        sys.exit(1)
+    cov = load_coverage(matrix)
+    print('%i models x %i variables x %i months (%i runs)' % (len(cov['models']), len(cov['variables']),
+                                                             len(cov['months']), len(cov['runs'])))
+    if complete:
+        print('Complete for %s: %s' % (','.join(complete), ' '.join(complete_for_range(cov, complete, y1, y2)) or 'none'))
+    if bestrun:
+        run, frac = best_run(cov, bestrun, qvars, y1, y2)
+        print('Best run of %s: %s (%.2f covered)' % (bestrun, run, frac))
+    if gaps:
+        for model, var, frac, ngaps in gap_summary(cov, y1, y2):
+            print('%-20s %-10s %.2f covered, %i gaps' % (model, var, frac, ngaps))
+    if heatmap:
+        coverage_heatmap(cov, heatmap, y1, y2)
+        print('Heatmap written to %s' % heatmap)
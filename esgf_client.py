@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+"""
+Clients for ESGF used by cmip5datafinder.py:
+  - ESGFSearch (--esgf-search URL) queries the ESGF search REST API in
+    place of synda search -f and returns the same SyndaRecord's (see
+    synda_records.py), with the HTTP url and checksum of each file;
+  - HTTPDownloader (--http-download ROOT) fetches files straight from
+    the data nodes into their DRS path, resuming interrupted transfers
+    and checking sizes and checksums on the way.
+
+  esgf = ESGFSearch('https://esgf-index1.ceda.ac.uk/esg-search/search')
+  recs = list(esgf.search('CMIP5 MPI-ESM-LR Amon historical r1i1p1', 'tas'))
+  HTTPDownloader('/sdt/data').fetch_many([(r.url, r.local_path('/sdt/data/'), r.size,
+                                           r.checksum, r.checksum_type) for r in recs])
+
+See esgf_standin.py for a local stand-in of both the index and the data nodes.
+"""
+# -------------------------------------------------------------------------
+#      Setup.
+# -------------------------------------------------------------------------
+
+# ---- Import standard modules to the python path.
+import sys, os, time
+from synda_records import synda_record
+
+__author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
+
+# ---- ESGF search API client
+class ESGFSearch(object):
+    """
+    Minimal client for the ESGF search REST API e.g.
+    https://esgf-index1.ceda.ac.uk/esg-search/search
+    that stands in for synda search -f: keep-alive HTTP connections from
+    a bounded pool, limit/offset paging, only the fields we need, and
+    search_many() to run several searches concurrently. Results are
+    SyndaRecord's, status done if status(file id) (synda's database) says
+    so or, when it does not know the file, if the file is under one of the
+    roots (/sdt/data), new otherwise.
+    Any HTTP server answering the same queries will do, see esgf_standin.py
+    """
+    FIELDS = 'instance_id,size,url,checksum,checksum_type'
+    FACETS = ('project', 'model', 'cmor_table', 'experiment', 'ensemble')
+
+    def __init__(self, url, pool_size=4, limit=500, timeout=120, status=None, roots=('/sdt/data/',)):
+        import urlparse, Queue, threading
+        parsed = urlparse.urlparse(url)
+        self.https = parsed.scheme == 'https'
+        self.host = parsed.netloc
+        self.path = parsed.path or '/esg-search/search'
+        self.limit = limit
+        self.timeout = timeout
+        self.pool_size = pool_size
+        # idle connections; at most pool_size are ever opened
+        self.pool = Queue.Queue()
+        self.opened = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        # synda status of a file id (None if unknown) and the
+        # local roots a file counts as done under
+        self.status = status
+        self.roots = roots
+        # basename -> records of all searches, e.g. to verify files against
+        self.seen = {}
+
+    def _connect(self):
+        import httplib
+        if self.https:
+            return httplib.HTTPSConnection(self.host, timeout=self.timeout)
+        return httplib.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _get(self, query):
+        """
+        one GET on a pooled connection, returns the decoded json;
+        a stale keep-alive connection is replaced once
+        """
+        import httplib, socket, urllib, json, Queue
+        try:
+            conn = self.pool.get_nowait()
+        except Queue.Empty:
+            with self.lock:
+                opened = self.opened < self.pool_size
+                if opened:
+                    self.opened += 1
+            if opened:
+                conn = self._connect()
+            else:
+                conn = self.pool.get()
+        url = self.path + '?' + urllib.urlencode(query)
+        try:
+            for attempt in (1, 2):
+                try:
+                    conn.request('GET', url, headers={'Connection': 'keep-alive'})
+                    resp = conn.getresponse()
+                    body = resp.read()
+                    break
+                except (httplib.HTTPException, socket.error):
+                    conn.close()
+                    if attempt == 2:
+                        raise
+                    conn = self._connect()
+            with self.lock:
+                self.requests += 1
+            if resp.status != 200:
+                raise IOError('ESGF search answered %i for %s' % (resp.status, url))
+            return json.loads(body)
+        finally:
+            self.pool.put(conn)
+
+    def search(self, model_data, varname):
+        """
+        Generator over the SyndaRecord's for e.g.
+        model_data = 'CMIP5 MPI-ESM-LR Amon historical r1i1p1', varname = 'tro3'
+        fetched limit records at a time
+        """
+        query = dict(zip(self.FACETS, model_data.split()))
+        query.update({'variable': varname, 'type': 'File', 'replica': 'false',
+                      'fields': self.FIELDS, 'format': 'application/solr+json',
+                      'limit': self.limit})
+        offset = 0
+        seen = set()
+        while True:
+            query['offset'] = offset
+            response = self._get(query)['response']
+            docs = response['docs']
+            for doc in docs:
+                rec = self.record(doc)
+                if rec is not None and rec.file_name not in seen:
+                    seen.add(rec.file_name)
+                    yield rec
+            offset += len(docs)
+            if len(docs) == 0 or offset >= response['numFound']:
+                break
+
+    def record(self, doc):
+        """
+        SyndaRecord of one solr doc
+        """
+        def first(value):
+            if isinstance(value, list):
+                return value[0] if value else None
+            return value
+        file_name = first(doc.get('instance_id'))
+        if file_name is None:
+            return None
+        # instance ids may carry a |data_node suffix
+        rec = synda_record('new', int(first(doc.get('size')) or 0), str(file_name.split('|')[0]))
+        if rec is None:
+            return None
+        known = None
+        if self.status is not None:
+            known = self.status(rec.file_name)
+        if known is not None:
+            # synda's own record: a file still in transfer is not done
+            rec.status = 'done' if known == 'done' else 'new'
+        elif [root for root in self.roots if os.path.exists(rec.local_path(root))]:
+            rec.status = 'done'
+        for url in doc.get('url', []):
+            # URL|mime type|service name
+            if url.split('|')[-1] == 'HTTPServer':
+                rec.url = str(url.split('|')[0])
+        rec.checksum = first(doc.get('checksum'))
+        rec.checksum_type = first(doc.get('checksum_type'))
+        with self.lock:
+            self.seen.setdefault(rec.basename, []).append(rec)
+        return rec
+
+    def search_many(self, queries, workers=4):
+        """
+        runs search() for a list of (model_data, varname) in
+        workers threads, returns {(model_data, varname): [records]}
+        """
+        from multiprocessing.dummy import Pool
+        pool = Pool(max(1, min(workers, len(queries))))
+        try:
+            results = pool.map(lambda q: list(self.search(q[0], q[1])), queries)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(queries, results))
+
+# ---- parallel HTTP downloader
+class HTTPDownloader(object):
+    """
+    Downloads files straight from the ESGF data nodes instead of handing
+    them to synda install; needs the HTTPServer url of each file, so it
+    only works with --esgf-search records. Files land in their DRS path
+    under root (e.g. /sdt/data/). workers threads each keep one keep-alive
+    connection per data node, so there are never more than workers
+    connections to a node. Each file streams to PATH.part and is hashed
+    on the way (checksum_type of the search record, sha256 if none) so
+    it is never read back; an interrupted PATH.part is resumed with a
+    Range request (its bytes are hashed once to seed the checksum). Only
+    a complete file with the right size and checksum is renamed into place;
+    without a size from the search the length comes from the response
+    (Content-Range or Content-Length, or the end of a chunked body) and
+    a body of unknown length stays in PATH.part.
+    """
+    CHUNK = 1 << 20
+
+    def __init__(self, root, workers=4, timeout=120, verbose=False):
+        import threading
+        self.root = root.rstrip('/') + '/'
+        self.workers = workers
+        self.timeout = timeout
+        self.verbose = verbose
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.opened = []
+
+    def _conn(self, scheme, host):
+        # this thread's connection to host
+        conns = self.local.__dict__.setdefault('conns', {})
+        if (scheme, host) not in conns:
+            import httplib
+            if scheme == 'https':
+                conn = httplib.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                conn = httplib.HTTPConnection(host, timeout=self.timeout)
+            with self.lock:
+                self.opened.append(conn)
+            conns[(scheme, host)] = conn
+        return conns[(scheme, host)]
+
+    def _drop(self, scheme, host):
+        conn = self.local.__dict__.get('conns', {}).pop((scheme, host), None)
+        if conn is not None:
+            conn.close()
+
+    def _length(self, resp, offset):
+        # full file length from a response starting at offset, None if
+        # the response does not say
+        total = (resp.getheader('content-range') or '').rpartition('/')[2]
+        if total.isdigit():
+            return int(total)
+        length = resp.getheader('content-length')
+        if length and length.isdigit() and resp.status in (200, 206):
+            return offset + int(length) if resp.status == 206 else int(length)
+        return None
+
+    def fetch(self, url, dest, size=None, checksum=None, checksum_type=None, retries=3):
+        """
+        downloads url to dest; returns (bytes transferred, error message
+        or None if dest is in place)
+        """
+        import hashlib, httplib, socket, urlparse
+        if os.path.exists(dest) and (not size or os.path.getsize(dest) == size):
+            return 0, None
+        try:
+            digest = hashlib.new((checksum_type or 'sha256').lower())
+        except ValueError:
+            # unknown checksum type, size check only
+            digest = hashlib.sha256()
+            checksum = None
+        part = dest + '.part'
+        try:
+            os.makedirs(os.path.dirname(dest))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(dest)):
+                raise
+        offset = 0
+        if os.path.exists(part):
+            with open(part, 'rb') as file:
+                for chunk in iter(lambda: file.read(self.CHUNK), ''):
+                    digest.update(chunk)
+                    offset += len(chunk)
+        parsed = urlparse.urlparse(url)
+        path = parsed.path + ('?' + parsed.query if parsed.query else '')
+        got = 0
+        expect = size or None
+        for attempt in range(1, retries + 1):
+            headers = {'Connection': 'keep-alive'}
+            if offset > 0:
+                headers['Range'] = 'bytes=%i-' % offset
+            try:
+                conn = self._conn(parsed.scheme, parsed.netloc)
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                if not size:
+                    expect = self._length(resp, offset)
+                if resp.status == 416 and expect is not None and offset == expect:
+                    # .part was complete already
+                    resp.read()
+                    break
+                if resp.status == 200 and offset > 0:
+                    # the server ignored the range, start over
+                    offset = 0
+                    digest = hashlib.new(digest.name)
+                    if not size:
+                        expect = self._length(resp, 0)
+                elif resp.status not in (200, 206):
+                    resp.read()
+                    return got, 'HTTP %i %s' % (resp.status, resp.reason)
+                with open(part, 'ab' if offset > 0 else 'wb') as file:
+                    for chunk in iter(lambda: resp.read(self.CHUNK), ''):
+                        file.write(chunk)
+                        digest.update(chunk)
+                        offset += len(chunk)
+                        got += len(chunk)
+                if expect is None and resp.chunked:
+                    # httplib raises IncompleteRead on a cut chunked body,
+                    # so one read to the end is the whole file
+                    expect = offset
+                if expect and offset < expect:
+                    # connection dropped mid-file, resume from offset
+                    self._drop(parsed.scheme, parsed.netloc)
+                    continue
+                break
+            except (httplib.HTTPException, socket.error) as err:
+                self._drop(parsed.scheme, parsed.netloc)
+                if attempt == retries:
+                    return got, str(err)
+        if expect is None:
+            # no way to tell a cut connection from the end of the file
+            return got, 'length unknown, kept %s' % part
+        if offset != expect:
+            return got, 'got %i of %i bytes' % (offset, expect)
+        if checksum and digest.hexdigest() != checksum.lower():
+            os.remove(part)
+            return got, '%s checksum mismatch' % digest.name
+        os.rename(part, dest)
+        return got, None
+
+    def fetch_many(self, jobs):
+        """
+        downloads a list of (url, dest, size, checksum, checksum_type) in
+        workers threads and reports the throughput; returns {dest: error or None}
+        """
+        from multiprocessing.dummy import Pool
+        if not jobs:
+            return {}
+        def one(job):
+            t0 = time.time()
+            got, err = self.fetch(*job)
+            return job[1], got, err, time.time() - t0
+        errors = {}
+        total = 0
+        t0 = time.time()
+        pool = Pool(max(1, min(self.workers, len(jobs))))
+        try:
+            for dest, got, err, dt in pool.imap_unordered(one, jobs):
+                errors[dest] = err
+                total += got
+                if err is not None:
+                    print >> sys.stderr, "HTTP download failed: %s (%s)" % (dest, err)
+                elif self.verbose is True:
+                    print('Downloaded %s: %.1f MB in %.1f s (%.1f MB/s)' % (dest, got / 1e6, dt, got / 1e6 / max(dt, 1e-6)))
+        finally:
+            pool.close()
+            pool.join()
+            for conn in self.opened:
+                conn.close()
+        dt = time.time() - t0
+        nfail = len([e for e in errors.values() if e is not None])
+        print('HTTP downloads: %i files, %.1f MB in %.1f s (%.1f MB/s) over %i connections; %i failed'
+              % (len(jobs) - nfail, total / 1e6, dt, total / 1e6 / max(dt, 1e-6), len(self.opened), nfail))
+        self.opened = []
+        return errors
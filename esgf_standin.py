@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+"""
+Small local stand-in for the ESGF search REST API (esg-search/search),
+to test and benchmark cmip5datafinder.py --esgf-search offline.
+It serves recorded responses: solr json answers saved from a real index
+(format=application/solr+json) and/or synda calls recorded with
+cmip5datafinder.py --record DIR; both are turned into File docs that are
+filtered by the query facets, paged with limit/offset and cut down to
+the requested fields. Connections are kept alive (HTTP/1.1).
+It is also a data node for cmip5datafinder.py --http-download: each doc
+comes with an HTTPServer url under /thredds/fileServer/ and the sha256
+checksum of a synthetic .nc file of its size (capped by --max-size),
+served with Range support; --drop-after breaks the first transfer of
+each file to exercise the resume path.
+
+Example run:
+python esgf_standin.py --responses synda_tape --port 8008
+python cmip5datafinder.py -p example.txt --synda --datasource badc --esgf-search http://localhost:8008/esg-search/search
+python cmip5datafinder.py -p example.txt --synda --download --datasource badc --esgf-search http://localhost:8008/esg-search/search --http-download /tmp/sdt/data
+"""
+# -------------------------------------------------------------------------
+#      Setup.
+# -------------------------------------------------------------------------
+
+# ---- Import standard modules to the python path.
+import sys, os, getopt, time, json, hashlib, threading
+import urlparse
+import BaseHTTPServer, SocketServer
+
+__author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
+
+# ---- facets of a CMIP5 file instance id
+FACETS = ['project', 'product', 'institute', 'model', 'experiment',
+          'time_frequency', 'realm', 'cmor_table', 'ensemble', 'version']
+
+# ---- sizes as printed by synda search e.g. 221.2 MB
+SIZE_UNITS = {'bytes': 1, 'B': 1, 'kB': 10**3, 'KB': 10**3, 'MB': 10**6,
+              'GB': 10**9, 'TB': 10**12}
+
+# ---- synthetic file content is this block size repeated
+BLOCK = 1 << 16
+
+# ---- Function usage.
+def usage():
+  msg = """\
+Local stand-in for the ESGF search API, serving recorded responses.
+
+Usage:
+  esgf_standin.py [options]
+  -h, --help                  Display this message and exit
+  --responses <DIR>           Directory of recorded responses: solr json files and/or
+                              cmip5datafinder.py --record files [REQUIRED]
+  --port <PORT>               Port to listen on (default 8008)
+  --latency <SEC>             Wait SEC seconds before each answer to model a real index
+  --max-size <BYTES>          Cap on the size of the synthetic files served (default 4000000)
+  --drop-after <BYTES>        Close the connection after BYTES of the first transfer of each file
+  --verbose                   Log every request
+"""
+  print >> sys.stderr, msg
+
+def file_doc(instance_id, size):
+    """
+    solr File doc for a CMIP5 file instance id, facets
+    taken from the id itself
+    """
+    parts = instance_id.split('.', 10)
+    doc = dict(zip(FACETS, parts[:10]))
+    doc['title'] = parts[10]
+    doc['variable'] = parts[10].split('_')[0]
+    doc['instance_id'] = instance_id
+    doc['size'] = size
+    doc['type'] = 'File'
+    return doc
+
+def file_path(doc):
+    """
+    data node path of a doc: DRS dirs, version, variable, file name
+    """
+    return '/thredds/fileServer/' + '/'.join([doc[f] for f in FACETS] + [doc['variable'], doc['title']])
+
+def content(instance_id, start, end):
+    """
+    generator over bytes start..end-1 of the synthetic file of instance_id:
+    a block seeded by the id, repeated
+    """
+    block = hashlib.sha256(instance_id).digest() * (BLOCK // 32)
+    pos = start
+    while pos < end:
+        off = pos % BLOCK
+        chunk = block[off:min(BLOCK, off + end - pos)]
+        pos += len(chunk)
+        yield chunk
+
+def add_files(docs, max_size):
+    """
+    caps doc sizes to max_size, adds checksums and returns the
+    {data node path: (instance id, size)} of the synthetic files
+    """
+    files = {}
+    for doc in docs:
+        iid = doc['instance_id']
+        if isinstance(iid, list):
+            iid = iid[0]
+        iid = str(iid.split('|')[0])
+        size = doc.get('size', 0)
+        if isinstance(size, list):
+            size = size[0]
+        size = min(int(size), max_size)
+        digest = hashlib.sha256()
+        for chunk in content(iid, 0, size):
+            digest.update(chunk)
+        doc['size'] = size
+        doc['checksum'] = [digest.hexdigest()]
+        doc['checksum_type'] = ['SHA256']
+        doc['_path'] = file_path(file_doc(iid, size))
+        files[doc['_path']] = (iid, size)
+    return files
+
+def load_responses(dirname):
+    """
+    reads all recorded responses in dirname and returns
+    the unique File docs, in file name order
+    """
+    docs = []
+    seen = set()
+    for name in sorted(os.listdir(dirname)):
+        if not name.endswith('.json') or name.startswith('.'):
+            continue
+        with open(os.path.join(dirname, name), 'r') as file:
+            entry = json.load(file)
+        found = []
+        if 'response' in entry:
+            # solr answer of a real index
+            for doc in entry['response'].get('docs', []):
+                if 'instance_id' in doc:
+                    iid = doc['instance_id']
+                    if isinstance(iid, list):
+                        iid = iid[0]
+                    full = file_doc(iid.split('|')[0], doc.get('size', 0))
+                    full.update(doc)
+                    found.append(full)
+        elif entry.get('args', '').startswith('search'):
+            # synda search -f output recorded by cmip5datafinder.py --record
+            for line in entry['stdout'].splitlines():
+                cols = line.split()
+                if len(cols) >= 4 and len(cols[3].split('.', 10)) == 11:
+                    size = int(round(float(cols[1]) * SIZE_UNITS.get(cols[2], 1)))
+                    found.append(file_doc(cols[3], size))
+        for doc in found:
+            iid = doc['instance_id']
+            if isinstance(iid, list):
+                iid = iid[0]
+            if iid not in seen:
+                seen.add(iid)
+                docs.append(doc)
+    return docs
+
+def matches(doc, query):
+    """
+    True if doc has all the facet values asked for in query
+    """
+    for facet, values in query.items():
+        if facet in ('limit', 'offset', 'fields', 'format', 'type', 'replica',
+                     'distrib', 'latest'):
+            continue
+        value = doc.get(facet)
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if value is None or str(value).lower() not in [v.lower() for v in values]:
+            return False
+    return True
+
+class StandinHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    answers GET .../search?facet=value&limit=N&offset=M&fields=a,b
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.stats['connections'] += 1
+
+    def log_message(self, format, *args):
+        if self.server.verbose is True:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_body(self, code, body, ctype):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_file(self, path):
+        """
+        serves a synthetic file, whole or from a bytes=N- Range
+        """
+        iid, size = self.server.files[path]
+        start = 0
+        rng = self.headers.get('Range')
+        if rng and rng.startswith('bytes=') and rng[6:].split('-')[0].isdigit():
+            start = int(rng[6:].split('-')[0])
+            if start >= size:
+                self.send_body(416, '', 'text/plain')
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %i-%i/%i' % (start, size - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/netcdf')
+        self.send_header('Content-Length', str(size - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        with self.server.lock:
+            drop = self.server.drop_after > 0 and path not in self.server.dropped
+            self.server.dropped.add(path)
+        sent = 0
+        for chunk in content(iid, start, size):
+            if drop and sent + len(chunk) > self.server.drop_after:
+                self.wfile.write(chunk[:self.server.drop_after - sent])
+                self.server.stats['dropped'] += 1
+                self.close_connection = 1
+                return
+            self.wfile.write(chunk)
+            sent += len(chunk)
+        self.server.stats['bytes'] += sent
+
+    def do_GET(self):
+        self.server.stats['requests'] += 1
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        parsed = urlparse.urlparse(self.path)
+        if parsed.path in self.server.files:
+            self.send_file(parsed.path)
+            return
+        if not parsed.path.endswith('/search'):
+            self.send_body(404, 'not found\n', 'text/plain')
+            return
+        query = urlparse.parse_qs(parsed.query)
+        limit = int(query.get('limit', ['10'])[0])
+        offset = int(query.get('offset', ['0'])[0])
+        fields = query.get('fields', ['*'])[0].split(',')
+        hits = [doc for doc in self.server.docs if matches(doc, query)]
+        page = []
+        base = 'http://' + self.headers.get('Host', '%s:%i' % self.server.server_address)
+        for doc in hits[offset:offset + limit]:
+            full = dict([(f, v) for f, v in doc.items() if not f.startswith('_')])
+            full['url'] = [base + doc['_path'] + '|application/netcdf|HTTPServer']
+            if fields == ['*']:
+                page.append(full)
+            else:
+                page.append(dict([(f, full[f]) for f in fields if f in full]))
+        body = json.dumps({'response': {'numFound': len(hits), 'start': offset, 'docs': page}})
+        self.send_body(200, body, 'application/json')
+
+class StandinServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+# ---- parse command line
+responses = None
+port = 8008
+latency = 0.
+verbose = False
+max_size = 4000000
+drop_after = 0
+try:
+    opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "responses=", "port=", "latency=",
+                                                  "max-size=", "drop-after=", "verbose"])
+except getopt.GetoptError:
+    usage()
+    sys.exit(1)
+for o, a in opts:
+    if o in ("-h", "--help"):
+        usage()
+        sys.exit(0)
+    elif o == "--responses":
+        responses = a
+    elif o == "--port":
+        port = int(a)
+    elif o == "--latency":
+        latency = float(a)
+    elif o == "--max-size":
+        max_size = int(a)
+    elif o == "--drop-after":
+        drop_after = int(a)
+    elif o == "--verbose":
+        verbose = True
+if not responses:
+    print >> sys.stderr, "No --responses directory specified. Exiting."
+    usage()
+    sys.exit(1)
+
+server = StandinServer(('127.0.0.1', port), StandinHandler)
+server.docs = load_responses(responses)
+server.files = add_files(server.docs, max_size)
+server.latency = latency
+server.verbose = verbose
+server.drop_after = drop_after
+server.dropped = set()
+server.lock = threading.Lock()
+server.stats = {'connections': 0, 'requests': 0, 'bytes': 0, 'dropped': 0}
+print('Serving %i File docs from %s on http://127.0.0.1:%i/esg-search/search' % (len(server.docs), responses, port))
+sys.stdout.flush()
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+print('Served %i requests over %i connections, %i file bytes, %i transfers dropped'
+      % (server.stats['requests'], server.stats['connections'], server.stats['bytes'], server.stats['dropped']))
@@ -11,14 +11,14 @@ data files if not found in the local path.
 # -------------------------------------------------------------------------
 
 # ---- Import standard modules to the python path.
-import sys, os, shutil, math, random, copy, getopt, re, string, popen2, time
-import numpy as np
-from numpy import loadtxt as lt
-from numpy import savetxt as st
-from xml.dom import minidom
+# ---- only light modules here; numpy is imported where it is used
+# ---- so that startup and synda lookups stay fast
+import sys, os, shutil, getopt, time
 import subprocess
 from datetime import datetime
-import time
+from synda_adapter import which_synda
+from synda_records import time_handling, parse_synda_search
+from param_files import read_namelist
 
 __author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
 
@@ -31,10 +31,10 @@ For queries, email valeriu.predoi@ncas.ac.uk. Have fun!
 
 Usage:
   get_data_synda.py [options]
-  -p, --params-file <file>    Namelist file (xml) or text file (txt) or any other input file 
+  -p, --params-file <file>    Namelist file (xml), recipe (yml) or text file (txt)
                               e.g. for xml: --params-file ESMValTool/nml/namelist_myTest.xml
-                              e.g. for text:
-                              e.g. for yaml:
+                              e.g. for text: --params-file example.txt
+                              e.g. for yaml: --params-file recipe_myTest.yml
                               This option is REQUIRED if --user-input is not present
   -h, --help                  Display this message and exit
   --user-input                Flag for user defined file and variables parameters (to be inputted at command line)
@@ -56,65 +56,6 @@ Usage:
 # ---- Operational functions here ---- #
 ########################################
 
-# ---- get the path to synda executable
-def which_synda(synda):
-    """
-
-    This function returns the path to the synda exec
-    or aborts the whole program if path is not found.
-
-    """
-    def is_exe(fpath):
-        return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
-
-    fpath, fname = os.path.split(synda)
-    if fpath:
-        if is_exe(synda):
-            #print('We are using the following executable: %s' % synda)
-            return synda
-    else:
-        for path in os.environ["PATH"].split(os.pathsep):
-            path = path.strip('"')
-            exe_file = os.path.join(path, synda)
-            if is_exe(exe_file):
-                #print('We are using the following executable: %s' % exe_file)
-                return exe_file
-
-    #print('No synda executable found on the system. Aborting program.')
-    return None
-
-# ---- handling the years for files
-def time_handling(year1, year1_model, year2, year2_model):
-    """
-
-    year1 - the start year in files
-    year1_model - the needed start year of data
-    year2 - the last year in files
-    year2_model - the needed last year of data
-    we compromise on months
-
-    """
-    # model interval < data interval / file
-    if year1 <= int(year1_model) and year2 >= int(year2_model):
-        return True
-    # model interval > data interval / file
-    elif year1 >= int(year1_model) and year2 <= int(year2_model):
-        return True
-    elif year1 <= int(year1_model) and year2 <= int(year2_model):
-        # data is entirely before model
-        if year2 <= int(year1_model):
-            return False
-        # data overlaps to the left
-        elif year2 >= int(year1_model):
-            return True
-    elif year1 >= int(year1_model) and year2 >= int(year2_model):
-        # data is entirely after model
-        if year1 >= int(year2_model):
-            return False
-        # data overlaps to the right
-        elif year1 <= int(year2_model):
-            return True
-
 # ---- synda search
 def synda_search(model_data,varname,server):
     """
@@ -130,6 +71,7 @@ def synda_search(model_data,varname,server):
 
     in a directory called allAvailableFiles_SERVER. This info may be needed for later 
     analyses or manual downloads. It is a good data tracking tool as well.
+    Returns a SyndaRecord generator that reads the synda output line by line.
 
     """
     # this is needed mostly for parallel processes that may
@@ -150,16 +92,18 @@ def synda_search(model_data,varname,server):
         cachefile = open(outfiletitle, 'w')
     synda_search = which_synda('synda') + ' search -f ' + model_data + ' ' + varname
     proc = subprocess.Popen(synda_search, stdout=subprocess.PIPE, shell=True)
-    (out, err) = proc.communicate()
-    if err is not None:
-        print >> sys.stderr, "An error has occured while searching for data:"
-        print >> sys.stderr, err
-        sys.exit(1)
-    else:
-        cachefile.write(out)
-        return out
-    cachefile.close()
-    cachefile.save()
+
+    def lines():
+        # copy the output lines to the Data_Files file as they arrive
+        try:
+            for line in iter(proc.stdout.readline, ''):
+                cachefile.write(line)
+                yield line
+        finally:
+            cachefile.close()
+            proc.stdout.close()
+            proc.wait()
+    return parse_synda_search(lines())
 
 # ---- synda download
 def synda_dll(searchoutput,varname,year1_model,year2_model,outfile,dryrunOn):
@@ -167,7 +111,7 @@ def synda_dll(searchoutput,varname,year1_model,year2_model,outfile,dryrunOn):
     This function takes the standard search output from synda
     and parses it to see if/what files need to be downloaded
 
-    The searchoutput argument is a string and is of the form e.g.
+    The searchoutput argument is a SyndaRecord iterator (parse_synda_search()) over lines of the form e.g.
 
     new   221.2 MB  cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-195912.nc
     done  132.7 MB  cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_200001-200512.nc
@@ -188,70 +132,61 @@ def synda_dll(searchoutput,varname,year1_model,year2_model,outfile,dryrunOn):
         sys.exit(1)
     with open(outfile, 'a') as file:
         file.close()
-    entries = searchoutput.split('\n')[:-1]
-    if len(entries)>0:
-        for entry in entries:
-            label=str(entry.split()[0])
-            file_name = entry.split()[3]
-            time_range = file_name.split('_')[-1].strip('.nc')
-            time1 = time_range.split('-')[0]
-            y1 = datetime.strptime(time1, '%Y%m')
-            year1 = y1.year
-            time2 = time_range.split('-')[1]
-            y2 = datetime.strptime(time2, '%Y%m')           
-            year2 = y2.year
-            if time_handling(year1, year1_model, year2, year2_model) is True:
-                print('Matching needed time interval with the following database file:')
-                print(file_name)
-                print('\n')
-                if label=='done':
-                    print('File has already been downloaded, path:')
-                    print('----------------------------------------------------')
-                    file_name_complete = ".".join(file_name.split('.')[:10]) + '.' + varname + '.' + ".".join(file_name.split('.')[10:])
-                    filepath_complete = '/sdt/data/c' + file_name_complete.replace('.','/').strip('/nc') + '.nc'
-                    print(filepath_complete + '\n')
+    nrec = 0
+    for rec in searchoutput:
+        nrec += 1
+        if rec.year1 is not None and time_handling(rec.year1, year1_model, rec.year2, year2_model)[0] is True:
+            print('Matching needed time interval with the following database file:')
+            print(rec.file_name)
+            print('\n')
+            filepath = rec.local_path()
+            if rec.status=='done':
+                print('File has already been downloaded, path:')
+                print('----------------------------------------------------')
+                print(filepath + '\n')
+                with open(outfile, 'a') as file:
+                    file.write(filepath + '\n')
+                    file.close()
+                print('----------------------------------------------------')
+                # no download #
+            elif rec.status=='new':
+                print('File has NOT been downloaded previously, initiating the download now...')
+                print('----------------------------------------------------')
+                if dryrunOn is True:
+                    print('Needed file would be installed here: \n')
+                    print(filepath + '\n')
                     with open(outfile, 'a') as file:
-                        file.write(filepath_complete + '\n')
+                        file.write(filepath + '\n')
                         file.close()
-                    print('----------------------------------------------------')
-                    # no download #
-                elif label=='new':
-                    print('File has NOT been downloaded previously, initiating the download now...')
-                    print('----------------------------------------------------')
-                    file_name_new = ".".join(file_name.split('.')[:10]) + '.' + varname + '.' + ".".join(file_name.split('.')[10:])
-                    filepath_new = '/sdt/data/c' + file_name_new.replace('.','/').strip('/nc') + '.nc'
-                    if dryrunOn is True:
-                        print('Needed file would be installed here: \n')
-                        print(filepath_new + '\n')
+                    print('But --dryrun so no downloads! Run without --dryrun to download file. Exiting now, bye \n')
+                    print('------------------------------------------------')
+                    # no download, dryrun only #
+                else:
+                    print('Ready to download...calling synda now...')
+                    synda_install = which_synda('synda') +  ' install ' + rec.file_name
+                    proc = subprocess.Popen(synda_install, stdout=subprocess.PIPE, stdin=subprocess.PIPE, shell=True)
+                    dll ='\n'
+                    (out, err) = proc.communicate(input=dll)
+                    if err is not None:
+                        print >> sys.stderr, "An error has occured while starting the download:"
+                        print >> sys.stderr, err
+                        sys.exit(1)
+                    else:
+                        print('Your file is under download and after download finishes you can find it here:')
+                        print(filepath + '\n')
+                        print('Writing cache file now...')
                         with open(outfile, 'a') as file:
-                            file.write(filepath_new + '\n')
+                            file.write(filepath + '\n')
                             file.close()
-                        print('But --dryrun so no downloads! Run without --dryrun to download file. Exiting now, bye \n')
-                        print('------------------------------------------------')
-                        # no download, dryrun only #
-                    else:
-                        print('Ready to download...calling synda now...')
-                        synda_install = which_synda('synda') +  ' install ' + file_name
-                        proc = subprocess.Popen(synda_install, stdout=subprocess.PIPE, stdin=subprocess.PIPE, shell=True)
-                        dll ='\n'
-                        (out, err) = proc.communicate(input=dll)
-                        if err is not None:
-                            print >> sys.stderr, "An error has occured while starting the download:"
-                            print >> sys.stderr, err
-                            sys.exit(1)
-                        else:
-                            print('Your file is under download and after download finishes you can find it here:')
-                            print(filepath_new + '\n')
-                            print('Writing cache file now...')
-                            with open(outfile, 'a') as file:
-                                file.write(filepath_new + '\n')
-                                file.close()
-                            print('--------------------------------------------')
-                            # yes download #
-    else:
+                        print('--------------------------------------------')
+                        # yes download #
+    if nrec == 0:
         print >> sys.stderr, "Could not find data with the specified parameters :("
         print('----------------------------------------------------------------')
     # ---- fixing the cache file for duplicates
+    import numpy as np
+    from numpy import loadtxt as lt
+    from numpy import savetxt as st
     ar = lt(outfile, dtype=str)
     nar = np.unique(ar)
     st(outfile,nar,fmt='%s')
@@ -423,39 +358,25 @@ if params_file:
     # if you need to read xml param files, standardize them, then add
     # the standardized handling here, using the below syntax as model
     ################################################################ 
-    if paramfile_extension=='.xml':
-        # ---- code for XML inout files
-        # ---- this works with SOME ESMVal namelists
-        # ---- ESMVal migrates from XML files anyway so this is legacy code
-        # ---- Parse the namelist xml parameters file for MODEL data ---- #
-        # ---- with the specified variable(s) ---- #
-        xmldoc = minidom.parse(params_file)
-        diaglist = xmldoc.getElementsByTagName('diag')
+    if paramfile_extension in ('.xml', '.yml', '.yaml'):
+        # ---- Parse the namelist xml or recipe yml parameters file for MODEL data ---- #
+        # ---- the unique (model, variable, years) set across all diagnostics ---- #
+        itemlist = list(read_namelist(params_file))
         print('\n---------------------------------------------')
-        print('We parsed an XML file with diagnostics tests')
+        print('We parsed a namelist with diagnostics tests')
+        print('We need %i unique MODEL data files across all diagnostics:' % len(itemlist))
         print('---------------------------------------------')
-        for diag in diaglist:
-            itemlist = diag.getElementsByTagName('model')
-            varlist = diag.getElementsByTagName('variable')
-            v01 = varlist[0].firstChild.nodeValue
-            # ---- we need the variable to be as compact as possible
-            v1=v01.split()[0]
-            lenitemlist = len(itemlist)
-            print('We need %i MODEL data files for this diagnostic, using %s as variable:' % (lenitemlist,v1))
-            print('----------------------------------------------------------------------')
-            # FIXME bolted-on parallelization is easy to implement at this stage
-            for i in range(0,lenitemlist):
-                item = itemlist[i].firstChild.nodeValue
-                model_data = item.split()[0] + ' '+ item.split()[1] + ' ' + item.split()[2]\
-                     + ' ' + item.split()[3] + ' ' + item.split()[4]
-                print(model_data + '\n')
-                yr1 = int(item.split()[5])
-                yr2 = int(item.split()[6])
-                outpt = synda_search(model_data,v1,data_server)
-                if dryrunOn:
-                    synda_dll(outpt,v1,yr1,yr2,pfile2,dryrunOn)
-                else:
-                    synda_dll(outpt,v1,yr1,yr2,pfile2,dryrunOn=False)
+        for item in itemlist:
+            v1 = item[7]
+            model_data = " ".join(item[0:5])
+            print(model_data + '\n')
+            yr1 = item[5]
+            yr2 = item[6]
+            outpt = synda_search(model_data,v1,data_server)
+            if dryrunOn:
+                synda_dll(outpt,v1,yr1,yr2,pfile2,dryrunOn)
+            else:
+                synda_dll(outpt,v1,yr1,yr2,pfile2,dryrunOn=False)
     
         # ---- finding the download progress
         if not dryrunOn:
@@ -480,6 +401,7 @@ if params_file:
 
         """
         ###############################################################
+        from numpy import loadtxt as lt
         itemlist = lt(params_file,dtype=str)
         lenitemlist = len(itemlist)
         print('\n---------------------------------------------------------')
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""
+Time coverage of netCDF files for cmip5datafinder.py --introspect, from
+the time coordinate instead of the file name: nc_time() reads the first
+and last time values of a file (classic files straight from the header,
+netCDF4/HDF5 files with the netCDF4 or h5py module) and time_to_yyyymm()
+turns a CF time value into a year and month in any CF calendar:
+
+  first, last, units, calendar = nc_time('tas_Amon_MPI-ESM-LR_historical_r1i1p1_185001-200512.nc')
+  time_to_yyyymm(first, units, calendar)
+"""
+# -------------------------------------------------------------------------
+#      Setup.
+# -------------------------------------------------------------------------
+
+# ---- Import standard modules to the python path.
+import os
+from datetime import datetime
+
+__author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
+
+# netCDF classic types: struct code and size
+NC_TYPES = {1: ('b', 1), 2: ('c', 1), 3: ('h', 2), 4: ('i', 4), 5: ('f', 4), 6: ('d', 8),
+            7: ('B', 1), 8: ('H', 2), 9: ('I', 4), 10: ('q', 8), 11: ('Q', 8)}
+# cumulative days before each month
+CUM_365 = [0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334, 365]
+CUM_366 = [0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335, 366]
+
+def nc_classic_time(path):
+    """
+    Reads the time coordinate of a netCDF classic file (CDF-1, CDF-2 and
+    CDF-5, which is what most CMIP5 files are): only the header and the
+    first and last time values are read. Returns
+    (first value, last value, units, calendar) or None if the file has
+    no time variable; raises ValueError if it is not a classic file.
+    """
+    import struct
+    with open(path, 'rb') as file:
+        magic = file.read(4)
+        if len(magic) != 4 or magic[:3] != 'CDF' or magic[3] not in '\x01\x02\x05':
+            raise ValueError('not a netCDF classic file')
+        cdf5 = magic[3] == '\x05'
+        nsize = 8 if cdf5 else 4
+        offsize = 4 if magic[3] == '\x01' else 8
+
+        def take(size):
+            # size bytes of the header, a short read is a cut file
+            data = file.read(size)
+            if len(data) != size:
+                raise ValueError('truncated netCDF header')
+            return data
+
+        def read(fmt, size):
+            return struct.unpack('>' + fmt, take(size))[0]
+
+        def nonneg():
+            return read('Q' if cdf5 else 'I', nsize)
+
+        def nctype():
+            vtype = read('I', 4)
+            if vtype not in NC_TYPES:
+                raise ValueError('unknown netCDF type %i' % vtype)
+            return vtype
+
+        def name():
+            n = nonneg()
+            return take(n + (-n) % 4)[:n]
+
+        def attrs():
+            read('I', 4)
+            found = {}
+            for i in xrange(nonneg()):
+                aname = name()
+                code, size = NC_TYPES[nctype()]
+                n = nonneg()
+                data = take(n * size + (-n * size) % 4)[:n * size]
+                if code == 'c':
+                    found[aname] = data.rstrip('\x00').strip()
+                else:
+                    found[aname] = struct.unpack('>%i%s' % (n, code), data)
+            return found
+
+        numrecs = nonneg()
+        read('I', 4)
+        dims = []
+        for i in xrange(nonneg()):
+            dims.append((name(), nonneg()))
+        attrs()
+        read('I', 4)
+        variables = []
+        for i in xrange(nonneg()):
+            vname = name()
+            dimids = [read('Q' if cdf5 else 'I', nsize) for j in xrange(nonneg())]
+            vatts = attrs()
+            vtype = nctype()
+            vsize = nonneg()
+            begin = read('Q' if offsize == 8 else 'I', offsize)
+            variables.append((vname, dimids, vatts, vtype, vsize, begin))
+        recvars = [v for v in variables if v[1] and dims[v[1][0]][1] == 0]
+        recsize = sum([v[4] for v in recvars])
+        if len(recvars) == 1:
+            # a single record variable is not padded
+            recsize = NC_TYPES[recvars[0][3]][1]
+            for d in recvars[0][1][1:]:
+                recsize *= dims[d][1]
+        if numrecs == (1 << (8 * nsize)) - 1:
+            # streaming: number of records from the file size
+            first = min([v[5] for v in recvars]) if recvars else 0
+            numrecs = (os.path.getsize(path) - first) // max(recsize, 1)
+        for vname, dimids, vatts, vtype, vsize, begin in variables:
+            if vname != 'time' or len(dimids) != 1:
+                continue
+            code, size = NC_TYPES[vtype]
+            if dims[dimids[0]][1] == 0:
+                ntime, step = numrecs, recsize
+            else:
+                ntime, step = dims[dimids[0]][1], size
+            if ntime == 0:
+                return None
+            values = []
+            for i in (0, ntime - 1):
+                file.seek(begin + i * step)
+                values.append(read(code, size))
+            return (values[0], values[1], vatts.get('units', ''),
+                    vatts.get('calendar', 'standard').lower())
+    return None
+
+def nc_time(path):
+    """
+    (first value, last value, units, calendar) of the time coordinate of
+    any netCDF file: classic files are read directly, netCDF4 (HDF5)
+    files need the netCDF4 or h5py module; None if there is no time
+    """
+    with open(path, 'rb') as file:
+        magic = file.read(8)
+    if magic[:3] == 'CDF':
+        return nc_classic_time(path)
+    if magic != '\x89HDF\r\n\x1a\n':
+        raise ValueError('not a netCDF file')
+    try:
+        import netCDF4
+        with netCDF4.Dataset(path) as nc:
+            if 'time' not in nc.variables or len(nc.variables['time']) == 0:
+                return None
+            tv = nc.variables['time']
+            return (float(tv[0]), float(tv[-1]), getattr(tv, 'units', ''),
+                    getattr(tv, 'calendar', 'standard').lower())
+    except ImportError:
+        pass
+    try:
+        import h5py
+    except ImportError:
+        raise ValueError('netCDF4 file and no netCDF4 or h5py module')
+    with h5py.File(path, 'r') as nc:
+        if 'time' not in nc or nc['time'].shape[0] == 0:
+            return None
+        tv = nc['time']
+        units = tv.attrs.get('units', '')
+        calendar = tv.attrs.get('calendar', 'standard')
+        return (float(tv[0]), float(tv[-1]), str(units), str(calendar).lower())
+
+def julian_day(year,month,day):
+    """
+    day number of a date in the Julian calendar (the Julian Day Number)
+    """
+    a = (14 - month) // 12
+    y = year + 4800 - a
+    m = month + 12 * a - 3
+    return day + (153 * m + 2) // 5 + 365 * y + y // 4 - 32083
+
+def julian_date(jdn):
+    """
+    (year, month, day) in the Julian calendar of a Julian Day Number
+    """
+    c = jdn + 32082
+    d = (4 * c + 3) // 1461
+    e = c - 1461 * d // 4
+    m = (5 * e + 2) // 153
+    return (d - 4800 + m // 10, m + 3 - 12 * (m // 10), e - (153 * m + 2) // 5 + 1)
+
+def time_to_yyyymm(value,units,calendar):
+    """
+    year*100 + month of a CF time value e.g.
+    (45.5, 'days since 1850-01-01', 'noleap') -> 185002
+    for the standard, gregorian, proleptic_gregorian, julian,
+    noleap/365_day, all_leap/366_day and 360_day calendars
+    """
+    import math
+    from datetime import timedelta
+    step, since = units.split(' since ')
+    per_day = {'days': 1., 'day': 1., 'hours': 24., 'hour': 24., 'minutes': 1440.,
+               'minute': 1440., 'seconds': 86400., 'second': 86400.}[step.strip().lower()]
+    ref = since.strip().split()[0].split('T')[0].split('-')
+    ry, rm, rd = int(ref[0]), int(ref[1]), int(ref[2])
+    days = int(math.floor(value / per_day))
+    if calendar == '360_day':
+        total = days + (rm - 1) * 30 + rd - 1
+        return (ry + total // 360) * 100 + (total % 360) // 30 + 1
+    if calendar in ('noleap', '365_day', 'all_leap', '366_day'):
+        cum = CUM_365 if calendar in ('noleap', '365_day') else CUM_366
+        total = days + cum[rm - 1] + rd - 1
+        doy = total % cum[12]
+        month = [m for m in range(12) if cum[m] <= doy][-1] + 1
+        return (ry + total // cum[12]) * 100 + month
+    if calendar == 'julian':
+        year, month = julian_date(julian_day(ry, rm, rd) + days)[:2]
+        return year * 100 + month
+    date = datetime(ry, rm, rd) + timedelta(days=days)
+    return date.year * 100 + date.month
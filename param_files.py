@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Param file readers shared by cmip5datafinder.py and get_data_synda.py:
+read_params() streams a .txt param file and read_namelist() an
+ESMValTool namelist (.xml) or recipe (.yml), both as the unique
+FileDescriptor's (one row each) in file order:
+
+  for fd in read_namelist('namelist_perfmetrics_CMIP5.xml'):
+      fd.model_data(), fd.variable, fd.year1, fd.year2, fd.header()
+"""
+# -------------------------------------------------------------------------
+#      Setup.
+# -------------------------------------------------------------------------
+
+# ---- Import standard modules to the python path.
+# ---- the xml and yaml parsers are imported where they are used
+import sys, os
+from collections import namedtuple
+
+__author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
+
+# ---- filedescriptor
+class FileDescriptor(namedtuple('FileDescriptor',
+                     'project model table experiment ensemble year1 year2 variable')):
+    """
+    One param file row e.g.
+    CMIP5 MPI-ESM-LR Amon historical r1i1p1 1900 1982 tro3
+    with integer years; indexes as the old item[0]...item[7] rows.
+    """
+    __slots__ = ()
+
+    def header(self):
+        # e.g. CMIP5_MPI-ESM-LR_Amon_historical_r1i1p1_1900_1982_tro3
+        return "_".join([str(c) for c in self])
+
+    def model_data(self):
+        # e.g. CMIP5 MPI-ESM-LR Amon historical r1i1p1 (for synda search)
+        return " ".join(self[0:5])
+
+# ---- streaming param file reader
+def read_params(params_file):
+    """
+    Generator that reads a .txt param file line by line and yields
+    FileDescriptor's; each row must have exactly 8 columns:
+    cmip  experiment type1 type2    ensemble yr1  yr2  variable
+    CMIP5 MPI-ESM-LR Amon historical r1i1p1  1900  1982   tro3
+    Whitespace is normalised, empty lines and # comments are skipped,
+    malformed rows are reported to stderr and skipped, duplicate rows
+    are dropped keeping the first one (file order is preserved).
+    Memory goes only with the number of unique rows; nothing is written to disk.
+    """
+    seen = set()
+    with open(params_file, 'r') as file:
+        for lineno, line in enumerate(file, 1):
+            if '#' in line:
+                line = line.split('#', 1)[0]
+            row = tuple(line.split())
+            if not row or row in seen:
+                continue
+            if len(row) != 8:
+                print >> sys.stderr, "WARNING: %s line %i: need 8 columns, got %i; skipping it" % (params_file, lineno, len(row))
+                continue
+            try:
+                yr1 = int(row[5])
+                yr2 = int(row[6])
+            except ValueError:
+                print >> sys.stderr, "WARNING: %s line %i: bad years %s %s; skipping it" % (params_file, lineno, row[5], row[6])
+                continue
+            if yr1 > yr2:
+                print >> sys.stderr, "WARNING: %s line %i: year1 %i after year2 %i; skipping it" % (params_file, lineno, yr1, yr2)
+                continue
+            seen.add(row)
+            # tuple.__new__ skips the slow namedtuple constructor
+            yield tuple.__new__(FileDescriptor, row[:5] + (yr1, yr2, row[7]))
+
+# ---- streaming namelist/recipe reader
+def read_namelist(params_file):
+    """
+    Generator that reads an ESMValTool namelist (.xml) or recipe (.yml)
+    and yields the unique FileDescriptor's needed by all its diagnostics;
+    a model needed by ten diagnostics for the same variable and years
+    is yielded (and so searched for) only once.
+    XML namelists are parsed with iterparse, one <diag> at a time, e.g.
+    <model> CMIP5_ETHZ MPI-ESM-LR Amon historical r1i1p1 1980 2005 @{MODELPATH}/ </model>
+    <variable> ta </variable>
+    models in <MODELS> are used by every diagnostic.
+    YAML recipes need PyYAML; datasets from the top-level datasets list and
+    from additional_datasets are combined with every variable of a diagnostic.
+    Only CMIP5 entries are kept (CMIP5_ETHZ etc are read as CMIP5).
+    """
+    seen = set()
+
+    def make_fd(project, model, table, exp, ens, yr1, yr2, var):
+        if project.split('_')[0] != 'CMIP5':
+            return None
+        try:
+            fd = FileDescriptor('CMIP5', model, table, exp, ens, int(yr1), int(yr2), var)
+        except ValueError:
+            print >> sys.stderr, "WARNING: %s: bad years for %s %s %s; skipping it" % (params_file, model, var, (yr1, yr2))
+            return None
+        if fd in seen:
+            return None
+        seen.add(fd)
+        return fd
+
+    paramfile, paramfile_extension = os.path.splitext(params_file)
+    if paramfile_extension == '.xml':
+        try:
+            import xml.etree.cElementTree as ET
+        except ImportError:
+            import xml.etree.ElementTree as ET
+        gmodels = []
+        models = []
+        variables = []
+        indiag = False
+        for event, elem in ET.iterparse(params_file, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == 'diag':
+                    indiag = True
+                continue
+            if elem.tag == 'model' and elem.text and len(elem.text.split()) >= 7:
+                if indiag:
+                    models.append(elem.text.split()[0:7])
+                else:
+                    gmodels.append(elem.text.split()[0:7])
+            elif elem.tag == 'variable' and indiag and elem.text and elem.text.strip():
+                variables.append(elem.text.split()[0])
+            elif elem.tag == 'diag':
+                for v in variables:
+                    for m in models + gmodels:
+                        fd = make_fd(m[0], m[1], m[2], m[3], m[4], m[5], m[6], v)
+                        if fd is not None:
+                            yield fd
+                models = []
+                variables = []
+                indiag = False
+                elem.clear()
+    elif paramfile_extension in ('.yml', '.yaml'):
+        import yaml
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        with open(params_file, 'r') as file:
+            recipe = yaml.load(file, Loader=loader)
+        gdatasets = recipe.get('datasets') or []
+        for dname, diag in (recipe.get('diagnostics') or {}).items():
+            diag = diag or {}
+            ddatasets = gdatasets + (diag.get('additional_datasets') or [])
+            for vname, vsets in (diag.get('variables') or {}).items():
+                vsets = vsets or {}
+                for ds in ddatasets + (vsets.get('additional_datasets') or []):
+                    item = dict(vsets)
+                    item.update(ds)
+                    if not [k for k in ('project', 'dataset', 'mip', 'exp', 'ensemble', 'start_year', 'end_year') if k not in item]:
+                        fd = make_fd(str(item['project']), str(item['dataset']), str(item['mip']), str(item['exp']),
+                                     str(item['ensemble']), item['start_year'], item['end_year'],
+                                     str(item.get('short_name', vname)))
+                        if fd is not None:
+                            yield fd
+    else:
+        print >> sys.stderr, "WARNING: %s is not a .xml namelist or .yml recipe" % params_file
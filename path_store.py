@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Compact in-memory store for the paths of data files, as found by
+cmip5datafinder.py (find_local_files()) or read by cache_BADC.py from
+the all_badc_netcdf_* database files. CMIP5 paths repeat the same long
+directory prefix for thousands of files e.g.
+/badc/cmip5/data/cmip5/output1/MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/latest/tro3/
+so directories are kept once, as a trie of interned components, and a
+file is a leaf of four integers in arrays: its directory, its file name
+stem (tro3_Amon_MPI-ESM-LR_historical_r1i1p1_, kept once too) and the
+two dates of its _YYYYMM-YYYYMM.nc suffix. Names that do not end in
+dates are kept whole as stems. Full paths are rebuilt only when asked
+for (iteration, indexing) and prefix queries walk the trie.
+A PathStore is used as the list of strings it replaces, or through
+the integer index add() returns, which is all a caller has to keep:
+
+  paths = PathStore(find_output)
+  len(paths), paths[0], [p for p in paths]
+  paths.prefix('/badc/cmip5/data/cmip5/output1/MPI-M/MPI-ESM-LR/')
+  i = paths.add(path); paths.name(i), paths.component(paths.dir_of(i))
+  paths.with_stem('tro3_Amon_MPI-ESM-LR_historical_r1i1p1_')
+
+See bench_pathstore.py for its memory use against a list of strings.
+"""
+# -------------------------------------------------------------------------
+#      Setup.
+# -------------------------------------------------------------------------
+
+# ---- Import standard modules to the python path.
+from array import array
+
+__author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
+
+# ---- dates that fit the int leaf arrays
+MAX_DATE = 2**31 - 1
+
+def split_name(name):
+    """
+    (stem, date width, extension, date1, date2) of a file name e.g.
+    tro3_Amon_MPI-ESM-LR_historical_r1i1p1_185001-194912.nc gives
+    ('tro3_Amon_MPI-ESM-LR_historical_r1i1p1_', 6, '.nc', 185001, 194912);
+    (name, 0, '', -1, -1) if it does not end in two dates of the same width
+    """
+    i = name.rfind('_') + 1
+    j = name.find('.', i)
+    if j < 0:
+        j = len(name)
+    dates = name[i:j].split('-')
+    if i == 0 or len(dates) != 2 or len(dates[0]) != len(dates[1]) \
+            or not dates[0].isdigit() or not dates[1].isdigit():
+        return name, 0, '', -1, -1
+    t1, t2 = int(dates[0]), int(dates[1])
+    if t1 > MAX_DATE or t2 > MAX_DATE:
+        return name, 0, '', -1, -1
+    return name[:i], len(dates[0]), name[j:], t1, t2
+
+class PathStore(object):
+    """
+    Paths as a trie of directories with array-backed file leaves, in
+    the order they were added (duplicates are kept, as in a list)
+    """
+    __slots__ = ('_dnames', '_dparents', '_dchildren', '_stems', '_stem_ids',
+                 '_ldir', '_lstem', '_lt1', '_lt2', '_last', '_dpaths')
+
+    def __init__(self, paths=None):
+        # directory 0 is the root, the parent of the first component
+        self._dnames = [None]
+        self._dparents = array('i', [-1])
+        self._dchildren = {}
+        # stems are (prefix, date width, extension)
+        self._stems = []
+        self._stem_ids = {}
+        self._ldir = array('i')
+        self._lstem = array('i')
+        self._lt1 = array('i')
+        self._lt2 = array('i')
+        # last directory added and the rebuilt directory paths
+        self._last = (None, 0)
+        self._dpaths = {}
+        if paths is not None:
+            self.extend(paths)
+
+    def _dir(self, dirpath):
+        # directory id of dirpath, added if new
+        if dirpath == self._last[0]:
+            return self._last[1]
+        node = 0
+        for comp in dirpath.split('/'):
+            key = (node, comp)
+            child = self._dchildren.get(key)
+            if child is None:
+                child = len(self._dnames)
+                comp = intern(comp)
+                self._dnames.append(comp)
+                self._dparents.append(node)
+                self._dchildren[(node, comp)] = child
+            node = child
+        self._last = (dirpath, node)
+        return node
+
+    def _dirpath(self, node):
+        # path of directory node, rebuilt once
+        if node == 0:
+            return None
+        if node not in self._dpaths:
+            parent = self._dparents[node]
+            if parent == 0:
+                self._dpaths[node] = self._dnames[node]
+            else:
+                self._dpaths[node] = self._dirpath(parent) + '/' + self._dnames[node]
+        return self._dpaths[node]
+
+    def _name(self, i):
+        # file name of leaf i
+        prefix, width, ext = self._stems[self._lstem[i]]
+        if width == 0:
+            return prefix
+        return '%s%0*i-%0*i%s' % (prefix, width, self._lt1[i], width, self._lt2[i], ext)
+
+    def add(self, path):
+        """
+        adds path and returns its index
+        """
+        if '/' in path:
+            dirpath, name = path.rsplit('/', 1)
+            node = self._dir(dirpath)
+        else:
+            node, name = 0, path
+        prefix, width, ext, t1, t2 = split_name(name)
+        stem = (prefix, width, ext)
+        sid = self._stem_ids.get(stem)
+        if sid is None:
+            sid = len(self._stems)
+            self._stems.append((intern(prefix), width, intern(ext)))
+            self._stem_ids[stem] = sid
+        self._ldir.append(node)
+        self._lstem.append(sid)
+        self._lt1.append(t1)
+        self._lt2.append(t2)
+        return len(self._ldir) - 1
+
+    def extend(self, paths):
+        for path in paths:
+            self.add(path)
+
+    def __len__(self):
+        return len(self._ldir)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self._ldir)
+        if i < 0 or i >= len(self._ldir):
+            raise IndexError('PathStore index out of range')
+        dirpath = self._dirpath(self._ldir[i])
+        if dirpath is None:
+            return self._name(i)
+        return dirpath + '/' + self._name(i)
+
+    def __iter__(self):
+        return self.slice(0, len(self._ldir))
+
+    def slice(self, start, end):
+        """
+        generator over the paths start..end-1
+        """
+        ldir, lstem, lt1, lt2, stems = self._ldir, self._lstem, self._lt1, self._lt2, self._stems
+        last = (None, None)
+        for i in xrange(max(start, 0), min(end, len(ldir))):
+            # files of one directory are mostly added together
+            if ldir[i] != last[0]:
+                dirpath = self._dirpath(ldir[i])
+                last = (ldir[i], '' if dirpath is None else dirpath + '/')
+            prefix, width, ext = stems[lstem[i]]
+            if width == 0:
+                yield last[1] + prefix
+            else:
+                yield '%s%s%0*i-%0*i%s' % (last[1], prefix, width, lt1[i], width, lt2[i], ext)
+
+    def prefix(self, prefix):
+        """
+        generator over the paths that start with prefix, in the order
+        they were added; prefix may end in the middle of a directory
+        or file name
+        """
+        if '/' in prefix:
+            dirpath, frag = prefix.rsplit('/', 1)
+            node = 0
+            for comp in dirpath.split('/'):
+                node = self._dchildren.get((node, comp))
+                if node is None:
+                    return
+        else:
+            node, frag = 0, prefix
+        # parents are added before their children: one pass finds the subtree
+        inside = set()
+        for d in xrange(1, len(self._dnames)):
+            parent = self._dparents[d]
+            if parent in inside or parent == node and self._dnames[d].startswith(frag):
+                inside.add(d)
+        for i in xrange(len(self._ldir)):
+            d = self._ldir[i]
+            if d in inside or d == node and self._name(i).startswith(frag):
+                yield self[i]
+
+    def name(self, i):
+        """
+        file name of path i
+        """
+        return self._name(i)
+
+    def dir_of(self, i):
+        """
+        directory id of path i, see parent() and component()
+        """
+        return self._ldir[i]
+
+    def parent(self, node):
+        # directory id of the parent of directory node
+        return self._dparents[node]
+
+    def component(self, node):
+        # last component of directory node e.g. latest, v20120315, tro3
+        return self._dnames[node]
+
+    def with_stem(self, prefix):
+        """
+        generator over the indexes of the paths whose file name is
+        prefix followed by dates e.g. tro3_Amon_MPI-ESM-LR_historical_r1i1p1_
+        for tro3_Amon_MPI-ESM-LR_historical_r1i1p1_185001-200512.nc;
+        no path is rebuilt
+        """
+        sids = set([sid for sid, stem in enumerate(self._stems) if stem[0] == prefix and stem[1] > 0])
+        if not sids:
+            return
+        lstem = self._lstem
+        for i in xrange(len(lstem)):
+            if lstem[i] in sids:
+                yield i
+
+    def ndirs(self):
+        # number of directories in the trie
+        return len(self._dnames) - 1
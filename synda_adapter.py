@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+"""
+In-process access to synda for cmip5datafinder.py, so that a run does
+not start a new synda (a python interpreter that loads its whole
+configuration) for every search, install and queue:
+  - SyndaAPI runs synda's own python entry point (the main() of the
+    synda script, or of a module given by name) inside this process:
+    synda is imported and configured once, every call after that is a
+    function call with its output captured;
+  - SyndaDB answers status questions (is this file done? what is in the
+    queue?) from synda's SQLite transfer database ($ST_HOME/db/sdt.db),
+    opened read-only;
+  - SyndaCLI is the old way, one synda process per call, used when
+    neither of the above is there or asked for (--synda-cli).
+open_synda() picks what is available; all calls go through a Synda:
+
+  synda = open_synda('/usr/local/synda/bin/synda')
+  out, returncode = synda.run('search -f CMIP5 MPI-ESM-LR Amon historical r1i1p1 tas')
+  synda.file_status('cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315.tas_Amon_MPI-ESM-LR_historical_r1i1p1_185001-200512.nc')
+
+which_synda() finds the synda executable on the PATH, once per run.
+See synda_standin.py for a stand-in synda and bench_synda.py for the
+per-call overhead of each way.
+"""
+# -------------------------------------------------------------------------
+#      Setup.
+# -------------------------------------------------------------------------
+
+# ---- Import standard modules to the python path.
+import sys, os, shlex, subprocess, threading
+
+__author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
+
+# ---- get the path to synda executable
+def _which_synda(synda):
+    """
+    path of the synda executable: synda as given if it is a path,
+    else the first one on the PATH; None if there is none
+    """
+    def is_exe(fpath):
+        return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
+
+    fpath, fname = os.path.split(synda)
+    if fpath:
+        if is_exe(synda):
+            return synda
+    else:
+        for path in os.environ["PATH"].split(os.pathsep):
+            path = path.strip('"')
+            exe_file = os.path.join(path, synda)
+            if is_exe(exe_file):
+                return exe_file
+    return None
+
+# ---- found synda executables, PATH is scanned once per run
+SYNDA_EXE = {}
+
+def which_synda(synda):
+    """
+    cached wrapper around _which_synda, shared by cmip5datafinder.py,
+    cache_BADC.py, get_data_synda.py and check_data_synda.py
+    """
+    if synda not in SYNDA_EXE:
+        SYNDA_EXE[synda] = _which_synda(synda)
+    return SYNDA_EXE[synda]
+
+class SyndaCLI(object):
+    """
+    one synda process per call
+    """
+    kind = 'cli'
+
+    def __init__(self, exe):
+        self.exe = exe
+
+    def close(self):
+        # nothing held between calls
+        pass
+
+    def run(self, args, stdin_data=None):
+        if stdin_data is not None:
+            proc = subprocess.Popen(self.exe + ' ' + args, stdout=subprocess.PIPE, stdin=subprocess.PIPE, shell=True)
+        else:
+            proc = subprocess.Popen(self.exe + ' ' + args, stdout=subprocess.PIPE, shell=True)
+        (out, err) = proc.communicate(input=stdin_data)
+        return out, proc.returncode
+
+    def lines(self, args, done=None):
+        """
+        generator over the stdout lines, read from the pipe as they
+        arrive; done(out, returncode) is called at the end
+        """
+        proc = subprocess.Popen(self.exe + ' ' + args, stdout=subprocess.PIPE, shell=True)
+        lines = []
+        try:
+            for line in iter(proc.stdout.readline, ''):
+                if done is not None:
+                    lines.append(line)
+                yield line
+        finally:
+            # consumers may stop early, don't leave synda hanging
+            proc.stdout.close()
+            proc.wait()
+            if done is not None:
+                done(''.join(lines), proc.returncode)
+
+def load_api(name):
+    """
+    synda's python entry point: name is a module name or the path of
+    the synda script; None if it can not be imported or has no main()
+    """
+    import imp, importlib
+    if os.path.isfile(name):
+        # only a python script that does not run itself on import
+        try:
+            with open(name, 'r') as file:
+                text = file.read(1 << 20)
+        except IOError:
+            return None
+        shebang = text.split('\n', 1)[0]
+        if not text.startswith('#!') or 'python' not in shebang \
+                or '__main__' not in text or 'def main' not in text:
+            return None
+        if ('python3' in shebang) != (sys.version_info[0] >= 3):
+            # written for another python, run it as a command
+            return None
+        bindir = os.path.dirname(os.path.abspath(name))
+        if bindir not in sys.path:
+            # synda's own modules live next to the script
+            sys.path.insert(1, bindir)
+        loader = lambda: imp.load_source('synda_entry_point', name)
+    else:
+        loader = lambda: importlib.import_module(name)
+    try:
+        module = loader()
+    except Exception as exc:
+        print >> sys.stderr, "WARNING: could not import synda from %s (%s), using the synda command" % (name, exc)
+        return None
+    if not callable(getattr(module, 'main', None)):
+        return None
+    return module
+
+class ThreadOutput(object):
+    """
+    sys.stdout while SyndaAPI is used: what the thread running synda
+    prints goes to its buffer, what the other threads print goes
+    to the real stdout as before
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+        # SyndaAPI's using it, the real stdout is back when none is left
+        self.users = 0
+
+    def target(self):
+        buf = getattr(self.local, 'buffer', None)
+        if buf is None:
+            return self.stream
+        return buf
+
+    def write(self, text):
+        self.target().write(text)
+
+    def writelines(self, lines):
+        self.target().writelines(lines)
+
+    def flush(self):
+        self.target().flush()
+
+    # print keeps its state in the file it prints to
+    def _get_softspace(self):
+        return getattr(self.target(), 'softspace', 0)
+
+    def _set_softspace(self, value):
+        self.target().softspace = value
+
+    softspace = property(_get_softspace, _set_softspace)
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+class SyndaAPI(object):
+    """
+    synda's main() called in this process with sys.argv and stdin
+    swapped and its stdout captured for the call (see ThreadOutput);
+    calls are serialized since argv and stdin are process wide.
+    close() when done with it, to put sys.stdout back
+    """
+    kind = 'api'
+
+    def __init__(self, module, exe='synda'):
+        self.module = module
+        self.exe = exe
+        self.lock = threading.Lock()
+        if not isinstance(sys.stdout, ThreadOutput):
+            sys.stdout = ThreadOutput(sys.stdout)
+        self.output = sys.stdout
+        self.output.users += 1
+        self.closed = False
+
+    def close(self):
+        """
+        gives sys.stdout back once no SyndaAPI uses it any more
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.output.users -= 1
+            if self.output.users == 0 and sys.stdout is self.output:
+                sys.stdout = self.output.stream
+
+    def run(self, args, stdin_data=None):
+        from StringIO import StringIO
+        with self.lock:
+            saved = (sys.argv, sys.stdin)
+            sys.argv = [self.exe] + shlex.split(args)
+            sys.stdin = StringIO(stdin_data or '')
+            self.output.local.buffer = out = StringIO()
+            try:
+                try:
+                    returncode = self.module.main()
+                except SystemExit as exc:
+                    returncode = exc.code
+                except Exception as exc:
+                    print >> sys.stderr, "synda %s failed: %s" % (args, exc)
+                    returncode = 1
+            finally:
+                sys.argv, sys.stdin = saved
+                self.output.local.buffer = None
+        if returncode is None:
+            returncode = 0
+        elif not isinstance(returncode, int):
+            # sys.exit('message')
+            print >> sys.stderr, returncode
+            returncode = 1
+        text = out.getvalue()
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return text, returncode
+
+    def lines(self, args, done=None):
+        out, returncode = self.run(args)
+        if done is not None:
+            done(out, returncode)
+        for line in out.splitlines(True):
+            yield line
+
+class SyndaDB(object):
+    """
+    read-only view of synda's SQLite database: the file table
+    (file_functional_id, status, size, checksum, checksum_type) of all
+    the files synda knows
+    """
+    def __init__(self, path, timeout=5.):
+        import sqlite3
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        # no writes from here, synda owns the database
+        self.conn.execute('PRAGMA query_only = 1')
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(file)')]
+        if 'file_functional_id' not in columns or 'status' not in columns:
+            self.conn.close()
+            raise ValueError('%s has no synda file table' % path)
+        self.has_size = 'size' in columns
+        self.has_checksum = 'checksum' in columns and 'checksum_type' in columns
+        self.lock = threading.Lock()
+
+    def status(self, file_id):
+        """
+        synda status of one file id (done, waiting, running, error...)
+        or None if synda does not know it
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT status FROM file WHERE file_functional_id = ?',
+                                    (file_id,)).fetchone()
+        return str(row[0]) if row else None
+
+    def statuses(self, file_ids):
+        """
+        {file id: status} of the file ids synda knows
+        """
+        found = {}
+        for fid, status in self._select('status', file_ids):
+            found[str(fid)] = str(status)
+        return found
+
+    def checksums(self, file_ids):
+        """
+        {file id: (size, checksum, checksum type)} of the file ids synda
+        has a checksum for; empty if the table has no checksum columns
+        """
+        found = {}
+        if not self.has_checksum:
+            return found
+        size = 'size' if self.has_size else '0'
+        for fid, size, checksum, checksum_type in self._select('%s, checksum, checksum_type' % size, file_ids):
+            if checksum:
+                found[str(fid)] = (size or 0, str(checksum), str(checksum_type or 'sha256'))
+        return found
+
+    def _select(self, columns, file_ids):
+        # rows (file id, columns...) of the file ids
+        file_ids = list(file_ids)
+        rows = []
+        with self.lock:
+            # stay below the SQLite limit of host parameters
+            for i in range(0, len(file_ids), 500):
+                chunk = file_ids[i:i + 500]
+                query = 'SELECT file_functional_id, %s FROM file WHERE file_functional_id IN (%s)' % (columns, ','.join('?' * len(chunk)))
+                rows.extend(self.conn.execute(query, chunk).fetchall())
+        return rows
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def queue(self):
+        """
+        [(status, number of files, MB)] as synda queue prints them
+        """
+        size = 'SUM(size)' if self.has_size else '0'
+        with self.lock:
+            rows = self.conn.execute('SELECT status, COUNT(*), %s FROM file GROUP BY status ORDER BY status' % size).fetchall()
+        return [(str(status), n, (total or 0) / 1e6) for status, n, total in rows]
+
+class Synda(object):
+    """
+    synda calls (run, lines) through the API or the command line,
+    status questions through the database when there is one
+    """
+    def __init__(self, caller, db=None):
+        self.caller = caller
+        self.db = db
+        self.calls = 0
+
+    def describe(self):
+        found = 'synda %s' % ('python API (in process)' if self.caller.kind == 'api' else 'command')
+        if self.db is not None:
+            found += ', status from %s' % self.db.path
+        return found
+
+    def run(self, args, stdin_data=None):
+        self.calls += 1
+        return self.caller.run(args, stdin_data)
+
+    def lines(self, args, done=None):
+        self.calls += 1
+        return self.caller.lines(args, done)
+
+    def close(self):
+        """
+        closes the API (sys.stdout back) and the database
+        """
+        self.caller.close()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def file_status(self, file_id):
+        # None if there is no database or the file is not in it
+        if self.db is None:
+            return None
+        return self.db.status(file_id)
+
+    def checksums(self, file_ids):
+        # {} if there is no database
+        if self.db is None:
+            return {}
+        return self.db.checksums(file_ids)
+
+    def queue(self):
+        """
+        synda queue output, from the database if there is one
+        """
+        if self.db is None:
+            return self.run('queue')
+        lines = ['%-10s %6i %12.1f' % row for row in self.db.queue()]
+        return '\n'.join(lines) + '\n', 0
+
+def synda_home(exe):
+    # $ST_HOME, else the install dir of the executable (ST_HOME/bin/synda)
+    if os.environ.get('ST_HOME'):
+        return os.environ['ST_HOME']
+    return os.path.dirname(os.path.dirname(os.path.realpath(exe)))
+
+def open_synda(exe, api=None, db=None, cli=False, verbose=False):
+    """
+    Synda for the executable exe: in process through api (module name
+    or script path; default the synda script itself) unless cli is
+    True, statuses from the database db (default $ST_HOME/db/sdt.db
+    if it is there, none with cli unless given); the command line for
+    anything missing
+    """
+    caller = None
+    if cli is not True:
+        module = load_api(api or exe)
+        if module is not None:
+            caller = SyndaAPI(module, exe)
+    if caller is None:
+        if api and cli is not True:
+            print >> sys.stderr, "WARNING: no synda main() in %s, using the synda command" % api
+        caller = SyndaCLI(exe)
+    store = None
+    if db is None and cli is True:
+        # the command for everything, as before
+        return Synda(caller)
+    if db is None:
+        db = os.path.join(synda_home(exe), 'db', 'sdt.db')
+        explicit = False
+    else:
+        explicit = True
+    if os.path.isfile(db):
+        try:
+            store = SyndaDB(db)
+        except Exception as exc:
+            if explicit or verbose:
+                print >> sys.stderr, "WARNING: can not read synda database %s (%s)" % (db, exc)
+    elif explicit:
+        print >> sys.stderr, "WARNING: synda database %s not found" % db
+    return Synda(caller, store)
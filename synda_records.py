@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""
+synda search -f output as records, shared by cmip5datafinder.py,
+cache_BADC.py and get_data_synda.py: parse_synda_search() turns the
+lines of a search into SyndaRecord's (the file id split into its DRS
+facets, the size in bytes and the years of the file), latest_versions()
+keeps the newest version of each file and time_handling() compares the
+years of a file with the years a filedescriptor needs:
+
+  for rec in latest_versions(parse_synda_search(synda_output_lines)):
+      rec.file_name, rec.size, rec.year1, rec.year2, rec.local_path()
+"""
+# -------------------------------------------------------------------------
+#      Setup.
+# -------------------------------------------------------------------------
+
+# ---- Import standard modules to the python path.
+from datetime import datetime
+
+__author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
+
+# ---- handling the years for files
+def time_handling(year1, year1_model, year2, year2_model):
+    """
+    This function is responsible for finding the correct 
+    files for the needed timespan:
+
+    year1 - the start year in files
+    year1_model - the needed start year of data
+    year2 - the last year in files
+    year2_model - the needed last year of data
+    WARNINGS:
+    we reduce our analysis only to years
+
+    """
+    # model interval < data interval / file
+    # model requirements completely within data stretch
+    if year1 <= int(year1_model) and year2 >= int(year2_model):
+        return True,True
+    # model interval > data interval / file
+    # data stretch completely within model requirements
+    elif year1 >= int(year1_model) and year2 <= int(year2_model):
+        return True,False
+    # left/right overlaps and complete misses
+    elif year1 <= int(year1_model) and year2 <= int(year2_model):
+        # data is entirely before model
+        if year2 <= int(year1_model):
+            return False,False
+        # data overlaps to the left
+        elif year2 >= int(year1_model):
+            return True,False
+    elif year1 >= int(year1_model) and year2 >= int(year2_model):
+        # data is entirely after model
+        if year1 >= int(year2_model):
+            return False,False
+        # data overlaps to the right
+        elif year1 <= int(year2_model):
+            return True,False
+
+# ---- function to handle various date formats
+def date_handling(time1,time2):
+    """
+    This function deals with different input date formats e.g.
+    time1 = 198204 or
+    time1 = 19820422 or
+    time1 = 198204220511 etc
+    More formats can be coded in at this stage.
+    Returns year 1 and year 2
+    """
+    # yyyymm
+    if len(list(time1)) == 6 and len(list(time2)) == 6:
+        y1 = datetime.strptime(time1, '%Y%m')
+        year1 = y1.year
+        y2 = datetime.strptime(time2, '%Y%m')
+        year2 = y2.year
+    else:
+        # yyyymmdd
+        if len(list(time1)) == 8 and len(list(time2)) == 8:
+            y1 = datetime.strptime(time1, '%Y%m%d')
+            year1 = y1.year
+            y2 = datetime.strptime(time2, '%Y%m%d')
+            year2 = y2.year
+        # yyyymmddHHMM
+        if len(list(time1)) == 12 and len(list(time2)) == 12:
+            y1 = datetime.strptime(time1, '%Y%m%d%H%M')
+            year1 = y1.year
+            y2 = datetime.strptime(time2, '%Y%m%d%H%M')
+            year2 = y2.year
+    return year1,year2
+
+# ---- sizes as printed by synda search e.g. 221.2 MB
+SIZE_UNITS = {'bytes': 1, 'B': 1, 'kB': 10**3, 'KB': 10**3, 'MB': 10**6,
+              'GB': 10**9, 'TB': 10**12}
+
+def size_to_bytes(value, unit):
+    """
+    converts a synda size e.g. ('221.2', 'MB') to bytes
+    """
+    return int(round(float(value) * SIZE_UNITS.get(unit, 1)))
+
+# ---- one line of synda search output
+class SyndaRecord(object):
+    """
+    One parsed line of synda search -f output e.g.
+    new   221.2 MB  cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-195912.nc
+    status: new or done; size: bytes; file_name: the synda file id (4th column);
+    the dataset facets project...ensemble, version (v20120315), variable,
+    basename (tro3_Amon_..._195001-195912.nc) and year1, year2 of the time range
+    (None if the file has no time range e.g. fx files);
+    url, checksum and checksum_type are only known from the ESGF search API
+    (see esgf_client.ESGFSearch), None for synda records
+    """
+    __slots__ = ('status', 'size', 'file_name', 'project', 'product', 'institute',
+                 'model', 'experiment', 'frequency', 'realm', 'table', 'ensemble',
+                 'version', 'variable', 'basename', 'year1', 'year2',
+                 'url', 'checksum', 'checksum_type')
+
+    def local_path(self, root='/sdt/data/'):
+        # DRS path of the file under root, variable dir after the version
+        return root + "/".join([self.project, self.product, self.institute, self.model,
+                                self.experiment, self.frequency, self.realm, self.table,
+                                self.ensemble, self.version, self.variable, self.basename])
+
+    def dataset_id(self):
+        # e.g. cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315
+        return self.file_name[:-len(self.basename) - 1]
+
+# ---- build one record
+def synda_record(status,size,file_name):
+    """
+    Returns the SyndaRecord of a synda file id e.g.
+    cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315.tro3_Amon_..._195001-195912.nc
+    with its status and size in bytes, or None if file_name is not a file id
+    """
+    facets = file_name.split('.', 10)
+    if len(facets) < 11:
+        return None
+    rec = SyndaRecord()
+    rec.status = status
+    rec.size = size
+    rec.file_name = file_name
+    (rec.project, rec.product, rec.institute, rec.model, rec.experiment,
+     rec.frequency, rec.realm, rec.table, rec.ensemble, rec.version,
+     rec.basename) = facets
+    rec.variable = rec.basename.split('_')[0]
+    time_range = rec.basename.rsplit('.', 1)[0].split('_')[-1].split('-')
+    rec.year1 = rec.year2 = None
+    if len(time_range) == 2:
+        try:
+            rec.year1, rec.year2 = date_handling(time_range[0],time_range[1])
+        except (ValueError, UnboundLocalError):
+            pass
+    rec.url = rec.checksum = rec.checksum_type = None
+    return rec
+
+# ---- synda search output parser
+def parse_synda_search(lines):
+    """
+    Generator that turns synda search -f output lines into SyndaRecord's;
+    each line is split once, lines that are not file lines are skipped.
+    lines: any line iterator e.g. the synda stdout pipe or an open file
+    """
+    for line in lines:
+        cols = line.split()
+        if len(cols) < 4:
+            continue
+        rec = synda_record(cols[0], size_to_bytes(cols[1], cols[2]), cols[3])
+        if rec is not None:
+            yield rec
+
+# ---- newest version of each file in a search
+def latest_versions(records):
+    """
+    Groups SyndaRecord's per file (dataset id without its version plus
+    file basename) and keeps the record with the highest vYYYYMMDD version;
+    the records are returned in search order. This replaces one
+    synda search -f -l 1 call per file.
+    """
+    def version_key(version):
+        digits = version.lstrip('v')
+        if digits.isdigit():
+            return int(digits)
+        return -1
+
+    latest = {}
+    order = []
+    for rec in records:
+        key = (rec.dataset_id().rsplit('.', 1)[0], rec.basename)
+        if key not in latest:
+            order.append(key)
+            latest[key] = rec
+        elif version_key(rec.version) > version_key(latest[key].version):
+            latest[key] = rec
+    return [latest[key] for key in order]
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Stand-in synda, to test and benchmark the synda paths of
+cmip5datafinder.py (and synda_adapter.py) without a synda install.
+--setup DIR lays out a synda home like a real one:
+  DIR/bin/synda       python script with a main(), so it is both a synda
+                      command and an entry point synda_adapter can import
+  DIR/conf/sdt.conf   with an indexes= line
+  DIR/db/sdt.db       SQLite database with synda's file table
+Searches (synda search -f ...) are answered from an index of synda
+search -f lines (--index FILE) and/or the synda calls recorded with
+cmip5datafinder.py --record DIR (--responses DIR); a file is done if the
+database says so. install adds files to the database as waiting, queue
+and watch report from it. --startup SEC makes every start of this synda
+wait SEC seconds, to model a real synda loading its configuration, and
+--latency SEC every search, to model the round trip to the index.
+Every call is appended to DIR/log/calls.log.
+
+Example run:
+python synda_standin.py --setup /tmp/sdt --responses synda_tape --startup 0.3
+PATH=/tmp/sdt/bin:$PATH python cmip5datafinder.py -p example.txt --synda --datasource badc
+"""
+# -------------------------------------------------------------------------
+#      Setup.
+# -------------------------------------------------------------------------
+
+# ---- Import standard modules to the python path.
+import sys, os, getopt, time, json, sqlite3
+
+__author__ = "Valeriu Predoi <valeriu.predoi@ncas.ac.uk>"
+
+# ---- the file table of synda's database, the columns we use
+SCHEMA = """CREATE TABLE IF NOT EXISTS file (
+    file_id INTEGER PRIMARY KEY,
+    file_functional_id TEXT UNIQUE,
+    status TEXT,
+    size INTEGER,
+    checksum TEXT,
+    checksum_type TEXT,
+    local_path TEXT)"""
+
+# ---- the synda script written by --setup
+SCRIPT = """#!%(python)s
+# stand-in synda, see synda_standin.py
+import sys
+sys.path.insert(0, %(repo)r)
+import synda_standin
+synda_standin.configure(%(home)r)
+
+def main():
+    return synda_standin.synda_main(sys.argv[1:])
+
+if __name__ == '__main__':
+    sys.exit(main())
+"""
+
+# ---- Function usage.
+def usage():
+  msg = """\
+Stand-in synda: sets up a synda home whose synda answers from recorded searches.
+
+Usage:
+  synda_standin.py --setup DIR [options]
+  -h, --help                  Display this message and exit
+  --setup <DIR>               Synda home to create (bin/synda, conf/sdt.conf, db/sdt.db) [REQUIRED]
+  --index <FILE>              synda search -f output lines to answer searches from
+  --responses <DIR>           synda calls recorded with cmip5datafinder.py --record DIR
+  --startup <SEC>             Time each start of the stand-in takes (default 0)
+  --latency <SEC>             Time each search takes (default 0)
+  --done <FILE>               File ids (one per line) to put in the database as done
+"""
+  print >> sys.stderr, msg
+
+def read_config(home):
+    # the settings --setup saved
+    with open(os.path.join(home, 'conf', 'standin.json'), 'r') as file:
+        return json.load(file)
+
+# ---- state of this synda, set by configure()
+HOME = {'dir': None, 'conf': None, 'lines': None, 'tape': None}
+
+def configure(home):
+    """
+    loads the settings of the synda home, as a real synda loads
+    its configuration on start
+    """
+    HOME['dir'] = home
+    HOME['conf'] = read_config(home)
+    if HOME['conf']['startup'] > 0:
+        time.sleep(HOME['conf']['startup'])
+    lines = []
+    if HOME['conf']['index']:
+        with open(HOME['conf']['index'], 'r') as file:
+            lines = [line.rstrip('\n') for line in file if len(line.split()) >= 4]
+    tape = {}
+    if HOME['conf']['responses']:
+        rdir = HOME['conf']['responses']
+        for name in sorted(os.listdir(rdir)):
+            if name.endswith('.json') and not name.startswith('.'):
+                with open(os.path.join(rdir, name), 'r') as file:
+                    entry = json.load(file)
+                tape.setdefault(entry['args'], entry)
+    HOME['lines'] = lines
+    HOME['tape'] = tape
+
+def connect():
+    return sqlite3.connect(os.path.join(HOME['dir'], 'db', 'sdt.db'), timeout=10)
+
+def matches(file_id, terms):
+    """
+    True if all search terms are facets of the file id, as synda
+    search matches them (CMIP5 is the project of every file)
+    """
+    parts = file_id.split('.', 10)
+    if len(parts) < 11:
+        return False
+    facets = set([p.lower() for p in parts[:10]])
+    facets.update([p.lower() for p in parts[10].split('_')])
+    return all([t.lower() in facets for t in terms])
+
+def search(terms):
+    """
+    synda search -f lines for the terms, status from the database
+    """
+    found = []
+    seen = set()
+    entry = HOME['tape'].get(' '.join(['search'] + terms))
+    candidates = []
+    if entry is not None:
+        candidates.extend(entry['stdout'].splitlines())
+    candidates.extend([line for line in HOME['lines'] if matches(line.split()[3], [t for t in terms if t != '-f'])])
+    for line in candidates:
+        cols = line.split()
+        if len(cols) >= 4 and cols[3] not in seen:
+            seen.add(cols[3])
+            found.append(cols)
+    conn = connect()
+    try:
+        done = set()
+        for cols in found:
+            row = conn.execute('SELECT status FROM file WHERE file_functional_id = ?', (cols[3],)).fetchone()
+            if row and row[0] == 'done':
+                done.add(cols[3])
+    finally:
+        conn.close()
+    return ['%-5s %s %s  %s' % ('done' if cols[3] in done else cols[0], cols[1], cols[2], cols[3]) for cols in found]
+
+def synda_main(args):
+    """
+    the synda command line: search, install, queue, watch
+    """
+    with open(os.path.join(HOME['dir'], 'log', 'calls.log'), 'a') as file:
+        file.write(' '.join(args) + '\n')
+    if not args:
+        print('usage: synda {search,install,queue,watch} ...')
+        return 2
+    if args[0] == 'search':
+        if HOME['conf'].get('latency', 0) > 0:
+            time.sleep(HOME['conf']['latency'])
+        for line in search(args[1:]):
+            print(line)
+        return 0
+    if args[0] == 'install':
+        # the confirmation synda asks for
+        sys.stdin.read()
+        ids = [a for a in args[1:] if not a.startswith('-')]
+        conn = connect()
+        try:
+            for fid in ids:
+                conn.execute('INSERT OR IGNORE INTO file (file_functional_id, status, size) VALUES (?, ?, ?)',
+                             (fid, 'waiting', 0))
+            conn.commit()
+        finally:
+            conn.close()
+        print('%i file(s) will be added to the download queue.' % len(ids))
+        return 0
+    if args[0] == 'queue':
+        conn = connect()
+        try:
+            rows = conn.execute('SELECT status, COUNT(*), SUM(size) FROM file GROUP BY status ORDER BY status').fetchall()
+        finally:
+            conn.close()
+        print('status   count  size')
+        for status, n, total in rows:
+            print('%-10s %6i %12.1f' % (status, n, (total or 0) / 1e6))
+        return 0
+    if args[0] == 'watch':
+        conn = connect()
+        try:
+            rows = conn.execute("SELECT file_functional_id FROM file WHERE status = 'running'").fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            print('No current download')
+        for row in rows:
+            print('running %s' % row[0])
+        return 0
+    print('synda: unknown command %s' % args[0])
+    return 2
+
+def setup(home, index=None, responses=None, startup=0., done=None, latency=0.):
+    """
+    creates the synda home: bin/synda, conf, db, log
+    """
+    for sub in ('bin', 'conf', 'db', 'log'):
+        if not os.path.isdir(os.path.join(home, sub)):
+            os.makedirs(os.path.join(home, sub))
+    with open(os.path.join(home, 'conf', 'standin.json'), 'w') as file:
+        json.dump({'index': index and os.path.abspath(index),
+                   'responses': responses and os.path.abspath(responses),
+                   'startup': startup, 'latency': latency}, file)
+    with open(os.path.join(home, 'conf', 'sdt.conf'), 'w') as file:
+        file.write('[index]\nindexes=localhost (synda_standin.py)\n')
+    exe = os.path.join(home, 'bin', 'synda')
+    with open(exe, 'w') as file:
+        file.write(SCRIPT % {'python': sys.executable, 'home': os.path.abspath(home),
+                             'repo': os.path.dirname(os.path.abspath(__file__))})
+    os.chmod(exe, 0755)
+    conn = sqlite3.connect(os.path.join(home, 'db', 'sdt.db'))
+    try:
+        conn.execute(SCHEMA)
+        if done:
+            with open(done, 'r') as file:
+                for fid in file.read().split():
+                    conn.execute("INSERT OR REPLACE INTO file (file_functional_id, status, size) VALUES (?, 'done', 0)", (fid,))
+        conn.commit()
+    finally:
+        conn.close()
+    return exe
+
+if __name__ == '__main__':
+    # ---- parse command line
+    home = None
+    index = None
+    responses = None
+    startup = 0.
+    latency = 0.
+    done = None
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "setup=", "index=", "responses=",
+                                                      "startup=", "latency=", "done="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(1)
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit(0)
+        elif o == "--setup":
+            home = a
+        elif o == "--index":
+            index = a
+        elif o == "--responses":
+            responses = a
+        elif o == "--startup":
+            startup = float(a)
+        elif o == "--latency":
+            latency = float(a)
+        elif o == "--done":
+            done = a
+    if not home:
+        print >> sys.stderr, "No --setup directory specified. Exiting."
+        usage()
+        sys.exit(1)
+    exe = setup(home, index, responses, startup, done, latency)
+    print('Stand-in synda in %s; use it with PATH=%s:$PATH' % (exe, os.path.dirname(os.path.abspath(exe))))
@@ -0,0 +1,94 @@
+"""
+Shared fixtures of the tests: the repo modules on the path, a small
+local CMIP5 tree and a way to run cmip5datafinder.py on it (the script
+runs on import, so it is always run as a command).
+Run them from the repo root with: python -m pytest tests
+"""
+import sys, os, subprocess
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO not in sys.path:
+    sys.path.insert(0, REPO)
+
+# ---- the functions of cmip5datafinder.py, without running it
+@pytest.fixture(scope='session')
+def cdf():
+    """
+    module with everything cmip5datafinder.py defines before it parses
+    its command line; the globals set from the options (missing_ttl,
+    introspectOn...) are not there, tests set the ones they need
+    """
+    import imp
+    path = os.path.join(REPO, 'cmip5datafinder.py')
+    with open(path, 'r') as file:
+        source = file.read()
+    source = source[:source.index('\n# ---- subcommands, handled before the caching options')]
+    module = imp.new_module('cmip5datafinder')
+    module.__file__ = path
+    exec compile(source, path, 'exec') in module.__dict__
+    return module
+
+# ---- a small local datasource, as on badc
+FILES = [
+    'MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/latest/tro3/tro3_Amon_MPI-ESM-LR_historical_r1i1p1_185001-194912.nc',
+    'MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/latest/tro3/tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-199912.nc',
+    'CSIRO-QCCCE/CSIRO-Mk3-6-0/historical/mon/aerosol/aero/r1i1p1/latest/tro3/tro3_aero_CSIRO-Mk3-6-0_historical_r1i1p1_185001-200512.nc',
+    'NSF-DOE-NCAR/CESM1-BGC/historical/mon/atmos/Amon/r1i1p1/latest/ta/ta_Amon_CESM1-BGC_historical_r1i1p1_185001-200512.nc',
+]
+PARAMS = """CMIP5 MPI-ESM-LR Amon historical r1i1p1 1900 1982 tro3
+CMIP5 MPI-ESM-LR Amon historical r1i1p1 1980 2005 tro3
+CMIP5 CSIRO-Mk3-6-0 aero historical r1i1p1 1900 2005 tro3
+CMIP5 CESM1-BGC Amon historical r1i1p1 1980 2005 ta
+CMIP5 GFDL-CM3 aero historical r1i1p1 1980 2015 tro3
+"""
+
+@pytest.fixture
+def datasource(tmpdir):
+    """
+    (root, work dir with params.txt) of a local tree of FILES
+    """
+    root = tmpdir.mkdir('output1')
+    for name in FILES:
+        root.join(name).ensure().write('x' * 1024)
+    work = tmpdir.mkdir('work')
+    work.join('params.txt').write(PARAMS)
+    return str(root) + '/', work
+
+def run_finder(cwd, *args, **kw):
+    # cmip5datafinder.py args in cwd, its output; fails on an error exit;
+    # synda=SCRIPT puts the directory of that synda first on the PATH
+    env = dict(os.environ)
+    if kw.get('synda'):
+        env['PATH'] = os.path.dirname(kw['synda']) + os.pathsep + env.get('PATH', '')
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO, 'cmip5datafinder.py')] + list(args),
+                            cwd=str(cwd), env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = proc.communicate()[0]
+    assert proc.returncode == 0, out
+    return out
+
+@pytest.fixture
+def finder():
+    """
+    run_finder(cwd, *args, synda=None)
+    """
+    return run_finder
+
+# ---- a stand-in synda (synda_standin.py) that knows two files, one done
+D = 'cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1.v20120315'
+DONE = D + '.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_200001-200512.nc'
+NEW = D + '.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-199912.nc'
+
+@pytest.fixture
+def synda_home(tmpdir):
+    """
+    (synda home, synda script) of the stand-in synda
+    """
+    import synda_standin
+    index = tmpdir.join('index.txt')
+    index.write('new   221.2 MB  %s\ndone  132.7 MB  %s\n' % (NEW, DONE))
+    done = tmpdir.join('done.txt')
+    done.write(DONE + '\n')
+    home = str(tmpdir.join('sdt'))
+    exe = synda_standin.setup(home, index=str(index), done=str(done))
+    return home, exe
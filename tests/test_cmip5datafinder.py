@@ -0,0 +1,149 @@
+"""
+The lookup and merge subcommands of cmip5datafinder.py (lookup_header,
+merge_shards) on caches of a small local datasource
+"""
+import sys, os, subprocess
+
+FINDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cmip5datafinder.py')
+
+def final_cache(work, name='cache_params.txt-local'):
+    return work.join(name).read().splitlines()
+
+def test_lookup(datasource, finder):
+    root, work = datasource
+    finder(work, '-p', 'params.txt', '--datasource', 'local=' + root)
+    lines = final_cache(work)
+    assert len(lines) == 5
+    for line in lines:
+        header, status = line.split()[:2]
+        out = finder(work, 'lookup', 'cache_params.txt-local', header).splitlines()
+        assert out[0].split()[:2] == [header, status]
+        if status == 'missing':
+            assert len(out) == 1
+        else:
+            # the paths of the line, one per line
+            assert [p.strip() for p in out[1:]] == [p.strip(" '[],") for p in line.split(None, 3)[3].split(', ')]
+    out = finder(work, 'lookup', 'cache_params.txt-local', 'CMIP5_MPI-ESM-LR_Amon_historical_r1i1p1_1900_1982_tro3')
+    assert out.split()[1:3] == ['complete', '1.00']
+    assert len(out.splitlines()) == 3
+    assert work.join('cache_params.txt-local.idx').check()
+
+def test_lookup_not_there(datasource, finder):
+    root, work = datasource
+    finder(work, '-p', 'params.txt', '--datasource', 'local=' + root)
+    proc = subprocess.Popen([sys.executable, FINDER, 'lookup', 'cache_params.txt-local',
+                             'CMIP5_NOPE_Amon_historical_r1i1p1_1900_1982_tro3'],
+                            cwd=str(work), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    assert proc.returncode == 1
+    assert 'not in cache_params.txt-local' in err
+
+def test_lookup_after_cache_changed(datasource, finder):
+    root, work = datasource
+    finder(work, '-p', 'params.txt', '--datasource', 'local=' + root)
+    cache = work.join('cache_params.txt-local')
+    lines = cache.read().splitlines()
+    finder(work, 'lookup', 'cache_params.txt-local', lines[0].split()[0])
+    # same size, other order: the index is out of date
+    cache.write('\n'.join([lines[1], lines[0]] + lines[2:]) + '\n')
+    out = finder(work, 'lookup', 'cache_params.txt-local', lines[0].split()[0], lines[1].split()[0])
+    assert [l.split()[0] for l in out.splitlines() if not l.startswith(' ')] == [lines[0].split()[0], lines[1].split()[0]]
+
+def test_merge_shards(datasource, finder):
+    import numpy as np
+    root, work = datasource
+    full = work.mkdir('full')
+    full.join('params.txt').write(work.join('params.txt').read())
+    finder(full, '-p', 'params.txt', '--datasource', 'local=' + root, '--coverage-matrix')
+    for i in (1, 2):
+        finder(work, '-p', 'params.txt', '--datasource', 'local=' + root, '--shard', '%i/2' % i, '--coverage-matrix')
+        assert work.join('shard_%i_of_2' % i).check(dir=1)
+    merged = work.mkdir('merged')
+    out = finder(merged, 'merge', str(work.join('shard_1_of_2')), str(work.join('shard_2_of_2')))
+    assert 'Traceback' not in out
+    # same final cache, in param file order, as one run over everything
+    assert final_cache(merged) == final_cache(full)
+    for name in ('cache_cmip5_local.txt', 'missing_cache_cmip5_local.txt'):
+        assert sorted(merged.join('cache_files_local', name).read().splitlines()) == \
+               sorted(full.join('cache_files_local', name).read().splitlines())
+    header = final_cache(full)[0].split()[0]
+    assert finder(merged, 'lookup', 'cache_params.txt-local', header).split()[0] == header
+    # the coverage matrix and the plots are made again, not joined as text
+    assert not merged.join('cache_params.txt-local.coverage.npz.idx').check()
+    cov = np.load(str(merged.join('cache_params.txt-local.coverage.npz')))
+    ref = np.load(str(full.join('cache_params.txt-local.coverage.npz')))
+    assert sorted(cov.files) == sorted(ref.files)
+    for key in ref.files:
+        assert (cov[key] == ref[key]).all()
+    for plot in ('overall.png', 'missing.png', 'incomplete.png'):
+        if full.join('cache_files_local', plot).check():
+            data = merged.join('cache_files_local', plot).read('rb')
+            assert data.startswith('\x89PNG') and data.count('IEND') == 1
+
+def test_introspect_cut_header(datasource, finder):
+    from test_netcdf_time import cdf1
+    root, work = datasource
+    # one good file, one cut inside an attribute; the others are not netCDF
+    good = os.path.join(root, 'MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/latest/tro3/tro3_Amon_MPI-ESM-LR_historical_r1i1p1_185001-194912.nc')
+    cdf1(good, [15.5 + 365 * i for i in range(100)], 'days since 1850-01-01', 'noleap')
+    cut = os.path.join(root, 'MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/latest/tro3/tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-199912.nc')
+    cdf1(cut, [15.5, 45.5], 'days since 1950-01-01', 'noleap')
+    data = open(cut, 'rb').read()
+    with open(cut, 'wb') as file:
+        file.write(data[:data.index('actual_range') + 20])
+    out = finder(work, '-p', 'params.txt', '--datasource', 'local=' + root, '--introspect')
+    assert 'no time coordinate read from %s' % cut in out
+    assert len(final_cache(work)) == 5
+
+def hold_inflight_and_run(work, root, publish):
+    """
+    runs cmip5datafinder.py while this process holds the .inflight lock
+    of its parameters, as a concurrent run would; that run publishes a
+    new .done if publish. Returns the output of the waiting run.
+    """
+    import fcntl, glob, time
+    done = glob.glob(str(work.join('.cmip5datafinder-*.done')))[0]
+    inflight = done[:-len('.done')] + '.inflight'
+    lf = open(inflight, 'a+')
+    fcntl.lockf(lf, fcntl.LOCK_EX)
+    proc = subprocess.Popen([sys.executable, FINDER, '-p', 'params.txt', '--datasource', 'local=' + root],
+                            cwd=str(work), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    time.sleep(2)
+    if publish:
+        with open(done, 'w') as file:
+            file.write('cache_params.txt-local\n')
+    os.remove(inflight)
+    lf.close()
+    out = proc.communicate()[0]
+    assert proc.returncode == 0, out
+    assert 'waiting for its results' in out
+    return out
+
+def test_single_flight(datasource, finder):
+    root, work = datasource
+    finder(work, '-p', 'params.txt', '--datasource', 'local=' + root)
+    # the lock goes with the run, the .done stays
+    assert not work.listdir('.cmip5datafinder-*.inflight')
+    assert len(work.listdir('.cmip5datafinder-*.done')) == 1
+    out = hold_inflight_and_run(work, root, publish=True)
+    assert 'Reusing the caches of the concurrent run' in out
+    out = hold_inflight_and_run(work, root, publish=False)
+    assert 'The concurrent run did not finish, running now' in out
+    assert not work.listdir('.cmip5datafinder-*.inflight')
+
+def test_verify_skips_dry_run(datasource, synda_home, finder):
+    from conftest import NEW
+    root, work = datasource
+    # only the first half of MPI-ESM-LR is local, the rest is found by synda
+    os.remove(os.path.join(root, 'MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/latest/tro3/tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-199912.nc'))
+    out = finder(work, '-p', 'params.txt', '--datasource', 'local=' + root, '--synda', '--download', '--dryrun', '--verify',
+                 synda=synda_home[1])
+    basename = NEW.split('.', 10)[10]
+    combined = work.join('cache_files_local', 'cache_cmip5_combined_local.txt').read()
+    # the dry run path sits next to the local file of the same filedescriptor
+    assert basename in combined
+    assert 'tro3_Amon_MPI-ESM-LR_historical_r1i1p1_185001-194912.nc' in combined
+    # only the local files are checked, the dry run one is not on disk and not corrupt
+    corrupt = work.join('cache_files_local', 'corrupt_cache_cmip5_local.txt')
+    assert not corrupt.check() or basename not in corrupt.read()
+    assert 'Verified 3 files: 0 ok, 0 corrupt, 3 without checksum' in out
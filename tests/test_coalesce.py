@@ -0,0 +1,52 @@
+"""
+Coalescing of filedescriptors that only differ by their years:
+coalesce_descriptors, member_years and slice_cache_lines
+"""
+from param_files import FileDescriptor
+
+def fd(model, year1, year2, variable='tro3', table='Amon'):
+    return FileDescriptor('CMIP5', model, table, 'historical', 'r1i1p1', year1, year2, variable)
+
+ROWS = [fd('MPI-ESM-LR', 1900, 1950), fd('CESM1-BGC', 1980, 2005, 'ta'),
+        fd('MPI-ESM-LR', 1990, 2015), fd('MPI-ESM-LR', 1980, 2005, 'ta'),
+        fd('MPI-ESM-LR', 1940, 1960)]
+
+def test_coalesce_descriptors(cdf):
+    groups = cdf.coalesce_descriptors(ROWS)
+    # one group per dataset and variable, in first appearance order
+    assert [(u.model, u.variable, u.year1, u.year2) for u, members in groups] == [
+        ('MPI-ESM-LR', 'tro3', 1900, 2015), ('CESM1-BGC', 'ta', 1980, 2005), ('MPI-ESM-LR', 'ta', 1980, 2005)]
+    assert groups[0][1] == [ROWS[0], ROWS[2], ROWS[4]]
+    assert groups[1][1] == [ROWS[1]]
+    assert cdf.coalesce_descriptors([]) == []
+
+def test_member_years(cdf):
+    members = cdf.coalesce_descriptors(ROWS)[0][1]
+    years = cdf.member_years(members)
+    # the gap between the rows is not needed
+    assert min(years) == 1900 and max(years) == 2015
+    assert 1970 not in years and 1989 not in years
+    assert 1960 in years and 1990 in years
+
+def test_slice_cache_lines(cdf):
+    results = cdf.RunResults()
+    groups = dict([(u.header(), members) for u, members in cdf.coalesce_descriptors(ROWS)])
+    union = fd('MPI-ESM-LR', 1900, 2015).header()
+    base = '/sdt/data/cmip5/output1/MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/v1/tro3/tro3_Amon_MPI-ESM-LR_historical_r1i1p1_'
+    results.add_synda(union, base + '190001-194912.nc', 'INSTALLED')
+    results.add_synda(union, base + '195001-199912.nc', 'NOT-YET-INSTALLED')
+    results.add_synda(union, base + '200001-201512.nc', 'INSTALLED')
+    other = fd('CESM1-BGC', 1980, 2005, 'ta').header()
+    results.add_synda(other, '/sdt/data/ta_Amon_CESM1-BGC_historical_r1i1p1_185001-200512.nc', 'INSTALLED')
+    cdf.slice_cache_lines(results, groups)
+    def names(header):
+        return sorted([p.split('_')[-1] for p, s in results.byheader[header].synda or ()])
+    # each row gets the files that overlap its years (sharing only the
+    # last year is not an overlap, see time_handling)
+    assert names(ROWS[0].header()) == ['190001-194912.nc']
+    assert names(ROWS[2].header()) == ['195001-199912.nc', '200001-201512.nc']
+    assert names(ROWS[4].header()) == ['190001-194912.nc', '195001-199912.nc']
+    assert names(other) == ['185001-200512.nc']
+    # the union header is gone unless it is a row itself
+    assert not results.byheader[union].synda
+    assert sorted([s for p, s in results.byheader[ROWS[2].header()].synda]) == ['INSTALLED', 'NOT-YET-INSTALLED']
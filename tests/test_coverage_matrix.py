@@ -0,0 +1,75 @@
+"""
+build_coverage and the queries of coverage_matrix.py on a final cache
+written here
+"""
+from coverage_matrix import build_coverage, load_coverage, complete_for_range, best_run, gap_summary, file_months
+
+def path(model, run, var, y1, y2):
+    exp, ens = run.split('_')
+    return '/badc/%s/%s/%s/%s_Amon_%s_%s_%s_%i01-%i12.nc' % (model, exp, var, var, model, exp, ens, y1, y2)
+
+LINES = [
+    ('CMIP5_A_Amon_historical_r1i1p1_1980_2005_tas', 'complete', 1.0, [path('A', 'historical_r1i1p1', 'tas', 1980, 2005)]),
+    ('CMIP5_A_Amon_historical_r1i1p1_1980_2005_pr', 'complete', 1.0, [path('A', 'historical_r1i1p1', 'pr', 1950, 1999),
+                                                                       path('A', 'historical_r1i1p1', 'pr', 2000, 2005)]),
+    # B has a gap in pr and its tas in another ensemble
+    ('CMIP5_B_Amon_historical_r1i1p1_1980_2005_pr', 'incomplete', 0.7, [path('B', 'historical_r1i1p1', 'pr', 1980, 1989),
+                                                                         path('B', 'historical_r1i1p1', 'pr', 1996, 2005)]),
+    ('CMIP5_B_Amon_historical_r2i1p1_1980_2005_tas', 'complete', 1.0, [path('B', 'historical_r2i1p1', 'tas', 1980, 2005)]),
+    ('CMIP5_C_Amon_historical_r1i1p1_1980_2005_tas', 'missing', 0.0, []),
+]
+
+def write_cache(tmpdir):
+    cache = tmpdir.join('cache_params.txt-local')
+    with open(str(cache), 'w') as file:
+        for header, status, frac, paths in LINES:
+            if paths:
+                file.write('%s %s %.2f %s\n' % (header, status, frac, paths))
+            else:
+                file.write('%s %s\n' % (header, status))
+    return str(cache)
+
+def test_file_months():
+    assert file_months('/x/tas_Amon_A_historical_r1i1p1_185001-200512.nc') == (185001, 200512)
+    assert file_months('/x/tas_Amon_A_historical_r1i1p1_18500101-20051231.nc') == (185001, 200512)
+    assert file_months('/x/areacella_fx_A_historical_r0i0p0.nc') is None
+    assert file_months('/x/a.nc', {'/x/a.nc': (190001, 190012, 'noleap')}) == (190001, 190012)
+
+def test_build_coverage(tmpdir):
+    cache = write_cache(tmpdir)
+    cov = build_coverage(cache)
+    assert list(cov['models']) == ['A', 'B', 'C']
+    assert list(cov['runs']) == ['historical_r1i1p1', 'historical_r2i1p1']
+    assert list(cov['variables']) == ['pr', 'tas']
+    assert cov['months'][0] == 198001 and cov['months'][-1] == 200512 and len(cov['months']) == 26 * 12
+    assert cov['by_run'].shape == (3, 2, 2, 26 * 12)
+    # files outside the years are clipped, gaps stay
+    assert cov['coverage'][0].all()
+    pr_b = cov['coverage'][1, 0]
+    assert pr_b.sum() == 20 * 12
+    assert not pr_b[10 * 12:16 * 12].any()
+    assert not cov['coverage'][2].any()
+    # written next to the cache
+    saved = load_coverage(cache + '.coverage.npz')
+    assert (saved['by_run'] == cov['by_run']).all()
+
+def test_time_ranges(tmpdir):
+    cache = write_cache(tmpdir)
+    # the time coordinate says A's tas stops in 1999
+    tas_a = LINES[0][3][0]
+    cov = build_coverage(cache, time_ranges=lambda paths: {tas_a: (198001, 199912, 'noleap')})
+    assert cov['coverage'][0, 1].sum() == 20 * 12
+
+def test_queries(tmpdir):
+    cov = build_coverage(write_cache(tmpdir))
+    assert complete_for_range(cov, ['tas', 'pr']) == ['A']
+    assert complete_for_range(cov, ['tas']) == ['A', 'B']
+    # B's pr is complete in the 1980s only
+    assert complete_for_range(cov, ['pr'], 1980, 1989) == ['A', 'B']
+    assert complete_for_range(cov, ['nope']) == []
+    assert best_run(cov, 'B', ['tas']) == ('historical_r2i1p1', 1.0)
+    assert best_run(cov, 'Z') == (None, 0.)
+    gaps = dict([((m, v), (f, n)) for m, v, f, n in gap_summary(cov)])
+    assert gaps[('B', 'pr')] == (20 / 26., 1)
+    assert gaps[('A', 'tas')] == (1.0, 0)
+    assert ('C', 'tas') not in gaps
@@ -0,0 +1,103 @@
+"""
+HTTPDownloader of esgf_client.py against a local data node that can
+cut a transfer, ignore Range requests or send no length
+"""
+import os, hashlib, threading, BaseHTTPServer
+import pytest
+from esgf_client import HTTPDownloader
+
+BODY = ''.join(chr(i % 251) for i in range(300000))
+SHA256 = hashlib.sha256(BODY).hexdigest()
+
+class DataNode(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    /cut sends the first 1000 bytes of a full GET and drops the
+    connection, /norange always sends the whole file, /nolen sends
+    part of it without a length
+    """
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        rng = self.headers.get('Range')
+        self.requests.append((self.path, rng))
+        start = int(rng[6:-1]) if rng and self.path != '/norange' else 0
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header('Content-Range', 'bytes %i-%i/%i' % (start, len(BODY) - 1, len(BODY)))
+        if self.path == '/nolen':
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(BODY[:1000])
+            self.close_connection = 1
+            return
+        self.send_header('Content-Length', str(len(BODY) - start))
+        self.end_headers()
+        if self.path == '/cut' and not start:
+            self.wfile.write(BODY[:1000])
+            self.close_connection = 1
+            return
+        self.wfile.write(BODY[start:])
+
+@pytest.fixture
+def node():
+    srv = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), DataNode)
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.daemon = True
+    thread.start()
+    DataNode.requests = []
+    yield 'http://127.0.0.1:%i' % srv.server_address[1]
+    srv.shutdown()
+    srv.server_close()
+
+def test_fetch(node, tmpdir):
+    dest = str(tmpdir.join('data', 'ok.nc'))
+    got, err = HTTPDownloader(str(tmpdir)).fetch(node + '/ok', dest, size=len(BODY), checksum=SHA256)
+    assert err is None
+    assert got == len(BODY)
+    assert open(dest, 'rb').read() == BODY
+    assert not os.path.exists(dest + '.part')
+
+def test_resume_cut_transfer(node, tmpdir):
+    dest = str(tmpdir.join('cut.nc'))
+    got, err = HTTPDownloader(str(tmpdir)).fetch(node + '/cut', dest, checksum=SHA256)
+    assert err is None
+    assert open(dest, 'rb').read() == BODY
+    # the second request asks for the rest only
+    assert DataNode.requests == [('/cut', None), ('/cut', 'bytes=1000-')]
+
+def test_resume_part_file(node, tmpdir):
+    dest = str(tmpdir.join('part.nc'))
+    with open(dest + '.part', 'wb') as file:
+        file.write(BODY[:5000])
+    got, err = HTTPDownloader(str(tmpdir)).fetch(node + '/ok', dest, size=len(BODY), checksum=SHA256)
+    assert err is None
+    assert got == len(BODY) - 5000
+    assert DataNode.requests == [('/ok', 'bytes=5000-')]
+    assert open(dest, 'rb').read() == BODY
+
+def test_range_ignored(node, tmpdir):
+    dest = str(tmpdir.join('norange.nc'))
+    with open(dest + '.part', 'wb') as file:
+        file.write(BODY[:5000])
+    got, err = HTTPDownloader(str(tmpdir)).fetch(node + '/norange', dest, checksum=SHA256)
+    assert err is None
+    assert got == len(BODY)
+    assert open(dest, 'rb').read() == BODY
+
+def test_checksum_mismatch(node, tmpdir):
+    dest = str(tmpdir.join('bad.nc'))
+    got, err = HTTPDownloader(str(tmpdir)).fetch(node + '/ok', dest, checksum='0' * 64)
+    assert err.lower() == 'sha256 checksum mismatch'
+    assert not os.path.exists(dest)
+    assert not os.path.exists(dest + '.part')
+
+def test_length_unknown(node, tmpdir):
+    dest = str(tmpdir.join('nolen.nc'))
+    got, err = HTTPDownloader(str(tmpdir)).fetch(node + '/nolen', dest)
+    assert err == 'length unknown, kept %s.part' % dest
+    assert not os.path.exists(dest)
+    assert os.path.getsize(dest + '.part') == 1000
@@ -0,0 +1,83 @@
+"""
+The store of filedescriptors missing locally and on ESGF:
+record_missing and known_missing
+"""
+import os, time
+import pytest
+from param_files import FileDescriptor
+
+GONE = FileDescriptor('CMIP5', 'MPI-ESM-LR', 'Amon', 'historical', 'r1i1p1', 1980, 2005, 'pr')
+FOUND = FileDescriptor('CMIP5', 'MPI-ESM-LR', 'Amon', 'historical', 'r1i1p1', 1980, 2005, 'tro3')
+
+@pytest.fixture
+def store(cdf, tmpdir, monkeypatch):
+    """
+    (root, institute listing) of a local tree with FOUND's directory;
+    the missing store in tmpdir, default options
+    """
+    root = tmpdir.mkdir('output1')
+    root.join('MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/latest/tro3').ensure(dir=1)
+    monkeypatch.setattr(cdf, 'MISSING_STORE', str(tmpdir.join('missing_store.txt')))
+    monkeypatch.setattr(cdf, 'missing_ttl', 7., raising=False)
+    monkeypatch.setattr(cdf, 'recheckMissing', False, raising=False)
+    return str(root) + '/', ['drwxr-xr-x 2 user group 4096 Jan 1 2016 MPI-M']
+
+def run_results(cdf, missing=(), local=()):
+    # RunResults of a run that found nothing for missing, a file for local
+    results = cdf.RunResults()
+    for fd in missing:
+        results.add_missing(fd.header())
+        results.add_synda_missing(fd.header())
+    for fd in local:
+        results.add_local(fd.header(), results.paths.add('/x/' + fd.header() + '_198001-200512.nc'))
+    return results
+
+def test_record_and_know(cdf, store):
+    root, ls = store
+    cdf.record_missing([GONE, FOUND], run_results(cdf, missing=[GONE], local=[FOUND]), root, ls, '/latest/')
+    saved = cdf.read_missing_store(cdf.MISSING_STORE)
+    assert list(saved) == [(root, GONE.header())]
+    assert cdf.known_missing([GONE, FOUND], root, ls, '/latest/') == set([GONE.header()])
+    # another datasource root does not know it
+    assert cdf.known_missing([GONE], root + 'other/', ls, '/latest/') == set()
+
+def test_local_change(cdf, store, tmpdir):
+    root, ls = store
+    cdf.record_missing([GONE], run_results(cdf, missing=[GONE]), root, ls, '/latest/')
+    # a pr directory appears: the entry no longer holds
+    time.sleep(0.01)
+    tmpdir.join('output1/MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/latest/pr').ensure(dir=1)
+    assert cdf.known_missing([GONE], root, ls, '/latest/') == set()
+
+def test_ttl_and_recheck(cdf, store, monkeypatch):
+    root, ls = store
+    cdf.record_missing([GONE], run_results(cdf, missing=[GONE]), root, ls, '/latest/')
+    monkeypatch.setattr(cdf, 'recheckMissing', True)
+    assert cdf.known_missing([GONE], root, ls, '/latest/') == set()
+    monkeypatch.setattr(cdf, 'recheckMissing', False)
+    # recorded 8 days ago
+    key = (root, GONE.header())
+    old = cdf.read_missing_store(cdf.MISSING_STORE)[key]
+    cdf.write_missing_store(cdf.MISSING_STORE, {key: (time.time() - 8 * 86400., old[1])})
+    assert cdf.known_missing([GONE], root, ls, '/latest/') == set()
+
+def test_drop_when_found(cdf, store):
+    root, ls = store
+    cdf.record_missing([GONE], run_results(cdf, missing=[GONE]), root, ls, '/latest/')
+    # a later run (--recheck-missing) finds it
+    cdf.record_missing([GONE], run_results(cdf, local=[GONE]), root, ls, '/latest/')
+    assert cdf.read_missing_store(cdf.MISSING_STORE) == {}
+
+def test_known_not_recorded_again(cdf, store):
+    root, ls = store
+    results = run_results(cdf)
+    results.add_known_missing(GONE.header(), synda=True)
+    cdf.record_missing([GONE], results, root, ls, '/latest/')
+    assert not os.path.exists(cdf.MISSING_STORE)
+
+def test_ttl_zero(cdf, store, monkeypatch):
+    root, ls = store
+    monkeypatch.setattr(cdf, 'missing_ttl', 0.)
+    cdf.record_missing([GONE], run_results(cdf, missing=[GONE]), root, ls, '/latest/')
+    assert not os.path.exists(cdf.MISSING_STORE)
+    assert cdf.known_missing([GONE], root, ls, '/latest/') == set()
@@ -0,0 +1,80 @@
+"""
+nc_classic_time, nc_time and time_to_yyyymm of netcdf_time.py on
+classic files written here
+"""
+import struct
+import pytest
+from netcdf_time import nc_classic_time, nc_time, time_to_yyyymm, julian_day, julian_date
+
+def pad(s):
+    return s + '\x00' * ((-len(s)) % 4)
+
+def name(s):
+    return struct.pack('>I', len(s)) + pad(s)
+
+def cdf1(path, values, units, calendar, record=False):
+    """
+    CDF-1 file with one time variable (a record variable if record)
+    """
+    hdr = 'CDF\x01' + struct.pack('>I', len(values) if record else 0)
+    hdr += struct.pack('>II', 10, 1) + name('time') + struct.pack('>I', 0 if record else len(values))
+    hdr += struct.pack('>II', 0, 0)
+    atts = struct.pack('>II', 12, 3)
+    atts += name('actual_range') + struct.pack('>II', 6, 2) + struct.pack('>dd', values[0], values[-1])
+    for k, v in (('units', units), ('calendar', calendar)):
+        atts += name(k) + struct.pack('>II', 2, len(v)) + pad(v)
+    var = struct.pack('>II', 11, 1) + name('time') + struct.pack('>II', 1, 0) + atts + struct.pack('>II', 6, 8 * (1 if record else len(values)))
+    begin = len(hdr) + len(var) + 4
+    data = ''.join(struct.pack('>d', v) for v in values)
+    with open(path, 'wb') as file:
+        file.write(hdr + var + struct.pack('>I', begin) + data)
+    return len(hdr + var) + 4
+
+@pytest.mark.parametrize('record', [False, True])
+def test_nc_classic_time(tmpdir, record):
+    path = str(tmpdir.join('t.nc'))
+    cdf1(path, [15.5 + 30 * i for i in range(24)], 'days since 1850-01-01', 'noleap', record)
+    assert nc_classic_time(path) == (15.5, 705.5, 'days since 1850-01-01', 'noleap')
+    assert nc_time(path) == nc_classic_time(path)
+
+def test_truncated_header(tmpdir):
+    path = str(tmpdir.join('t.nc'))
+    cdf1(path, [15.5, 45.5], 'days since 1850-01-01', 'noleap')
+    data = open(path, 'rb').read()
+    # cut inside a number, a text attribute and a length
+    for cut in (data.index('actual_range') + 20, data.index('days') + 5, data.index('units') + 6):
+        with open(path, 'wb') as file:
+            file.write(data[:cut])
+        with pytest.raises(ValueError):
+            nc_classic_time(path)
+
+def test_not_netcdf(tmpdir):
+    path = str(tmpdir.join('t.nc'))
+    tmpdir.join('t.nc').write('not a netCDF file')
+    with pytest.raises(ValueError):
+        nc_time(path)
+
+@pytest.mark.parametrize('value,units,calendar,expected', [
+    (45.5, 'days since 1850-01-01', 'noleap', 185002),
+    (365, 'days since 1850-01-01', '365_day', 185101),
+    (59, 'days since 1852-01-01', 'standard', 185202),
+    (60, 'days since 1852-01-01 00:00:00', 'gregorian', 185203),
+    (59, 'days since 1850-01-01', 'all_leap', 185002),
+    (359.9, 'days since 1850-01-01', '360_day', 185012),
+    (360, 'days since 1850-01-01', '360_day', 185101),
+    (24 * 31, 'hours since 2000-01-01', 'proleptic_gregorian', 200002),
+    # 1900 is a leap year in the julian calendar only
+    (28, 'days since 1900-02-01', 'julian', 190002),
+    (28, 'days since 1900-02-01', 'standard', 190003),
+    # 1850-01-01 to 2000-01-01 is one day longer in the julian calendar
+    (54786, 'days since 1850-01-01', 'julian', 199912),
+    (54786, 'days since 1850-01-01', 'standard', 200001),
+])
+def test_time_to_yyyymm(value, units, calendar, expected):
+    assert time_to_yyyymm(value, units, calendar) == expected
+
+def test_julian_day():
+    # 2000-01-01 (gregorian) is 1999-12-19 julian, JDN 2451545
+    assert julian_day(1999, 12, 19) == 2451545
+    for date in ((1850, 1, 1), (1900, 2, 29), (2005, 12, 31)):
+        assert julian_date(julian_day(*date)) == date
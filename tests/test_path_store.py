@@ -0,0 +1,61 @@
+"""
+PathStore of path_store.py against a plain list of the same paths
+"""
+import pytest
+from path_store import PathStore, split_name
+
+ROOT = '/badc/cmip5/data/cmip5/output1/MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/'
+PATHS = [
+    ROOT + 'latest/tro3/tro3_Amon_MPI-ESM-LR_historical_r1i1p1_185001-194912.nc',
+    ROOT + 'latest/tro3/tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-200512.nc',
+    ROOT + 'v20120315/tro3/tro3_Amon_MPI-ESM-LR_historical_r1i1p1_185001-200512.nc',
+    ROOT + 'latest/ta/ta_Amon_MPI-ESM-LR_historical_r1i1p1_18500101-18991231.nc',
+    '/badc/cmip5/data/cmip5/output1/MPI-M/MPI-ESM-LR/historical/fx/atmos/fx/r0i0p0/latest/areacella/areacella_fx_MPI-ESM-LR_historical_r0i0p0.nc',
+    'relative/tro3_Amon_x_185001-1899.nc',
+    'no_directory.txt',
+    # duplicates are kept
+    ROOT + 'latest/tro3/tro3_Amon_MPI-ESM-LR_historical_r1i1p1_185001-194912.nc',
+]
+
+def test_split_name():
+    assert split_name('tas_Amon_M_e_r1i1p1_185001-200512.nc') == ('tas_Amon_M_e_r1i1p1_', 6, '.nc', 185001, 200512)
+    assert split_name('areacella_fx_M_e_r0i0p0.nc')[1] == 0
+
+def test_round_trip():
+    store = PathStore(PATHS)
+    assert len(store) == len(PATHS)
+    assert list(store) == PATHS
+    assert [store[i] for i in range(len(PATHS))] == PATHS
+    assert store[-1] == PATHS[-1]
+    assert list(store.slice(2, 5)) == PATHS[2:5]
+    with pytest.raises(IndexError):
+        store[len(PATHS)]
+
+def test_add_returns_index():
+    store = PathStore()
+    for i, path in enumerate(PATHS):
+        assert store.add(path) == i
+        assert store[i] == path
+    assert store.name(2) == PATHS[2].rsplit('/', 1)[1]
+
+def test_prefix():
+    store = PathStore(PATHS)
+    for prefix in (ROOT, ROOT + 'latest/', ROOT + 'lat', ROOT + 'latest/tro3/tro3_Amon_MPI-ESM-LR_historical_r1i1p1_1950',
+                   'relative/', 'no_', '/nowhere/'):
+        assert list(store.prefix(prefix)) == [p for p in PATHS if p.startswith(prefix)]
+
+def test_directories():
+    store = PathStore(PATHS)
+    d = store.dir_of(0)
+    assert store.component(d) == 'tro3'
+    assert store.component(store.parent(d)) == 'latest'
+    assert store.dir_of(2) != d
+    assert store.component(store.parent(store.dir_of(2))) == 'v20120315'
+    assert store.dir_of(0) == store.dir_of(7)
+
+def test_with_stem():
+    store = PathStore(PATHS)
+    assert list(store.with_stem('tro3_Amon_MPI-ESM-LR_historical_r1i1p1_')) == [0, 1, 2, 7]
+    # a dated name with no dates of equal width is not a dated stem
+    assert list(store.with_stem('tro3_Amon_x_')) == []
+    assert list(store.with_stem('areacella_fx_MPI-ESM-LR_historical_r0i0p0')) == []
@@ -0,0 +1,62 @@
+"""
+The download budget scheduler, plan_downloads
+"""
+from param_files import FileDescriptor
+
+MB = 1000000
+
+def fd(model, year1, year2):
+    return FileDescriptor('CMIP5', model, 'Amon', 'historical', 'r1i1p1', year1, year2, 'tas')
+
+def plan_of(files, have=None):
+    """
+    plan as synda_dll collects it from (header, year1, year2, MB) per file
+    """
+    plan = {'files': {}, 'have': have or {}}
+    for header, y1, y2, size in files:
+        fname = 'tas_%s_%i01-%i12.nc' % (header.split('_')[1], y1, y2)
+        plan['files'][fname] = ('v1', 'id.' + fname, '/sdt/data/' + fname, size * MB,
+                                set(range(y1, y2 + 1)), header, None)
+    return plan
+
+A = fd('A', 1980, 2005)
+B = fd('B', 1980, 2005)
+C = fd('C', 1980, 2005)
+GROUPS = {A.header(): [A], B.header(): [B], C.header(): [C]}
+FILES = [(A.header(), 1980, 2005, 500),
+         (B.header(), 1980, 1992, 100), (B.header(), 1993, 2005, 100),
+         (C.header(), 1980, 1989, 50), (C.header(), 1990, 2005, 400)]
+
+def test_no_budget(cdf):
+    steps, skipped = cdf.plan_downloads(plan_of(FILES), GROUPS)
+    assert len(steps) == 5 and skipped == []
+    # cheapest filedescriptors to complete first
+    assert [st[4] for st in steps if st[4]] == [[B.header()], [C.header()], [A.header()]]
+
+def test_budget_completes_most(cdf):
+    steps, skipped = cdf.plan_downloads(plan_of(FILES), GROUPS, 700 * MB)
+    # B (200) and C (450) complete; A does not fit, the rest fills nothing
+    assert sum([st[2] for st in steps]) == 650 * MB
+    assert sorted([h for st in steps for h in st[4]]) == sorted([B.header(), C.header()])
+    assert [st[3] for st in skipped] == [A.header()]
+
+def test_budget_partial_coverage(cdf):
+    steps, skipped = cdf.plan_downloads(plan_of(FILES), GROUPS, 260 * MB)
+    # B completes (200); the 60 MB left go to the file with the best coverage per byte
+    assert [st[3] for st in steps[:2]] == [B.header(), B.header()]
+    assert steps[1][4] == [B.header()]
+    assert [st[1].split('/')[-1] for st in steps[2:]] == ['tas_C_198001-198912.nc']
+    assert sum([st[2] for st in steps]) <= 260 * MB
+
+def test_years_on_disk(cdf):
+    # C has the 1990s on disk already: the small file completes it
+    plan = plan_of(FILES, have={C.header(): set(range(1990, 2006))})
+    steps, skipped = cdf.plan_downloads(plan, GROUPS, 60 * MB)
+    assert [(st[1].split('/')[-1], st[4]) for st in steps] == [('tas_C_198001-198912.nc', [C.header()])]
+
+def test_years_not_on_esgf(cdf):
+    # D can not be completed from these files, they still add coverage
+    D = fd('D', 1950, 2005)
+    plan = plan_of([(D.header(), 1980, 2005, 10)])
+    steps, skipped = cdf.plan_downloads(plan, {D.header(): [D]})
+    assert [(st[1].split('/')[-1], st[4]) for st in steps] == [('tas_D_198001-200512.nc', [])]
@@ -0,0 +1,113 @@
+"""
+RunResults, the stages of SyndaPipeline (PipelineStage) and a synda
+run with and without the pipeline
+"""
+import threading
+import pytest
+
+H = 'CMIP5_MPI-ESM-LR_Amon_historical_r1i1p1_1900_1982_tro3'
+
+def test_concurrent_adds(cdf):
+    results = cdf.RunResults()
+    headers = ['CMIP5_M%i_Amon_historical_r1i1p1_1900_2005_tro3' % i for i in range(20)]
+    def add(n):
+        for h in headers:
+            results.add_local(h, results.paths.add('/data/%s/%i.nc' % (h, n)))
+            results.add_missing(h, '%i.nc' % n)
+            results.add_synda(h, '/sdt/%i.nc' % n, 'done')
+    threads = [threading.Thread(target=add, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # nothing lost to a race on the same header
+    assert sorted(results.byheader) == sorted(headers)
+    for h in headers:
+        r = results.byheader[h]
+        assert len(r.local) == 8 and len(r.incomplete) == 8 and len(r.synda) == 8
+    assert len(results.local_lines()) == 8 * 20
+
+def test_lines(cdf):
+    results = cdf.RunResults()
+    # the same file found twice is one line
+    results.add_local(H, results.paths.add('/data/b.nc'))
+    results.add_local(H, results.paths.add('/data/a.nc'))
+    results.add_local(H, results.paths.add('/data/b.nc'))
+    assert results.local_lines() == [H + ' /data/a.nc', H + ' /data/b.nc']
+    gone = H.replace('MPI-ESM-LR', 'GFDL-CM3')
+    results.add_missing(gone)
+    results.add_missing(H, 'b.nc')
+    results.add_missing(H, 'a.nc')
+    assert results.missing_lines() == [gone + ' ERROR-MISSING', H + ' INCOMPLETE a.nc', H + ' INCOMPLETE b.nc']
+    assert results.on_disk(H) == ['a.nc', 'b.nc']
+    assert results.on_disk(gone) == ['dope']
+    assert results.incomplete_files() == {H: ['a.nc', 'b.nc'], gone: ['dope']}
+
+def test_needs_search(cdf):
+    results = cdf.RunResults()
+    results.add_local(H, results.paths.add('/data/a.nc'))
+    assert not results.needs_search(H)
+    obs = 'OBS_ERA-Interim_reanaly_1_T3M_1980_2005_ta'
+    results.add_missing(obs)
+    # only CMIP5 is searched for, and not what the missing store knows
+    assert not results.needs_search(obs)
+    gone = H.replace('MPI-ESM-LR', 'GFDL-CM3')
+    results.add_missing(gone)
+    assert results.missing_headers() == [gone]
+    results.add_known_missing(gone, synda=True)
+    assert results.missing_headers() == []
+    assert results.byheader[gone].synda_missing is True
+
+def test_installed_files(cdf, tmpdir):
+    results = cdf.RunResults()
+    there = tmpdir.join('there.nc').ensure()
+    results.add_local(H, results.paths.add('/data/a.nc'))
+    results.add_synda(H, str(there), 'done')
+    results.add_synda(H, str(tmpdir.join('gone.nc')), 'done')
+    results.add_synda(H, str(tmpdir.join('dry.nc')), 'NOT-YET-INSTALLED')
+    assert results.installed_files() == [(H, '/data/a.nc'), (H, str(there))]
+
+def test_stage_passes_on(cdf):
+    first = cdf.PipelineStage('first', 2, nthreads=3)
+    second = cdf.PipelineStage('second', 1)
+    done = []
+    first.start(lambda n: [n * 10], second)
+    second.start(done.append)
+    for n in range(20):
+        first.queue.put(n)
+    first.stop()
+    second.stop()
+    assert sorted(done) == range(0, 200, 10)
+    assert first.items == 20 and second.items == 20
+    # a queue of 1 is never deeper than 1
+    assert second.depth_max <= 1
+
+def test_stage_raises_on_stop(cdf):
+    stage = cdf.PipelineStage('failing', 1)
+    def work(n):
+        if n == 3:
+            raise ValueError('three')
+    stage.start(work)
+    # the items after the failure do not block the sender
+    for n in range(10):
+        stage.queue.put(n)
+    with pytest.raises(ValueError):
+        stage.stop()
+
+def test_pipeline_same_as_serial(datasource, synda_home, finder):
+    import os
+    root, work = datasource
+    os.remove(os.path.join(root, 'MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/latest/tro3/tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-199912.nc'))
+    caches = {}
+    for queue in ('0', '1'):
+        run = work.mkdir('queue_' + queue)
+        run.join('params.txt').write(work.join('params.txt').read())
+        finder(run, '-p', 'params.txt', '--datasource', 'local=' + root, '--synda', '--download', '--dryrun',
+               '--pipeline-queue', queue, synda=synda_home[1])
+        caches[queue] = dict([(name, run.join('cache_files_local', name).read())
+                              for name in sorted(os.listdir(str(run.join('cache_files_local'))))
+                              if name.endswith('.txt')])
+        caches[queue]['final'] = run.join('cache_params.txt-local').read()
+    assert caches['0'] == caches['1']
+    # the dry run found the file removed from the datasource
+    assert '_195001-199912.nc NOT-YET-INSTALLED' in caches['1']['cache_cmip5_synda_local.txt']
@@ -0,0 +1,70 @@
+"""
+SyndaDB and SyndaAPI of synda_adapter.py on a stand-in synda home
+(synda_standin.py)
+"""
+import sys, os
+import pytest
+from synda_adapter import SyndaDB, SyndaAPI, ThreadOutput, load_api, open_synda
+from conftest import DONE, NEW
+
+def test_status(synda_home):
+    db = SyndaDB(os.path.join(synda_home[0], 'db', 'sdt.db'))
+    assert db.status(DONE) == 'done'
+    assert db.status(NEW) is None
+    assert db.statuses([DONE, NEW]) == {DONE: 'done'}
+    # more ids than SQLite takes in one query
+    assert db.statuses([DONE] + ['x%i' % i for i in range(1200)]) == {DONE: 'done'}
+    assert db.checksums([DONE]) == {}
+    db.close()
+
+def test_not_a_synda_database(tmpdir):
+    import sqlite3
+    path = str(tmpdir.join('other.db'))
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE file (name TEXT)')
+    conn.close()
+    with pytest.raises(ValueError):
+        SyndaDB(path)
+
+def test_api_restores_stdout(synda_home):
+    stdout = sys.stdout
+    api = SyndaAPI(load_api(synda_home[1]), synda_home[1])
+    assert isinstance(sys.stdout, ThreadOutput)
+    out, returncode = api.run('search -f CMIP5 MPI-ESM-LR Amon historical r1i1p1 tro3')
+    assert returncode == 0
+    assert DONE in out and NEW in out
+    api.close()
+    assert sys.stdout is stdout
+    # twice is fine
+    api.close()
+    assert sys.stdout is stdout
+
+def test_api_shared_stdout(synda_home):
+    stdout = sys.stdout
+    first = SyndaAPI(load_api(synda_home[1]), synda_home[1])
+    second = SyndaAPI(load_api(synda_home[1]), synda_home[1])
+    first.close()
+    # still in use by the second one
+    assert isinstance(sys.stdout, ThreadOutput)
+    second.close()
+    assert sys.stdout is stdout
+
+def test_open_synda(synda_home):
+    stdout = sys.stdout
+    synda = open_synda(synda_home[1])
+    assert synda.caller.kind == 'api'
+    assert synda.file_status(DONE) == 'done'
+    assert synda.file_status(NEW) is None
+    synda.close()
+    assert sys.stdout is stdout
+
+def test_several_datasources(datasource, synda_home, finder):
+    root, work = datasource
+    other = work.dirpath().mkdir('other')
+    # each datasource runs in its own process with its own synda
+    out = finder(work, '-p', 'params.txt', '--synda', '--datasource', 'a=' + root,
+                 '--datasource', 'b=' + str(other) + '/', synda=synda_home[1])
+    assert 'Traceback' not in out
+    for d in ('a', 'b'):
+        assert work.join('cache_files_' + d, 'cache_cmip5_synda_%s.txt' % d).check()
+    assert 'search' in open(os.path.join(synda_home[0], 'log', 'calls.log')).read()
@@ -0,0 +1,42 @@
+"""
+parse_synda_search and latest_versions of synda_records.py
+"""
+from synda_records import parse_synda_search, latest_versions
+
+D = 'cmip5.output1.MPI-M.MPI-ESM-LR.historical.mon.atmos.Amon.r1i1p1'
+SEARCH = """new   221.2 MB  %(d)s.v20120315.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-199912.nc
+done  132.7 MB  %(d)s.v20120315.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_200001-200512.nc
+new   100.0 MB  %(d)s.v20110101.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_195001-199912.nc
+done  1.5 GB  %(d)s.v20130101.tro3_Amon_MPI-ESM-LR_historical_r1i1p1_200001-200512.nc
+No dataset found
+new   10.0 MB  %(d)s.v20120315.areacella_fx_MPI-ESM-LR_historical_r0i0p0.nc
+""" % {'d': D}
+
+def test_parse_synda_search():
+    recs = list(parse_synda_search(SEARCH.splitlines(True)))
+    # the message line is not a file
+    assert len(recs) == 5
+    rec = recs[0]
+    assert rec.status == 'new'
+    assert rec.size == 221200000
+    assert (rec.model, rec.experiment, rec.table, rec.ensemble) == ('MPI-ESM-LR', 'historical', 'Amon', 'r1i1p1')
+    assert rec.version == 'v20120315'
+    assert rec.variable == 'tro3'
+    assert (rec.year1, rec.year2) == (1950, 1999)
+    assert rec.dataset_id() == D + '.v20120315'
+    assert rec.local_path('/sdt/data/') == '/sdt/data/cmip5/output1/MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/v20120315/tro3/' + rec.basename
+    assert recs[3].size == 1500000000
+    # no time range
+    assert (recs[4].year1, recs[4].year2) == (None, None)
+
+def test_latest_versions():
+    recs = latest_versions(parse_synda_search(SEARCH.splitlines(True)))
+    # one record per file, newest version, in search order
+    assert [(r.basename.split('_')[-1], r.version) for r in recs] == [
+        ('195001-199912.nc', 'v20120315'),
+        ('200001-200512.nc', 'v20130101'),
+        ('r0i0p0.nc', 'v20120315')]
+    assert recs[1].status == 'done'
+
+def test_latest_versions_empty():
+    assert latest_versions([]) == []